@@ -0,0 +1,37 @@
+"""item image variants
+
+Adds ``item_images.variants``, a JSON map of responsive WebP variant paths
+keyed by target width. Rows uploaded before this revision keep a NULL map and
+clients fall back to the original file.
+
+Revision ID: 20261018_0002
+Revises: 20260420_0001
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+from sqlalchemy.dialects import sqlite
+
+revision: str = "20261018_0002"
+down_revision: Union[str, None] = "20260420_0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_columns(table: str) -> set[str]:
+    bind = op.get_bind()
+    return {col["name"] for col in inspect(bind).get_columns(table)}
+
+
+def upgrade() -> None:
+    if "variants" not in _existing_columns("item_images"):
+        op.add_column("item_images", sa.Column("variants", sqlite.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("item_images") as batch_op:
+        batch_op.drop_column("variants")
@@ -0,0 +1,63 @@
+"""content-addressed image blobs
+
+Adds the ``image_blobs`` table (one row per distinct SHA-256 of uploaded
+image bytes, with a reference count) and ``item_images.blob_sha256``.
+Existing images keep a NULL digest and continue to own their flat file.
+
+Revision ID: 20261018_0003
+Revises: 20261018_0002
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+from sqlalchemy.dialects import sqlite
+
+revision: str = "20261018_0003"
+down_revision: Union[str, None] = "20261018_0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_tables() -> set[str]:
+    return set(inspect(op.get_bind()).get_table_names())
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def _existing_indexes(table: str) -> set[str]:
+    return {idx["name"] for idx in inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade() -> None:
+    if "image_blobs" not in _existing_tables():
+        op.create_table(
+            "image_blobs",
+            sa.Column("sha256", sa.String(length=64), nullable=False),
+            sa.Column("filename", sa.String(), nullable=True),
+            sa.Column("file_path", sa.String(), nullable=True),
+            sa.Column("size_bytes", sa.Integer(), nullable=True),
+            sa.Column("ref_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("variants", sqlite.JSON(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("sha256"),
+        )
+
+    # SQLite cannot add a foreign key to an existing table without a rebuild;
+    # the relationship is enforced by the ORM model.
+    if "blob_sha256" not in _existing_columns("item_images"):
+        op.add_column("item_images", sa.Column("blob_sha256", sa.String(length=64), nullable=True))
+    if "ix_item_images_blob_sha256" not in _existing_indexes("item_images"):
+        op.create_index("ix_item_images_blob_sha256", "item_images", ["blob_sha256"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_item_images_blob_sha256", table_name="item_images")
+    with op.batch_alter_table("item_images") as batch_op:
+        batch_op.drop_column("blob_sha256")
+    op.drop_table("image_blobs")
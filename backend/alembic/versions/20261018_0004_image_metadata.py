@@ -0,0 +1,47 @@
+"""item image display metadata
+
+Adds width, height, byte size, source format, dominant color and BlurHash
+columns to ``item_images``. Existing rows are filled in by
+``scripts/backfill_image_metadata.py``.
+
+Revision ID: 20261018_0004
+Revises: 20261018_0003
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0004"
+down_revision: Union[str, None] = "20261018_0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NEW_COLUMNS = (
+    ("width", sa.Integer()),
+    ("height", sa.Integer()),
+    ("byte_size", sa.Integer()),
+    ("format", sa.String()),
+    ("dominant_color", sa.String()),
+    ("blurhash", sa.String()),
+)
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    existing = _existing_columns("item_images")
+    for name, type_ in NEW_COLUMNS:
+        if name not in existing:
+            op.add_column("item_images", sa.Column(name, type_, nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("item_images") as batch_op:
+        for name, _ in reversed(NEW_COLUMNS):
+            batch_op.drop_column(name)
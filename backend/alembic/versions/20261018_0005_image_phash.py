@@ -0,0 +1,34 @@
+"""item image perceptual hash
+
+Adds the ``phash`` column used for near-duplicate detection. Existing rows
+are filled in by ``scripts/backfill_image_metadata.py``.
+
+Revision ID: 20261018_0005
+Revises: 20261018_0004
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0005"
+down_revision: Union[str, None] = "20261018_0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    if "phash" not in _existing_columns("item_images"):
+        op.add_column("item_images", sa.Column("phash", sa.String(16), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("item_images") as batch_op:
+        batch_op.drop_column("phash")
@@ -0,0 +1,49 @@
+"""resumable upload sessions
+
+Adds the ``upload_sessions`` table backing ``/api/uploads``.
+
+Revision ID: 20261018_0006
+Revises: 20261018_0005
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0006"
+down_revision: Union[str, None] = "20261018_0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_tables() -> set[str]:
+    return set(inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    if "upload_sessions" in _existing_tables():
+        return
+    op.create_table(
+        "upload_sessions",
+        sa.Column("id", sa.String(length=36), nullable=False),
+        sa.Column("owner_id", sa.String(length=36), nullable=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("item_id", sa.String(length=36), nullable=True),
+        sa.Column("filename", sa.String(), nullable=True),
+        sa.Column("size_bytes", sa.Integer(), nullable=False),
+        sa.Column("received_bytes", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["owner_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["item_id"], ["items.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_upload_sessions_owner_id", "upload_sessions", ["owner_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_upload_sessions_owner_id", table_name="upload_sessions")
+    op.drop_table("upload_sessions")
@@ -0,0 +1,43 @@
+"""backup job progress
+
+Adds the progress columns updated while a backup runs in the background.
+
+Revision ID: 20261018_0007
+Revises: 20261018_0006
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0007"
+down_revision: Union[str, None] = "20261018_0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = (
+    sa.Column("progress_items", sa.Integer(), nullable=False, server_default="0"),
+    sa.Column("progress_bytes", sa.Integer(), nullable=False, server_default="0"),
+    sa.Column("total_bytes", sa.Integer(), nullable=True),
+    sa.Column("updated_at", sa.DateTime(), nullable=True),
+)
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    existing = _existing_columns("backups")
+    for column in COLUMNS:
+        if column.name not in existing:
+            op.add_column("backups", column)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("backups") as batch_op:
+        for column in reversed(COLUMNS):
+            batch_op.drop_column(column.name)
@@ -0,0 +1,47 @@
+"""incremental backups
+
+Adds ``backups.kind`` and ``backups.parent_id`` linking an incremental
+backup to the backup it was taken against. Existing backups are full.
+
+Revision ID: 20261018_0008
+Revises: 20261018_0007
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0008"
+down_revision: Union[str, None] = "20261018_0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def _existing_indexes(table: str) -> set[str]:
+    return {index["name"] for index in inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade() -> None:
+    existing = _existing_columns("backups")
+    if "kind" not in existing:
+        op.add_column("backups", sa.Column("kind", sa.String(), nullable=False, server_default="full"))
+    if "parent_id" not in existing:
+        # SQLite cannot add a foreign key constraint in place; the ORM
+        # model carries the relationship.
+        op.add_column("backups", sa.Column("parent_id", sa.String(length=36), nullable=True))
+    if "ix_backups_parent_id" not in _existing_indexes("backups"):
+        op.create_index("ix_backups_parent_id", "backups", ["parent_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_backups_parent_id", table_name="backups")
+    with op.batch_alter_table("backups") as batch_op:
+        batch_op.drop_column("parent_id")
+        batch_op.drop_column("kind")
@@ -0,0 +1,65 @@
+"""backup repository
+
+Adds the chunk and pack tables of the deduplicating backup repository and
+``backups.storage`` telling zip archives from repository snapshots.
+
+Revision ID: 20261018_0009
+Revises: 20261018_0008
+Create Date: 2026-10-18
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import inspect
+
+revision: str = "20261018_0009"
+down_revision: Union[str, None] = "20261018_0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing_tables() -> set[str]:
+    return set(inspect(op.get_bind()).get_table_names())
+
+
+def _existing_columns(table: str) -> set[str]:
+    return {col["name"] for col in inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    tables = _existing_tables()
+    if "backup_packs" not in tables:
+        op.create_table(
+            "backup_packs",
+            sa.Column("id", sa.String(length=32), nullable=False),
+            sa.Column("size_bytes", sa.Integer(), nullable=False),
+            sa.Column("live_bytes", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+    if "backup_chunks" not in tables:
+        op.create_table(
+            "backup_chunks",
+            sa.Column("sha256", sa.String(length=64), nullable=False),
+            sa.Column("pack_id", sa.String(length=32), nullable=False),
+            sa.Column("offset", sa.Integer(), nullable=False),
+            sa.Column("length", sa.Integer(), nullable=False),
+            sa.Column("raw_length", sa.Integer(), nullable=False),
+            sa.Column("compressed", sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column("ref_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.ForeignKeyConstraint(["pack_id"], ["backup_packs.id"]),
+            sa.PrimaryKeyConstraint("sha256"),
+        )
+        op.create_index("ix_backup_chunks_pack_id", "backup_chunks", ["pack_id"])
+    if "storage" not in _existing_columns("backups"):
+        op.add_column("backups", sa.Column("storage", sa.String(), nullable=False, server_default="zip"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("backups") as batch_op:
+        batch_op.drop_column("storage")
+    op.drop_index("ix_backup_chunks_pack_id", table_name="backup_chunks")
+    op.drop_table("backup_chunks")
+    op.drop_table("backup_packs")
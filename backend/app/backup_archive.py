@@ -0,0 +1,549 @@
+"""Backup archive writer.
+
+``write_archive`` builds a backup ZIP in one pass without staging anything
+on disk:
+
+1. ``data.json`` is streamed into its zip entry item by item while the
+   owner's items are read from the database in batches, so neither the
+   JSON document nor the item list is ever held in memory whole.
+2. Each image blob referenced along the way is then added to ``images/``
+   straight from ``UPLOAD_DIR``; blobs shared by several images are
+   archived once.
+3. ``manifest.json`` records every item's ``updated_at`` and image keys
+   (blob SHA-256, or filename for pre-blob uploads).
+4. ``summary.json`` holds the archive's type and counts, so an uploaded
+   archive can be validated without parsing ``data.json``.
+
+Given the parent backup's manifest, the same writer produces an
+incremental archive: only items whose manifest entry changed are written,
+and only images no earlier archive in the chain holds. The manifest is
+always complete, so items missing from it were deleted. ``merge_chain``
+folds a full backup and its incrementals into one synthetic full archive,
+which is how chains are restored and compacted. It reads ``data.json``
+back with ``iter_items``, the incremental parser restores use too.
+
+``progress`` is called after every item and image with the running
+``ArchiveStats``; callers throttle as they see fit.
+
+The archive is written under a ``.tmp`` name and renamed into place when
+complete, so a crash never leaves a truncated ``.zip`` that looks valid
+(the file GC sweeps the leftovers).
+
+Compression is chosen per entry: JPEG/PNG/WebP/HEIC images are already
+compressed and are stored as is, while the JSON entries are deflated at
+``BACKUP_DEFLATE_LEVEL``. ``write_tar_archive`` writes the same entries as
+a zstd-compressed tar instead when the optional ``zstandard`` package is
+installed. ``scripts/benchmark_backup.py`` compares the modes.
+"""
+
+import codecs
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import String, type_coerce
+from sqlalchemy.orm import Session
+
+from . import models, storage
+from .settings import settings
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the deployment
+    zstandard = None
+
+FORMAT_VERSION = "1.0"
+DATA_ENTRY = "data.json"
+MANIFEST_ENTRY = "manifest.json"
+SUMMARY_ENTRY = "summary.json"
+IMAGES_DIR = "images"
+
+ITEM_BATCH_SIZE = 500
+READ_BYTES = 1024 * 1024
+# Formats whose payload is already compressed; deflating them again costs
+# CPU for next to no gain.
+PRECOMPRESSED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif", ".gif", ".avif")
+# Tar headers need an entry's size up front, so streamed entries are
+# spooled; this much stays in memory before spilling to BACKUP_DIR.
+TAR_SPOOL_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class ArchiveStats:
+    items_scanned: int = 0
+    item_count: int = 0
+    image_count: int = 0
+    image_bytes: int = 0
+    size_bytes: int = 0
+
+
+ProgressCallback = Callable[[ArchiveStats], None]
+
+
+def is_precompressed(name: str) -> bool:
+    return name.lower().endswith(PRECOMPRESSED_EXTENSIONS)
+
+
+def open_entry(zf: zipfile.ZipFile, name: str):
+    """Open a streamed entry in ``zf``, stored or deflated by its name."""
+    # The entry's size is unknown up front, so allow it to pass 4 GiB.
+    if is_precompressed(name):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        return zf.open(info, "w", force_zip64=True)
+    return zf.open(name, "w", force_zip64=True)
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def item_record(item: models.Item) -> Dict:
+    return {
+        "id": str(item.id),
+        "name": item.name,
+        "category": item.category,
+        "location": item.location,
+        "brand": item.brand,
+        "model_number": item.model_number,
+        "serial_number": item.serial_number,
+        "purchase_date": _isoformat(item.purchase_date),
+        "purchase_price": item.purchase_price,
+        "current_value": item.current_value,
+        "warranty_expiration": _isoformat(item.warranty_expiration),
+        "notes": item.notes,
+        "custom_fields": item.custom_fields,
+        "created_at": _isoformat(item.created_at),
+        "updated_at": _isoformat(item.updated_at),
+        "images": [],
+    }
+
+
+def image_record(image: models.ItemImage) -> Dict:
+    return {
+        "id": str(image.id),
+        "filename": image.filename,
+        "sha256": image.blob_sha256,
+        **{name: getattr(image, name) for name in models.IMAGE_METADATA_FIELDS},
+        "created_at": _isoformat(image.created_at),
+    }
+
+
+def image_key(sha256: Optional[str], filename: str) -> str:
+    return sha256 or filename
+
+
+def manifest_blobs(manifest: Dict[str, Dict]) -> set:
+    return {key for entry in manifest.values() for key in entry["images"]}
+
+
+def _manifest_from_data(data: Dict) -> Dict[str, Dict]:
+    return {
+        item["id"]: {
+            "updated_at": item.get("updated_at"),
+            "images": sorted(image_key(image.get("sha256"), image["filename"]) for image in item.get("images", [])),
+        }
+        for item in data["items"]
+    }
+
+
+def read_manifest(zip_path: str) -> Dict[str, Dict]:
+    """The item manifest of an archive, derived from ``data.json`` for
+    archives written before manifests existed."""
+    with zipfile.ZipFile(zip_path) as zf:
+        if MANIFEST_ENTRY in zf.namelist():
+            return json.loads(zf.read(MANIFEST_ENTRY))["items"]
+        return _manifest_from_data(json.loads(zf.read(DATA_ENTRY)))
+
+
+def owner_items(db: Session, owner_id, batch_size: int = ITEM_BATCH_SIZE):
+    """Yield ``(item, images)`` for every item of ``owner_id``.
+
+    Items are read in keyset-paginated batches with one ``IN`` query for
+    each batch's images, so memory is bounded by ``batch_size``.
+    """
+    last_id = ""
+    while True:
+        # Keyset on the raw id string; see upload_layout.migrate_legacy_images.
+        batch = (
+            db.query(models.Item)
+            .filter(models.Item.owner_id == owner_id, type_coerce(models.Item.id, String) > last_id)
+            .order_by(models.Item.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return
+        last_id = str(batch[-1].id)
+        images: Dict = {}
+        rows = (
+            db.query(models.ItemImage)
+            .filter(models.ItemImage.item_id.in_([item.id for item in batch]))
+            .order_by(models.ItemImage.created_at)
+        )
+        for image in rows:
+            images.setdefault(image.item_id, []).append(image)
+        for item in batch:
+            yield item, images.get(item.id, [])
+
+
+def _item_manifest(item: models.Item, images: List[models.ItemImage]) -> Dict:
+    return {
+        "updated_at": _isoformat(item.updated_at),
+        "images": sorted(image_key(image.blob_sha256, image.filename) for image in images),
+    }
+
+
+def _write_data(
+    db: Session,
+    owner_id,
+    entry,
+    header: Dict,
+    stats: ArchiveStats,
+    manifest: Dict[str, Dict],
+    parent: Optional[Dict[str, Dict]],
+    progress: Optional[ProgressCallback],
+) -> List[Tuple[str, str]]:
+    """Stream ``data.json`` into ``entry``; returns the image files to add."""
+    files: Dict[str, str] = {}
+    known_blobs = manifest_blobs(parent) if parent is not None else set()
+    # Splice the streamed array in as the last key of the header object.
+    entry.write(json.dumps(header)[:-1].encode() + b', "items": [')
+    for item, images in owner_items(db, owner_id):
+        stats.items_scanned += 1
+        present = [image for image in images if os.path.exists(storage.absolute_path(image.file_path))]
+        item_manifest = _item_manifest(item, present)
+        manifest[str(item.id)] = item_manifest
+        if parent is not None and parent.get(str(item.id)) == item_manifest:
+            if progress is not None:
+                progress(stats)
+            continue
+        record = item_record(item)
+        for image in present:
+            stats.image_count += 1
+            # Images that share a blob share a filename.
+            if image_key(image.blob_sha256, image.filename) not in known_blobs:
+                files.setdefault(image.filename, storage.absolute_path(image.file_path))
+            record["images"].append(image_record(image))
+        if stats.item_count:
+            entry.write(b",\n")
+        entry.write(json.dumps(record).encode())
+        stats.item_count += 1
+        if progress is not None:
+            progress(stats)
+    entry.write(b"]}\n")
+    return list(files.items())
+
+
+@contextmanager
+def new_archive(zip_path: str) -> Iterator[zipfile.ZipFile]:
+    """Open ``zip_path`` for writing under a temporary name, renamed into
+    place only if the block completes."""
+    tmp_path = f"{zip_path}.tmp"
+    try:
+        with zipfile.ZipFile(
+            tmp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=settings.BACKUP_DEFLATE_LEVEL
+        ) as zf:
+            yield zf
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _header(kind: str, parent_id=None) -> Dict:
+    header = {"created_at": datetime.utcnow().isoformat(), "version": FORMAT_VERSION, "type": kind}
+    if parent_id is not None:
+        header["parent_id"] = str(parent_id)
+    return header
+
+
+class ZipSink:
+    """Where ``write_entries`` puts archive entries: a ZIP file.
+
+    Other backup formats (see ``backup_repository``) provide the same three
+    methods.
+    """
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.zf = zf
+
+    def open(self, name: str):
+        return open_entry(self.zf, name)
+
+    def add_file(self, name: str, source_path: str) -> int:
+        compress_type = zipfile.ZIP_STORED if is_precompressed(name) else None
+        self.zf.write(source_path, name, compress_type=compress_type)
+        return self.zf.getinfo(name).file_size
+
+    def writestr(self, name: str, data: bytes) -> None:
+        self.zf.writestr(name, data)
+
+
+class TarSink:
+    """``write_entries`` sink for a streamed tar file."""
+
+    def __init__(self, tar: tarfile.TarFile, spool_dir: str):
+        self.tar = tar
+        self.spool_dir = spool_dir
+
+    def _info(self, name: str, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o600
+        return info
+
+    @contextmanager
+    def open(self, name: str):
+        with tempfile.SpooledTemporaryFile(max_size=TAR_SPOOL_BYTES, dir=self.spool_dir) as spool:
+            yield spool
+            size = spool.tell()
+            spool.seek(0)
+            self.tar.addfile(self._info(name, size), spool)
+
+    def add_file(self, name: str, source_path: str) -> int:
+        with open(source_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.tar.addfile(self._info(name, size), f)
+        return size
+
+    def writestr(self, name: str, data: bytes) -> None:
+        with self.open(name) as entry:
+            entry.write(data)
+
+
+def _summary(kind: str, stats: ArchiveStats) -> bytes:
+    return json.dumps({
+        "version": FORMAT_VERSION,
+        "type": kind,
+        "item_count": stats.item_count,
+        "image_count": stats.image_count,
+        "image_bytes": stats.image_bytes,
+    }).encode()
+
+
+def write_entries(
+    db: Session,
+    owner_id,
+    sink,
+    progress: Optional[ProgressCallback] = None,
+    parent: Optional[Dict[str, Dict]] = None,
+    parent_id=None,
+) -> ArchiveStats:
+    """Write ``data.json``, the images, ``manifest.json`` and
+    ``summary.json`` to ``sink``."""
+    stats = ArchiveStats()
+    manifest: Dict[str, Dict] = {}
+    header = _header("full" if parent is None else "incremental", parent_id)
+    with sink.open(DATA_ENTRY) as entry:
+        files = _write_data(db, owner_id, entry, header, stats, manifest, parent, progress)
+    for filename, source_path in files:
+        stats.image_bytes += sink.add_file(f"{IMAGES_DIR}/{filename}", source_path)
+        if progress is not None:
+            progress(stats)
+    sink.writestr(MANIFEST_ENTRY, json.dumps({"items": manifest}).encode())
+    sink.writestr(SUMMARY_ENTRY, _summary(header["type"], stats))
+    return stats
+
+
+def write_archive(
+    db: Session,
+    owner_id,
+    zip_path: str,
+    progress: Optional[ProgressCallback] = None,
+    parent: Optional[Dict[str, Dict]] = None,
+    parent_id=None,
+) -> ArchiveStats:
+    """Write ``owner_id``'s inventory and images to ``zip_path``.
+
+    With ``parent`` (the parent backup's manifest) only what changed since
+    is written, making the archive an incremental on top of ``parent_id``.
+    """
+    with new_archive(zip_path) as zf:
+        stats = write_entries(db, owner_id, ZipSink(zf), progress, parent, parent_id)
+    stats.size_bytes = os.path.getsize(zip_path)
+    return stats
+
+
+def write_tar_archive(
+    db: Session,
+    owner_id,
+    tar_path: str,
+    progress: Optional[ProgressCallback] = None,
+) -> ArchiveStats:
+    """Write ``owner_id``'s inventory and images as a zstd-compressed tar."""
+    if zstandard is None:
+        raise RuntimeError("tar.zst backups need the zstandard package")
+    tmp_path = f"{tar_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as raw:
+            compressor = zstandard.ZstdCompressor(level=settings.BACKUP_ZSTD_LEVEL, threads=-1)
+            with compressor.stream_writer(raw, closefd=False) as out, tarfile.open(fileobj=out, mode="w|") as tar:
+                stats = write_entries(db, owner_id, TarSink(tar, os.path.dirname(tar_path)), progress)
+        os.replace(tmp_path, tar_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    stats.size_bytes = os.path.getsize(tar_path)
+    return stats
+
+
+@contextmanager
+def open_tar_archive(tar_path: str) -> Iterator[tarfile.TarFile]:
+    """Open a tar.zst backup for one sequential pass over its members."""
+    if zstandard is None:
+        raise RuntimeError("tar.zst backups need the zstandard package")
+    with open(tar_path, "rb") as raw, zstandard.ZstdDecompressor().stream_reader(raw) as src:
+        with tarfile.open(fileobj=src, mode="r|") as tar:
+            yield tar
+
+
+_WHITESPACE = " \t\r\n"
+
+
+class _JSONStream:
+    """Incremental reader over a UTF-8 JSON byte stream."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(READ_BYTES)
+        self._eof = not data
+        self._buffer = self._buffer[self._pos:] + self._utf8.decode(data, final=self._eof)
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character, or ``""`` at the end."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid data.json: expected {char!r}, found {found or 'end of file'!r}")
+        self._pos += 1
+
+    def skip(self, char: str) -> bool:
+        if self.peek() == char:
+            self._pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as exc:
+                if not self._fill():
+                    raise ValueError(f"Invalid data.json: {exc}") from None
+                continue
+            # A number at the end of the buffer may continue in the next read.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_items(f: BinaryIO, header: Optional[Dict] = None) -> Iterator[Dict]:
+    """Yield the elements of ``data.json``'s ``items`` array one at a time.
+
+    Other top-level keys are collected into ``header`` as they are passed.
+    """
+    stream = _JSONStream(f)
+    found = False
+    stream.expect("{")
+    if not stream.skip("}"):
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "items":
+                found = True
+                stream.expect("[")
+                if not stream.skip("]"):
+                    while True:
+                        yield stream.value()
+                        if not stream.skip(","):
+                            break
+                    stream.expect("]")
+            else:
+                value = stream.value()
+                if header is not None:
+                    header[key] = value
+            if not stream.skip(","):
+                break
+        stream.expect("}")
+    if not found:
+        raise ValueError("Invalid backup data structure: no items array")
+
+
+def merge_chain(chain_paths: List[str], zip_path: str) -> ArchiveStats:
+    """Fold a full archive and its incrementals (oldest first) into one
+    synthetic full archive at ``zip_path`` describing the newest state.
+
+    The archives are read newest first and each item is written as soon as
+    its latest copy turns up, so only item ids and image names are kept in
+    memory.
+    """
+    manifest = read_manifest(chain_paths[-1])
+    written = set()
+    needed = set()
+    stats = ArchiveStats()
+    with new_archive(zip_path) as zf:
+        with open_entry(zf, DATA_ENTRY) as entry:
+            entry.write(json.dumps(_header("full"))[:-1].encode() + b', "items": [')
+            for path in reversed(chain_paths):
+                with zipfile.ZipFile(path) as source, source.open(DATA_ENTRY) as f:
+                    for item in iter_items(f):
+                        if item["id"] not in manifest or item["id"] in written:
+                            continue
+                        if written:
+                            entry.write(b",\n")
+                        entry.write(json.dumps(item).encode())
+                        written.add(item["id"])
+                        stats.item_count += 1
+                        stats.image_count += len(item["images"])
+                        needed.update(f"{IMAGES_DIR}/{image['filename']}" for image in item["images"])
+            entry.write(b"]}\n")
+        if len(written) < len(manifest):
+            missing = next(item_id for item_id in manifest if item_id not in written)
+            raise ValueError(f"Backup chain is missing {len(manifest) - len(written)} items, e.g. {missing}")
+
+        # Newest first: the latest copy of each image wins.
+        for path in reversed(chain_paths):
+            with zipfile.ZipFile(path) as source:
+                names = sorted(needed.intersection(source.namelist()))
+                for name in names:
+                    with source.open(name) as src, open_entry(zf, name) as dst:
+                        shutil.copyfileobj(src, dst, READ_BYTES)
+                    stats.image_bytes += source.getinfo(name).file_size
+                needed.difference_update(names)
+        zf.writestr(MANIFEST_ENTRY, json.dumps({"items": manifest}))
+        zf.writestr(SUMMARY_ENTRY, _summary("full", stats))
+    stats.size_bytes = os.path.getsize(zip_path)
+    return stats
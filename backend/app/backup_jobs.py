@@ -0,0 +1,217 @@
+"""Backups as background jobs.
+
+``POST /api/backups`` only records a ``Backup`` row in ``in_progress`` with
+the item/image totals and an estimate of the image bytes to archive, then
+hands ``run_backup`` to a worker thread and returns. The job writes the
+archive with its own database session and saves progress on the row at
+most every ``PROGRESS_INTERVAL_SECONDS``, so ``GET /backups/{id}/progress``
+and the ``/events`` stream read it like any other row, from any process.
+
+Incremental jobs are written against the owner's latest completed backup
+(see ``backup_archive``). When that would make the chain longer than
+``BACKUP_MAX_CHAIN_LENGTH``, the new archive is compacted into a synthetic
+full backup, so restores never replay an unbounded chain.
+
+Repository backups (``storage="repository"``, see ``backup_repository``)
+are written as deduplicated snapshots instead; they are always full, since
+unchanged data already costs nothing. ``storage="tar.zst"`` backups are
+full zstd-compressed tar archives.
+
+A server restart kills running jobs; ``fail_interrupted`` marks their rows
+``failed`` at startup so they do not stay ``in_progress`` forever.
+"""
+
+import logging
+import os
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import List, Optional, Union
+
+from sqlalchemy import func
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import backup_archive, backup_repository, models
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+
+def backup_chain(db: Session, backup: models.Backup) -> List[models.Backup]:
+    """``backup`` and the backups it depends on, oldest (the full) first.
+
+    Raises ValueError if a link or its archive is missing.
+    """
+    chain = [backup]
+    while chain[0].parent_id is not None:
+        parent = db.query(models.Backup).filter(models.Backup.id == chain[0].parent_id).first()
+        if parent is None or parent in chain:
+            raise ValueError(f"Backup chain of {backup.id} is broken at {chain[0].id}")
+        chain.insert(0, parent)
+    for link in chain:
+        if link.status != "completed" or not link.file_path or not os.path.exists(link.file_path):
+            raise ValueError(f"Backup {link.id} in the chain of {backup.id} is not available")
+    return chain
+
+
+def latest_completed(db: Session, owner_id) -> Optional[models.Backup]:
+    return (
+        db.query(models.Backup)
+        .filter(
+            models.Backup.owner_id == owner_id,
+            models.Backup.status == "completed",
+            models.Backup.storage == "zip",
+        )
+        .order_by(models.Backup.created_at.desc())
+        .first()
+    )
+
+
+def start_backup(db: Session, owner_id, incremental: bool = False, storage: str = "zip") -> models.Backup:
+    """Record a new ``in_progress`` backup for ``owner_id``.
+
+    An incremental backup falls back to a full one when there is nothing to
+    build on. ``storage`` is ``"zip"``, ``"repository"`` or ``"tar.zst"``.
+    """
+    parent = latest_completed(db, owner_id) if incremental and storage == "zip" else None
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    extension = ".tar.zst" if storage == "tar.zst" else ".zip"
+    filename = f"backup_{owner_id}_{timestamp}{extension}"
+    taken = db.query(models.Backup.id).filter(models.Backup.filename == filename).first()
+    if taken or os.path.exists(os.path.join(str(settings.backup_path), filename)):
+        # Two backups in the same second must not share an archive.
+        filename = f"backup_{owner_id}_{timestamp}_{uuid.uuid4().hex[:8]}{extension}"
+    owner_images = (
+        db.query(models.ItemImage)
+        .join(models.Item, models.ItemImage.item_id == models.Item.id)
+        .filter(models.Item.owner_id == owner_id)
+    )
+    distinct_blobs = owner_images.with_entities(models.ItemImage.blob_sha256).distinct().subquery()
+    total_bytes = db.query(func.coalesce(func.sum(models.ImageBlob.size_bytes), 0)).filter(
+        models.ImageBlob.sha256.in_(db.query(distinct_blobs.c.blob_sha256))
+    ).scalar()
+    backup_id = uuid.uuid4()
+    file_path = os.path.join(str(settings.backup_path), filename)
+    if storage == "repository":
+        file_path = backup_repository.snapshot_path(backup_id)
+    backup = models.Backup(
+        id=backup_id,
+        owner_id=owner_id,
+        filename=filename,
+        file_path=file_path,
+        size_bytes=0,
+        item_count=db.query(models.Item).filter(models.Item.owner_id == owner_id).count(),
+        image_count=owner_images.count(),
+        status="in_progress",
+        progress_items=0,
+        progress_bytes=0,
+        total_bytes=total_bytes,
+        kind="incremental" if parent is not None else "full",
+        parent_id=parent.id if parent is not None else None,
+        storage=storage,
+    )
+    db.add(backup)
+    db.commit()
+    db.refresh(backup)
+    return backup
+
+
+def run_backup(bind: Union[Engine, Connection], backup_id) -> None:
+    """Write the archive for ``backup_id``; meant for a worker thread."""
+    db = Session(bind=bind, autoflush=False)
+    backup = None
+    try:
+        backup = db.query(models.Backup).filter(models.Backup.id == backup_id).one()
+        last_saved = time.monotonic()
+
+        def report(stats: backup_archive.ArchiveStats) -> None:
+            nonlocal last_saved
+            now = time.monotonic()
+            if now - last_saved < PROGRESS_INTERVAL_SECONDS:
+                return
+            last_saved = now
+            backup.progress_items = stats.items_scanned
+            backup.progress_bytes = stats.image_bytes
+            db.commit()
+
+        logger.info("starting %s backup %s for user %s", backup.kind, backup.id, backup.owner_id)
+        chain, parent_manifest = _load_parent(db, backup)
+        if backup.storage == "repository":
+            stats = backup_repository.write_snapshot(db, backup, progress=report)
+        elif backup.storage == "tar.zst":
+            stats = backup_archive.write_tar_archive(db, backup.owner_id, backup.file_path, progress=report)
+        else:
+            stats = backup_archive.write_archive(
+                db, backup.owner_id, backup.file_path, progress=report,
+                parent=parent_manifest, parent_id=backup.parent_id,
+            )
+        backup.progress_items = stats.items_scanned
+        backup.progress_bytes = stats.image_bytes
+        if chain and len(chain) + 1 > settings.BACKUP_MAX_CHAIN_LENGTH:
+            paths = [link.file_path for link in chain] + [backup.file_path]
+            stats = backup_archive.merge_chain(paths, backup.file_path)
+            backup.kind = "full"
+            backup.parent_id = None
+            logger.info("compacted backup %s into a synthetic full of %d archives", backup.id, len(paths))
+        backup.size_bytes = stats.size_bytes
+        backup.item_count = stats.item_count
+        backup.image_count = stats.image_count
+        backup.total_bytes = backup.progress_bytes
+        backup.status = "completed"
+        db.commit()
+        logger.info("backup %s completed (%d bytes)", backup.id, stats.size_bytes)
+    except Exception as exc:
+        logger.exception("error during backup creation")
+        db.rollback()
+        if backup is not None:
+            backup.status = "failed"
+            backup.error_message = str(exc)
+            db.commit()
+    finally:
+        db.close()
+
+
+def _load_parent(db: Session, backup: models.Backup):
+    """The parent chain and manifest of an incremental ``backup``.
+
+    Switches ``backup`` to a full backup if the parent cannot be used.
+    """
+    if backup.parent_id is None:
+        return [], None
+    try:
+        parent = db.query(models.Backup).filter(models.Backup.id == backup.parent_id).one()
+        chain = backup_chain(db, parent)
+        return chain, backup_archive.read_manifest(parent.file_path)
+    except (SQLAlchemyError, ValueError, KeyError, OSError, zipfile.BadZipFile) as exc:
+        logger.warning("backup %s: parent unusable (%s), taking a full backup", backup.id, exc)
+        backup.kind = "full"
+        backup.parent_id = None
+        db.commit()
+        return [], None
+
+
+def fail_interrupted(db: Session) -> int:
+    """Mark backups left ``in_progress`` by a previous process as failed."""
+    count = db.query(models.Backup).filter(models.Backup.status == "in_progress").update(
+        {"status": "failed", "error_message": "Interrupted by a server restart"},
+        synchronize_session=False,
+    )
+    db.commit()
+    return count
+
+
+def recover_on_startup(session_factory) -> None:
+    db = session_factory()
+    try:
+        count = fail_interrupted(db)
+        if count:
+            logger.warning("marked %d interrupted backups as failed", count)
+    except SQLAlchemyError as exc:
+        logger.warning("could not check for interrupted backups: %s", exc)
+    finally:
+        db.close()
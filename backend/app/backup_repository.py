@@ -0,0 +1,620 @@
+"""Deduplicating repository format for backups.
+
+A repository backup holds the same entries as a zip backup (``data.json``,
+``images/*``, ``manifest.json``), but each entry is cut into content-defined
+chunks that are stored once across every snapshot of every user. Layout
+under ``BACKUP_DIR/repository``:
+
+- ``packs/ab/<pack id>.pack``: chunks appended back to back; JSON chunks are
+  zlib-compressed, image chunks are stored as is (see
+  ``backup_archive.is_precompressed``).
+- ``snapshots/<backup id>.json``: the snapshot manifest, mapping each entry
+  to its size and ordered chunk digests. ``Backup.file_path`` points here.
+
+Chunks and packs are tracked in ``backup_chunks`` / ``backup_packs``. A
+chunk's ``ref_count`` is the number of snapshots using it. Deleting a
+snapshot decrements its chunks, drops those that reach zero, deletes packs
+with nothing live left and rewrites packs that are mostly dead, so storage
+tracks the unique data still referenced.
+
+Chunk boundaries come from a gear rolling hash with normalized chunking
+(as in FastCDC): a cut is made where the hash of the last few dozen bytes
+matches a mask, so an edit only changes the chunks around it. Hashing runs
+in Python, so each new image is chunked once: later snapshots of the same
+owner reuse the chunk list recorded for an image's filename, which for blob
+files is their content hash.
+
+Writes and prunes are serialized by a process-wide lock so a prune never
+drops a chunk that a running snapshot has decided to reuse. Rebuilding a
+snapshot (downloads and restores) holds ``_packs`` shared for as long as
+it reads, and a prune takes it exclusively, so packs are never repacked or
+unlinked under a reader. New snapshots only append packs and need neither.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from . import backup_archive, models
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+REPOSITORY_DIR = "repository"
+SNAPSHOT_VERSION = 1
+
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK = 1024 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+READ_BYTES = 1024 * 1024
+# Packs whose live bytes fall below this fraction are rewritten on prune.
+REPACK_BELOW = 0.5
+QUERY_BATCH = 500
+
+_M64 = (1 << 64) - 1
+_BITS = AVG_CHUNK.bit_length() - 1
+# Stricter mask before AVG_CHUNK, looser after: chunk sizes cluster at AVG.
+_MASK_SMALL = ((1 << (_BITS + 2)) - 1) << 16
+_MASK_LARGE = ((1 << (_BITS - 2)) - 1) << 16
+_GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256))
+
+class _ReadWriteLock:
+    """Any number of readers, or one writer."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+_lock = threading.Lock()
+_packs = _ReadWriteLock()
+
+
+def repository_path() -> str:
+    return os.path.join(str(settings.backup_path), REPOSITORY_DIR)
+
+
+def snapshot_path(backup_id) -> str:
+    return os.path.join(repository_path(), "snapshots", f"{backup_id}.json")
+
+
+def pack_path(pack_id: str) -> str:
+    return os.path.join(repository_path(), "packs", pack_id[:2], f"{pack_id}.pack")
+
+
+def cut_point(data, start: int, end: int) -> int:
+    """Length of the chunk that starts at ``data[start]``, ending by ``end``."""
+    available = end - start
+    if available <= MIN_CHUNK:
+        return available
+    gear = _GEAR
+    h = 0
+    normal = start + min(available, AVG_CHUNK)
+    for i in range(start + MIN_CHUNK, normal):
+        h = ((h << 1) + gear[data[i]]) & _M64
+        if not h & _MASK_SMALL:
+            return i + 1 - start
+    for i in range(normal, end):
+        h = ((h << 1) + gear[data[i]]) & _M64
+        if not h & _MASK_LARGE:
+            return i + 1 - start
+    return available
+
+
+class Chunker:
+    """Writable stream that hands content-defined chunks to ``emit``.
+
+    Boundaries depend only on the bytes, not on how they were written.
+    """
+
+    def __init__(self, emit):
+        self._emit = emit
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        start = 0
+        while len(self._buffer) - start >= MAX_CHUNK:
+            length = cut_point(self._buffer, start, start + MAX_CHUNK)
+            self._emit(bytes(self._buffer[start:start + length]))
+            start += length
+        if start:
+            del self._buffer[:start]
+        return len(data)
+
+    def close(self) -> None:
+        start = 0
+        while start < len(self._buffer):
+            length = cut_point(self._buffer, start, len(self._buffer))
+            self._emit(bytes(self._buffer[start:start + length]))
+            start += length
+        self._buffer.clear()
+
+
+class _PackWriter:
+    """Appends new chunks to pack files.
+
+    Rows are only handed to the session by ``add_rows`` once every pack is
+    sealed, so progress commits during a snapshot never publish chunks whose
+    pack is not on disk yet.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.bytes_written = 0
+        self._seen: set = set()
+        self._chunks: List[models.BackupChunk] = []
+        self._packs: List[models.BackupPack] = []
+        self._sealed: List[str] = []
+        self._file = None
+        self._pack_id: Optional[str] = None
+        self._size = 0
+
+    def put(self, digest: str, data: bytes, compress: bool) -> None:
+        if digest in self._seen:
+            return
+        self._seen.add(digest)
+        if self.db.get(models.BackupChunk, digest) is not None:
+            return
+        payload = zlib.compress(data, settings.BACKUP_DEFLATE_LEVEL) if compress else data
+        compressed = compress and len(payload) < len(data)
+        if not compressed:
+            payload = data
+        if self._file is None:
+            self._open()
+        self._file.write(payload)
+        self._chunks.append(models.BackupChunk(
+            sha256=digest,
+            pack_id=self._pack_id,
+            offset=self._size,
+            length=len(payload),
+            raw_length=len(data),
+            compressed=compressed,
+            ref_count=0,
+        ))
+        self._size += len(payload)
+        self.bytes_written += len(payload)
+        if self._size >= settings.BACKUP_PACK_BYTES:
+            self.seal()
+
+    def _open(self) -> None:
+        self._pack_id = uuid.uuid4().hex
+        path = pack_path(self._pack_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(f"{path}.tmp", "wb")
+        self._size = 0
+
+    def seal(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        path = pack_path(self._pack_id)
+        os.replace(f"{path}.tmp", path)
+        self._sealed.append(path)
+        self._packs.append(models.BackupPack(id=self._pack_id, size_bytes=self._size, live_bytes=self._size))
+
+    def add_rows(self) -> None:
+        self.db.add_all(self._packs)
+        self.db.flush()
+        self.db.add_all(self._chunks)
+        self.db.flush()
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._sealed.append(f"{pack_path(self._pack_id)}.tmp")
+            self._file = None
+        for path in self._sealed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class _EntryWriter:
+    def __init__(self, sink: "_RepositorySink", name: str):
+        self._sink = sink
+        self._name = name
+        self._chunks: List[str] = []
+        self._size = 0
+        compress = not backup_archive.is_precompressed(name)
+        self._chunker = Chunker(lambda data: self._emit(data, compress))
+
+    def _emit(self, data: bytes, compress: bool) -> None:
+        digest = hashlib.sha256(data).hexdigest()
+        self._sink.packer.put(digest, data, compress)
+        self._chunks.append(digest)
+
+    def write(self, data) -> int:
+        self._size += len(data)
+        return self._chunker.write(data)
+
+    def close(self) -> None:
+        self._chunker.close()
+        self._sink.entries[self._name] = {"size": self._size, "chunks": self._chunks}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if exc_info[0] is None:
+            self.close()
+
+
+class _RepositorySink:
+    """``backup_archive`` sink that chunks entries into the repository."""
+
+    def __init__(self, packer: _PackWriter, reusable: Dict[str, Dict]):
+        self.packer = packer
+        self.entries: Dict[str, Dict] = {}
+        self._reusable = reusable
+
+    def open(self, name: str) -> _EntryWriter:
+        return _EntryWriter(self, name)
+
+    def add_file(self, name: str, source_path: str) -> int:
+        entry = self._reusable.get(name)
+        if entry is None:
+            with self.open(name) as writer, open(source_path, "rb") as f:
+                while data := f.read(READ_BYTES):
+                    writer.write(data)
+            entry = self.entries[name]
+        self.entries[name] = entry
+        return entry["size"]
+
+    def writestr(self, name: str, data: bytes) -> None:
+        with self.open(name) as writer:
+            writer.write(data)
+
+
+def _batches(values: Iterable[str]):
+    values = list(values)
+    for start in range(0, len(values), QUERY_BATCH):
+        yield values[start:start + QUERY_BATCH]
+
+
+def _snapshot_digests(entries: Dict[str, Dict]) -> set:
+    return {digest for entry in entries.values() for digest in entry["chunks"]}
+
+
+def _load_entries(path: str) -> Dict[str, Dict]:
+    with open(path) as f:
+        return json.load(f)["entries"]
+
+
+def _reusable_entries(db: Session, owner_id) -> Dict[str, Dict]:
+    """Image chunk lists from the owner's latest snapshot still fully stored."""
+    previous = (
+        db.query(models.Backup)
+        .filter(
+            models.Backup.owner_id == owner_id,
+            models.Backup.storage == "repository",
+            models.Backup.status == "completed",
+        )
+        .order_by(models.Backup.created_at.desc())
+        .first()
+    )
+    if previous is None:
+        return {}
+    try:
+        entries = _load_entries(previous.file_path)
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("cannot reuse snapshot %s: %s", previous.id, exc)
+        return {}
+    images = {
+        name: entry for name, entry in entries.items()
+        if name.startswith(f"{backup_archive.IMAGES_DIR}/")
+    }
+    stored = set()
+    for batch in _batches(_snapshot_digests(images)):
+        stored.update(row[0] for row in db.query(models.BackupChunk.sha256).filter(
+            models.BackupChunk.sha256.in_(batch)
+        ))
+    return {name: entry for name, entry in images.items() if stored.issuperset(entry["chunks"])}
+
+
+def _adjust_refs(db: Session, digests: Iterable[str], delta: int) -> None:
+    for batch in _batches(digests):
+        db.query(models.BackupChunk).filter(models.BackupChunk.sha256.in_(batch)).update(
+            {models.BackupChunk.ref_count: models.BackupChunk.ref_count + delta},
+            synchronize_session=False,
+        )
+
+
+def _recount_refs(db: Session, excluded_id) -> set:
+    """Reset every chunk's ref_count to the number of completed snapshots,
+    other than ``excluded_id``, that list it. Returns the unreferenced ones."""
+    counts: Dict[str, int] = {}
+    others = db.query(models.Backup.file_path).filter(
+        models.Backup.storage == "repository",
+        models.Backup.status == "completed",
+        models.Backup.id != excluded_id,
+    )
+    for (path,) in others:
+        try:
+            entries = _load_entries(path)
+        except FileNotFoundError:
+            continue
+        for digest in _snapshot_digests(entries):
+            counts[digest] = counts.get(digest, 0) + 1
+    changed, unreferenced = [], set()
+    for digest, ref_count in db.query(models.BackupChunk.sha256, models.BackupChunk.ref_count):
+        count = counts.get(digest, 0)
+        if count != ref_count:
+            changed.append({"sha256": digest, "ref_count": count})
+        if count == 0:
+            unreferenced.add(digest)
+    if changed:
+        db.execute(update(models.BackupChunk), changed)
+    return unreferenced
+
+
+def _write_json(path: str, data: Dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_snapshot(
+    db: Session,
+    backup: models.Backup,
+    progress: Optional[backup_archive.ProgressCallback] = None,
+) -> backup_archive.ArchiveStats:
+    """Store ``backup``'s owner's inventory as a snapshot at ``backup.file_path``.
+
+    ``size_bytes`` of the result is what the snapshot added to the
+    repository, not its logical size.
+    """
+    with _lock:
+        packer = _PackWriter(db)
+        try:
+            sink = _RepositorySink(packer, _reusable_entries(db, backup.owner_id))
+            stats = backup_archive.write_entries(db, backup.owner_id, sink, progress)
+            packer.seal()
+            packer.add_rows()
+            _adjust_refs(db, _snapshot_digests(sink.entries), +1)
+            _write_json(backup.file_path, {
+                "version": SNAPSHOT_VERSION,
+                "created_at": datetime.utcnow().isoformat(),
+                "backup_id": str(backup.id),
+                "entries": sink.entries,
+            })
+            db.commit()
+        except BaseException:
+            db.rollback()
+            packer.abort()
+            if os.path.exists(backup.file_path):
+                os.remove(backup.file_path)
+            raise
+    stats.size_bytes = packer.bytes_written
+    return stats
+
+
+def materialize(db: Session, backup: models.Backup, zip_path: str) -> None:
+    """Rebuild the zip archive of a repository snapshot at ``zip_path``."""
+    with backup_archive.new_archive(zip_path) as zf:
+        for _ in _write_zip(db, backup, zf):
+            pass
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink that collects what ``zipfile`` writes until drained."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def iter_zip(db: Session, backup: models.Backup) -> Iterator[bytes]:
+    """Rebuild a snapshot's zip archive as a stream of byte strings, at most
+    one chunk at a time in memory and nothing on disk."""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(
+        buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=settings.BACKUP_DEFLATE_LEVEL
+    ) as zf:
+        for _ in _write_zip(db, backup, zf):
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+
+def _write_zip(db: Session, backup: models.Backup, zf: zipfile.ZipFile) -> Iterator[None]:
+    """Write a snapshot's entries into ``zf``, yielding after each chunk."""
+    with _packs.read():
+        entries = _load_entries(backup.file_path)
+        rows: Dict[str, models.BackupChunk] = {}
+        for batch in _batches(_snapshot_digests(entries)):
+            for row in db.query(models.BackupChunk).filter(models.BackupChunk.sha256.in_(batch)):
+                rows[row.sha256] = row
+        packs: Dict[str, object] = {}
+        try:
+            for name, entry in entries.items():
+                with backup_archive.open_entry(zf, name) as out:
+                    for digest in entry["chunks"]:
+                        row = rows.get(digest)
+                        if row is None:
+                            raise ValueError(f"Snapshot {backup.id} references missing chunk {digest}")
+                        f = packs.get(row.pack_id)
+                        if f is None:
+                            f = packs[row.pack_id] = open(pack_path(row.pack_id), "rb")
+                        f.seek(row.offset)
+                        data = f.read(row.length)
+                        if row.compressed:
+                            data = zlib.decompress(data)
+                        if hashlib.sha256(data).hexdigest() != digest:
+                            raise ValueError(f"Chunk {digest} in pack {row.pack_id} is corrupt")
+                        out.write(data)
+                        yield
+        finally:
+            for f in packs.values():
+                f.close()
+
+
+def _repack(db: Session, pack: models.BackupPack) -> str:
+    """Copy ``pack``'s live chunks into a new pack; returns the old path."""
+    new_id = uuid.uuid4().hex
+    new_path = pack_path(new_id)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    chunks = (
+        db.query(models.BackupChunk)
+        .filter(models.BackupChunk.pack_id == pack.id)
+        .order_by(models.BackupChunk.offset)
+        .all()
+    )
+    offset = 0
+    with open(pack_path(pack.id), "rb") as src, open(f"{new_path}.tmp", "wb") as dst:
+        for chunk in chunks:
+            src.seek(chunk.offset)
+            dst.write(src.read(chunk.length))
+            chunk.offset = offset
+            offset += chunk.length
+    os.replace(f"{new_path}.tmp", new_path)
+    db.add(models.BackupPack(id=new_id, size_bytes=offset, live_bytes=offset))
+    db.flush()
+    for chunk in chunks:
+        chunk.pack_id = new_id
+    db.delete(pack)
+    return pack_path(pack.id)
+
+
+def delete_snapshot(db: Session, backup: models.Backup) -> None:
+    """Delete ``backup`` and release its chunks, pruning dead data."""
+    with _lock:
+        with _packs.write():
+            try:
+                entries = _load_entries(backup.file_path)
+            except FileNotFoundError:
+                # Which chunks the snapshot held is lost with its manifest, so
+                # count every chunk's references again from the others.
+                logger.warning("snapshot %s has no manifest; recounting chunk references", backup.id)
+                digests = _recount_refs(db, backup.id)
+            else:
+                digests = _snapshot_digests(entries)
+                _adjust_refs(db, digests, -1)
+            freed: Dict[str, int] = {}
+            for batch in _batches(digests):
+                dead = db.query(models.BackupChunk).filter(
+                    models.BackupChunk.sha256.in_(batch), models.BackupChunk.ref_count <= 0
+                )
+                for chunk in dead:
+                    freed[chunk.pack_id] = freed.get(chunk.pack_id, 0) + chunk.length
+                    db.delete(chunk)
+            db.flush()
+            doomed = []
+            for pack_id, freed_bytes in freed.items():
+                pack = db.get(models.BackupPack, pack_id)
+                if pack is None:
+                    continue
+                pack.live_bytes -= freed_bytes
+                if pack.live_bytes <= 0:
+                    db.delete(pack)
+                    doomed.append(pack_path(pack_id))
+                elif pack.live_bytes < pack.size_bytes * REPACK_BELOW:
+                    doomed.append(_repack(db, pack))
+            db.delete(backup)
+            db.commit()
+            for path in doomed + [backup.file_path]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    logger.info("deleted snapshot %s, pruned %d packs", backup.id, len(doomed))
+
+
+def repository_stats(db: Session, owner_id) -> Dict[str, int]:
+    """What ``owner_id``'s completed snapshots take up in the repository.
+
+    Chunks are counted once however many snapshots use them, and whether
+    another user shares them is not revealed. ``logical_bytes`` is what the
+    same snapshots would take as separate archives.
+    """
+    snapshots = (
+        db.query(models.Backup)
+        .filter(
+            models.Backup.owner_id == owner_id,
+            models.Backup.storage == "repository",
+            models.Backup.status == "completed",
+        )
+        .all()
+    )
+    digests, logical = set(), 0
+    for backup in snapshots:
+        try:
+            entries = _load_entries(backup.file_path)
+        except FileNotFoundError:
+            continue
+        digests |= _snapshot_digests(entries)
+        logical += sum(entry["size"] for entry in entries.values())
+    packs, stored = set(), 0
+    for batch in _batches(digests):
+        for pack_id, length in db.query(models.BackupChunk.pack_id, models.BackupChunk.length).filter(
+            models.BackupChunk.sha256.in_(batch)
+        ):
+            packs.add(pack_id)
+            stored += length
+    return {
+        "snapshots": len(snapshots),
+        "packs": len(packs),
+        "chunks": len(digests),
+        "stored_bytes": stored,
+        "logical_bytes": logical,
+    }
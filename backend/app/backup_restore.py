@@ -0,0 +1,638 @@
+"""Streaming backup restore.
+
+``restore_archive`` reads a backup straight out of its archive instead of
+extracting it:
+
+1. Each ``images/*`` entry is streamed into a staging area under
+   ``UPLOAD_DIR/.staging`` while it is hashed, then renamed to its blob
+   path there (or dropped if the blob is already stored). Staged files move
+   into the store only once the items are written, just before the caller
+   commits, so the file GC cannot take them while the restore runs. Tar
+   archives are read in one sequential pass, so their ``data.json`` is
+   spooled to a temp file on the way.
+2. ``data.json`` is parsed incrementally by ``iter_items``, one item at a
+   time, and items and images are inserted ``RESTORE_BATCH_SIZE`` at a
+   time with one executemany per table and one blob upsert per batch.
+
+Disk use is the archive plus the images it adds to the blob store;
+memory is bounded by the batch size and the archive's image count.
+
+A replace restore writes the items into TEMP staging tables first, which
+keeps the database's write lock free while the archive is read. The
+staged rows are re-read and checked against the counts and checksum taken
+while writing, and every blob they use must be on disk. Only then are the
+user's items replaced in one short swap: bulk release, ``INSERT ...
+SELECT`` from staging, and a final count check. A failure at any step
+rolls back with the live items untouched.
+
+A merge restore (``mode="merge"``) keeps the archived item ids and diffs
+each batch against the live rows, so its writes are proportional to what
+changed since the backup.
+
+The caller owns the transaction; nothing is committed here. Archives do
+not carry WebP variants, so once the restore is committed the caller runs
+``render_missing_variants`` for blobs the restore had to create.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import backup_archive, imaging, models, storage
+from .backup_archive import iter_items
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+READ_BYTES = 1024 * 1024
+RESTORE_BATCH_SIZE = 500
+SUMMARY_MAX_BYTES = 1024 * 1024
+
+@dataclass
+class ArchiveSummary:
+    kind: str
+    item_count: int
+    image_count: int
+
+
+def _from_summary(summary: Dict) -> ArchiveSummary:
+    kind = summary["type"]
+    counts = (summary["item_count"], summary["image_count"])
+    if not isinstance(kind, str) or not all(type(count) is int and count >= 0 for count in counts):
+        raise ValueError("Invalid summary.json")
+    return ArchiveSummary(kind, *counts)
+
+
+def summarize_archive(zip_path: str) -> ArchiveSummary:
+    """Validate a backup zip and count its items and images, reading only
+    the central directory and ``summary.json`` or ``data.json``.
+
+    Image entries are never read here; their CRCs are checked when a
+    restore streams them. Raises ValueError or ``zipfile.BadZipFile``.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = {info.filename: info for info in zf.infolist()}
+        for name in infos:
+            if name.startswith("/") or ".." in name.split("/"):
+                raise ValueError(f"Invalid backup file: unsafe entry name {name}")
+        if backup_archive.DATA_ENTRY not in infos:
+            raise ValueError("Invalid backup file: missing data.json")
+
+        summary = infos.get(backup_archive.SUMMARY_ENTRY)
+        if summary is not None and summary.file_size <= SUMMARY_MAX_BYTES:
+            try:
+                return _from_summary(json.loads(zf.read(summary)))
+            except (KeyError, TypeError, ValueError) as exc:
+                logger.warning("ignoring summary.json of %s: %s", zip_path, exc)
+
+        header: Dict = {}
+        item_count = image_count = 0
+        with zf.open(backup_archive.DATA_ENTRY) as f:
+            for item in iter_items(f, header):
+                images = item.get("images", []) if isinstance(item, dict) else None
+                if not isinstance(images, list):
+                    raise ValueError("Invalid backup data structure")
+                item_count += 1
+                image_count += len(images)
+            # Reading to the end makes zipfile check data.json's CRC.
+            while f.read(READ_BYTES):
+                pass
+        return ArchiveSummary(header.get("type", "full"), item_count, image_count)
+
+
+@dataclass
+class RestoreResult:
+    items_restored: int = 0
+    images_restored: int = 0
+    items_unchanged: int = 0
+    items_deleted: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+# Archived image name -> (digest, extension, size in bytes).
+StoredImages = Dict[str, Tuple[str, str, int]]
+# (item record from data.json, [(image record, stored image)]).
+ParsedItem = Tuple[Dict, List[Tuple[Dict, Tuple[str, str, int]]]]
+# Item fields compared by merge restores.
+CONTENT_FIELDS = (
+    "name", "category", "location", "brand", "model_number", "serial_number", "purchase_date",
+    "purchase_price", "current_value", "warranty_expiration", "notes", "custom_fields",
+)
+
+
+def store_image(db: Session, src: BinaryIO, extension: str, staging: str) -> Tuple[str, str, int]:
+    """Stream ``src`` to its blob path under ``staging`` unless the store has
+    it already; returns its digest, extension and size."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=staging)
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while data := src.read(READ_BYTES):
+                sha.update(data)
+                out.write(data)
+                size += len(data)
+        digest = sha.hexdigest()
+        if storage.find_blob(db, digest) is None:
+            target = os.path.join(staging, storage.blob_relpath(digest, extension))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest, extension, size
+
+
+def _image_name(name: str) -> Optional[str]:
+    prefix = f"{backup_archive.IMAGES_DIR}/"
+    if not name.startswith(prefix) or name.endswith("/"):
+        return None
+    filename = name[len(prefix):]
+    if not filename or "/" in filename or filename.startswith("."):
+        return None
+    return filename
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _item_row(item_data: Dict, owner_id, item_id=None) -> Dict:
+    row = {
+        "id": item_id or uuid.uuid4(),
+        "owner_id": owner_id,
+        "name": item_data["name"],
+        "category": item_data["category"],
+        "location": item_data["location"],
+        "brand": item_data["brand"],
+        "model_number": item_data["model_number"],
+        "serial_number": item_data["serial_number"],
+        "purchase_date": _parse_datetime(item_data["purchase_date"]),
+        "purchase_price": item_data["purchase_price"],
+        "current_value": item_data["current_value"],
+        "warranty_expiration": _parse_datetime(item_data["warranty_expiration"]),
+        "notes": item_data["notes"],
+        "custom_fields": item_data["custom_fields"],
+    }
+    if item_id is not None:
+        # Merges keep the archived timestamps so unchanged items stay equal.
+        now = datetime.utcnow()
+        row["created_at"] = _parse_datetime(item_data.get("created_at")) or now
+        row["updated_at"] = _parse_datetime(item_data.get("updated_at")) or now
+    return row
+
+
+def _insert_images(db: Session, entries: List[Tuple[object, Dict, Tuple[str, str, int]]], keep_ids: bool = False) -> int:
+    """Insert ``(item id, image record, stored image)`` rows with one
+    executemany, taking the blob references they need in one upsert."""
+    if not entries:
+        return 0
+    refs: Dict[str, Tuple[str, int, int]] = {}
+    for _, _, (digest, extension, size) in entries:
+        _, _, count = refs.get(digest, (extension, size, 0))
+        refs[digest] = (extension, size, count + 1)
+    blobs = storage.acquire_blobs(db, refs)
+    ids = [_archived_id(image_data) if keep_ids else None for _, image_data, _ in entries]
+    taken = set()
+    wanted = [image_id for image_id in ids if image_id is not None]
+    for start in range(0, len(wanted), RESTORE_BATCH_SIZE):
+        taken.update(row[0] for row in db.query(models.ItemImage.id).filter(
+            models.ItemImage.id.in_(wanted[start:start + RESTORE_BATCH_SIZE])
+        ))
+    rows = [
+        {
+            "id": image_id if image_id is not None and image_id not in taken else uuid.uuid4(),
+            "item_id": item_id,
+            "filename": blobs[digest].filename,
+            "file_path": blobs[digest].file_path,
+            "variants": blobs[digest].variants,
+            "blob_sha256": digest,
+            **{name: image_data.get(name) for name in models.IMAGE_METADATA_FIELDS},
+        }
+        for image_id, (item_id, image_data, (digest, _, _)) in zip(ids, entries)
+    ]
+    db.execute(insert(models.ItemImage), rows)
+    return len(rows)
+
+
+def _archived_id(record: Dict) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(str(record["id"]))
+    except (KeyError, ValueError):
+        return None
+
+
+def _parse_items(items: Iterator[Dict], stored: StoredImages, result: RestoreResult) -> Iterator[ParsedItem]:
+    """Pair each item record with its stored images, reporting bad records."""
+    for item_data in items:
+        try:
+            images = [
+                (image_data, stored[image_data["filename"]])
+                for image_data in item_data.get("images", [])
+                if image_data.get("filename") in stored
+            ]
+        except (AttributeError, KeyError, TypeError) as e:
+            name = item_data.get("name") if isinstance(item_data, dict) else item_data
+            result.errors.append(f"Error restoring item {name}: {str(e)}")
+            continue
+        yield item_data, images
+
+
+def _batches(items: Iterator[ParsedItem], batch_size: int) -> Iterator[List[ParsedItem]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_staging = MetaData()
+# Per-connection TEMP tables: filling them never takes the database's write
+# lock, and other connections never see them.
+STAGED_ITEMS = Table(
+    "restore_staged_items",
+    _staging,
+    *[Column(column.name, column.type) for column in models.Item.__table__.columns],
+    prefixes=["TEMPORARY"],
+)
+STAGED_IMAGES = Table(
+    "restore_staged_images",
+    _staging,
+    Column("id", models.ItemImage.__table__.c.id.type),
+    Column("item_id", models.ItemImage.__table__.c.item_id.type),
+    Column("blob_sha256", String(64)),
+    Column("extension", String),
+    Column("blob_size", Integer),
+    *[Column(name, models.ItemImage.__table__.c[name].type) for name in models.IMAGE_METADATA_FIELDS],
+    Column("created_at", DateTime),
+    prefixes=["TEMPORARY"],
+)
+
+
+@dataclass
+class StagingTotals:
+    items: int = 0
+    images: int = 0
+    checksum: int = 0
+
+
+def _row_checksum(row) -> int:
+    canonical = json.dumps({column.name: row.get(column.name) for column in STAGED_ITEMS.columns},
+                           sort_keys=True, default=str)
+    return int.from_bytes(hashlib.sha256(canonical.encode()).digest()[:8], "big")
+
+
+def _reset_staging(db: Session) -> None:
+    connection = db.connection()
+    for table in (STAGED_IMAGES, STAGED_ITEMS):
+        table.drop(connection, checkfirst=True)
+
+
+def stage_items(
+    db: Session,
+    owner_id,
+    items: Iterator[ParsedItem],
+    result: RestoreResult,
+    batch_size: int = RESTORE_BATCH_SIZE,
+) -> StagingTotals:
+    """Write ``items`` for ``owner_id`` under new ids into the staging tables."""
+    connection = db.connection()
+    _reset_staging(db)
+    STAGED_ITEMS.create(connection)
+    STAGED_IMAGES.create(connection)
+    totals = StagingTotals()
+    for batch in _batches(items, batch_size):
+        rows, images = [], []
+        now = datetime.utcnow()
+        for item_data, item_images in batch:
+            try:
+                row = _item_row(item_data, owner_id)
+            except (KeyError, TypeError, ValueError) as e:
+                result.errors.append(f"Error restoring item {item_data.get('name')}: {str(e)}")
+                continue
+            row.update(created_at=now, updated_at=now)
+            rows.append(row)
+            totals.checksum = (totals.checksum + _row_checksum(row)) % (1 << 64)
+            images.extend(
+                {
+                    "id": uuid.uuid4(),
+                    "item_id": row["id"],
+                    "blob_sha256": digest,
+                    "extension": extension,
+                    "blob_size": size,
+                    **{name: image_data.get(name) for name in models.IMAGE_METADATA_FIELDS},
+                    "created_at": now,
+                }
+                for image_data, (digest, extension, size) in item_images
+            )
+        if rows:
+            connection.execute(insert(STAGED_ITEMS), rows)
+        if images:
+            connection.execute(insert(STAGED_IMAGES), images)
+        totals.items += len(rows)
+        totals.images += len(images)
+    return totals
+
+
+def _verify_staging(db: Session, expected: StagingTotals) -> None:
+    """Re-read the staging tables and check them against what was written,
+    and that every blob they reference is on disk."""
+    connection = db.connection()
+    totals = StagingTotals()
+    for row in connection.execute(select(STAGED_ITEMS)).mappings():
+        totals.items += 1
+        totals.checksum = (totals.checksum + _row_checksum(row)) % (1 << 64)
+    totals.images = connection.execute(select(func.count()).select_from(STAGED_IMAGES)).scalar()
+    if totals != expected:
+        raise ValueError(f"Staged restore does not match the archive: staged {totals}, expected {expected}")
+
+    digests = connection.execute(
+        select(STAGED_IMAGES.c.blob_sha256, func.min(STAGED_IMAGES.c.extension)).group_by(STAGED_IMAGES.c.blob_sha256)
+    ).all()
+    for start in range(0, len(digests), storage.QUERY_BATCH):
+        batch = dict(digests[start:start + storage.QUERY_BATCH])
+        paths = {
+            digest: os.path.join(storage.upload_dir(), storage.blob_relpath(digest, extension))
+            for digest, extension in batch.items()
+        }
+        for blob in db.query(models.ImageBlob).filter(models.ImageBlob.sha256.in_(list(batch))):
+            paths[blob.sha256] = storage.absolute_path(blob.file_path)
+        missing = [digest for digest, path in paths.items() if not os.path.exists(path)]
+        if missing:
+            raise ValueError(f"Staged restore references {len(missing)} missing image files, e.g. {missing[0]}")
+
+
+def _swap_in(db: Session, owner_id, expected: StagingTotals) -> List[str]:
+    """Replace ``owner_id``'s items with the staged ones; returns the files
+    the old items released."""
+    connection = db.connection()
+    staged, blobs = STAGED_IMAGES.c, models.ImageBlob.__table__.c
+    refs = {
+        digest: (extension, size, count)
+        for digest, extension, size, count in connection.execute(
+            select(staged.blob_sha256, func.min(staged.extension), func.min(staged.blob_size), func.count())
+            .group_by(staged.blob_sha256)
+        )
+    }
+    # Acquire before releasing: a blob the old and new items share never
+    # drops to zero, so its row, variants and files are kept.
+    storage.acquire_blobs(db, refs)
+    doomed = storage.release_owner_images(db, owner_id)
+    db.query(models.Item).filter(models.Item.owner_id == owner_id).delete(synchronize_session=False)
+    columns = [column.name for column in STAGED_ITEMS.columns]
+    connection.execute(insert(models.Item.__table__).from_select(columns, select(STAGED_ITEMS)))
+
+    metadata = list(models.IMAGE_METADATA_FIELDS)
+    connection.execute(
+        insert(models.ItemImage.__table__).from_select(
+            ["id", "item_id", "filename", "file_path", "variants", "blob_sha256", *metadata, "created_at"],
+            select(
+                staged.id, staged.item_id, blobs.filename, blobs.file_path, blobs.variants, staged.blob_sha256,
+                *[staged[name] for name in metadata], staged.created_at,
+            ).join_from(STAGED_IMAGES, models.ImageBlob.__table__, staged.blob_sha256 == blobs.sha256),
+        )
+    )
+
+    items = db.query(models.Item).filter(models.Item.owner_id == owner_id).count()
+    images = (
+        db.query(models.ItemImage)
+        .join(models.Item, models.ItemImage.item_id == models.Item.id)
+        .filter(models.Item.owner_id == owner_id)
+        .count()
+    )
+    if (items, images) != (expected.items, expected.images):
+        raise ValueError(
+            f"Restore swap wrote {items} items and {images} images, expected {expected.items} and {expected.images}"
+        )
+    return doomed
+
+
+def _content(record: Dict) -> str:
+    fields = {name: record.get(name) for name in CONTENT_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def merge_items(
+    db: Session,
+    owner_id,
+    items: Iterator[ParsedItem],
+    result: RestoreResult,
+    batch_size: int = RESTORE_BATCH_SIZE,
+) -> Tuple[set, List[str]]:
+    """Upsert ``items`` under their archived ids, skipping unchanged ones.
+
+    An item is unchanged when its ``updated_at`` matches, or its fields
+    hash the same and it has the same image blobs. Only images whose blob
+    differs are replaced, and new references are taken before old ones are
+    dropped, so blobs that stay keep their rows and variants. Returns the ids
+    seen and the files released by replaced images.
+    """
+    seen = set()
+    doomed: List[str] = []
+    for batch in _batches(items, batch_size):
+        ids = [_archived_id(item_data) for item_data, _ in batch]
+        known = [item_id for item_id in ids if item_id is not None]
+        live = {item.id: item for item in db.query(models.Item).filter(models.Item.id.in_(known))}
+        live_images: Dict = {}
+        for image in db.query(models.ItemImage).filter(models.ItemImage.item_id.in_(known)):
+            live_images.setdefault(image.item_id, []).append(image)
+
+        inserts, updates, images, released = [], [], [], []
+        for item_id, (item_data, item_images) in zip(ids, batch):
+            name = item_data.get("name")
+            if item_id is None:
+                result.errors.append(f"Error restoring item {name}: merge needs the archived item id")
+                continue
+            current = live.get(item_id)
+            if current is not None and current.owner_id != owner_id:
+                result.errors.append(f"Error restoring item {name}: id {item_id} belongs to another user")
+                continue
+            seen.add(item_id)
+            try:
+                row = _item_row(item_data, owner_id, item_id)
+            except (KeyError, TypeError, ValueError) as e:
+                result.errors.append(f"Error restoring item {name}: {str(e)}")
+                continue
+            if current is None:
+                inserts.append(row)
+                images.extend((item_id, image_data, image) for image_data, image in item_images)
+                continue
+            unmatched: Dict = {}
+            for image in live_images.get(item_id, []):
+                unmatched.setdefault(image.blob_sha256, []).append(image)
+            added = []
+            for image_data, image in item_images:
+                if unmatched.get(image[0]):
+                    unmatched[image[0]].pop()
+                else:
+                    added.append((item_id, image_data, image))
+            removed = [image for group in unmatched.values() for image in group]
+            same_images = not added and not removed
+            current_record = backup_archive.item_record(current)
+            same_fields = current_record["updated_at"] == item_data.get("updated_at") or (
+                _content(current_record) == _content(item_data)
+            )
+            if same_fields and same_images:
+                result.items_unchanged += 1
+                continue
+            if not same_fields:
+                updates.append(row)
+            images.extend(added)
+            released.extend(removed)
+            result.items_restored += 1
+
+        if inserts:
+            db.execute(insert(models.Item), inserts)
+            result.items_restored += len(inserts)
+        if updates:
+            db.execute(update(models.Item), updates)
+        result.images_restored += _insert_images(db, images, keep_ids=True)
+        doomed.extend(storage.release_images(db, released))
+    return seen, doomed
+
+
+def _delete_missing(db: Session, owner_id, seen: set, result: RestoreResult) -> List[str]:
+    missing = [row[0] for row in db.query(models.Item.id).filter(models.Item.owner_id == owner_id)
+               if row[0] not in seen]
+    doomed: List[str] = []
+    for start in range(0, len(missing), RESTORE_BATCH_SIZE):
+        batch = missing[start:start + RESTORE_BATCH_SIZE]
+        doomed.extend(storage.release_item_images(db, batch))
+        db.query(models.Item).filter(models.Item.id.in_(batch)).delete(synchronize_session=False)
+    result.items_deleted = len(missing)
+    return doomed
+
+
+def _read_zip(db: Session, path: str, staging: str, apply) -> None:
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        if backup_archive.DATA_ENTRY not in names:
+            raise ValueError("Invalid backup file: missing data.json")
+        stored: StoredImages = {}
+        for name in names:
+            filename = _image_name(name)
+            if filename is not None:
+                with zf.open(name) as src:
+                    stored[filename] = store_image(db, src, os.path.splitext(filename)[1], staging)
+        with zf.open(backup_archive.DATA_ENTRY) as f:
+            apply(iter_items(f), stored)
+
+
+def _read_tar(db: Session, path: str, staging: str, apply) -> None:
+    stored: StoredImages = {}
+    with tempfile.TemporaryFile(dir=str(settings.backup_path)) as data:
+        found = False
+        with backup_archive.open_tar_archive(path) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                src = tar.extractfile(member)
+                if member.name == backup_archive.DATA_ENTRY:
+                    shutil.copyfileobj(src, data, READ_BYTES)
+                    found = True
+                elif (filename := _image_name(member.name)) is not None:
+                    stored[filename] = store_image(db, src, os.path.splitext(filename)[1], staging)
+        if not found:
+            raise ValueError("Invalid backup file: missing data.json")
+        data.seek(0)
+        apply(iter_items(data), stored)
+
+
+def restore_archive(
+    db: Session,
+    owner_id,
+    path: str,
+    tar: bool = False,
+    mode: str = "replace",
+    delete_missing: bool = False,
+) -> Tuple[RestoreResult, List[str]]:
+    """Restore ``owner_id``'s items from the archive at ``path``.
+
+    ``mode="replace"`` stages the archive's items under new ids, verifies
+    the staged rows, then swaps them in for the user's items. ``mode="merge"`` keeps the archived ids and only writes
+    items that differ from the live rows; with ``delete_missing`` it also
+    deletes live items the archive does not have.
+
+    Returns the result and the files released along the way; remove them
+    with ``storage.remove_unreferenced`` after committing.
+    """
+    result = RestoreResult()
+    doomed: List[str] = []
+
+    def apply(items: Iterator[Dict], stored: StoredImages) -> None:
+        parsed = _parse_items(items, stored, result)
+        if mode == "merge":
+            seen, released = merge_items(db, owner_id, parsed, result)
+            doomed.extend(released)
+            if delete_missing:
+                doomed.extend(_delete_missing(db, owner_id, seen, result))
+            storage.publish_staged(staging)
+        else:
+            totals = stage_items(db, owner_id, parsed, result)
+            storage.publish_staged(staging)
+            _verify_staging(db, totals)
+            doomed.extend(_swap_in(db, owner_id, totals))
+            result.items_restored = totals.items
+            result.images_restored = totals.images
+
+    try:
+        with storage.staging_area() as staging:
+            (_read_tar if tar else _read_zip)(db, path, staging, apply)
+    finally:
+        if mode != "merge":
+            _reset_staging(db)
+    logger.info(
+        "%s restore for user %s: %d items and %d images written, %d unchanged, %d deleted",
+        mode, owner_id, result.items_restored, result.images_restored, result.items_unchanged, result.items_deleted,
+    )
+    return result, doomed
+
+
+def render_missing_variants(db: Session, owner_id) -> int:
+    """Render WebP variants for ``owner_id``'s blobs that have none yet and
+    store them on the blob and every image using it; commits per blob.
+
+    Meant for a worker thread after a restore. Failures are logged and the
+    blob is left for a later run; returns how many blobs were rendered.
+    """
+    item_ids = select(models.Item.id).where(models.Item.owner_id == owner_id)
+    digests = [
+        row[0] for row in db.query(models.ItemImage.blob_sha256)
+        .join(models.ImageBlob, models.ImageBlob.sha256 == models.ItemImage.blob_sha256)
+        .filter(models.ItemImage.item_id.in_(item_ids), models.ImageBlob.variants.is_(None))
+        .distinct()
+    ]
+    rendered = 0
+    for digest in digests:
+        blob = db.get(models.ImageBlob, digest)
+        path = storage.absolute_path(blob.file_path)
+        try:
+            written = imaging.generate_variants(
+                path, list(settings.IMAGE_VARIANT_WIDTHS), settings.IMAGE_VARIANT_QUALITY
+            )
+        except Exception:
+            logger.warning("could not render variants for restored blob %s", path, exc_info=True)
+            continue
+        directory = os.path.dirname(os.path.relpath(path, storage.upload_dir()))
+        variants = {width: storage.public_path(os.path.join(directory, name)) for width, name in written.items()}
+        blob.variants = variants
+        db.query(models.ItemImage).filter(models.ItemImage.blob_sha256 == digest).update(
+            {models.ItemImage.variants: variants}, synchronize_session=False
+        )
+        db.commit()
+        rendered += 1
+    return rendered
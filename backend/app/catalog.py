@@ -0,0 +1,249 @@
+"""Offline UPC/EAN product catalog used to prefill items on a barcode miss.
+
+Operators supply a product dump (CSV with a header row, or JSON Lines) and
+``build_catalog`` compiles it into a single read-only index file:
+
+    header   8-byte magic + uint64 record count
+    index    ``count`` fixed-width entries (GTIN-14 key, data offset, length),
+             sorted by key
+    data     compact JSON payloads, one per entry
+
+Lookups memory-map the file and binary-search the index, so a query touches
+a handful of pages and never parses the dump. The builder is an external
+merge sort: rows are sorted in bounded runs spilled to temp files and then
+k-way merged, so multi-million-row dumps build in roughly constant memory.
+"""
+
+import csv
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WHISCAT1"
+HEADER = struct.Struct(">8sQ")
+ENTRY = struct.Struct(">14sQI")
+KEY_WIDTH = 14
+RUN_RECORD = struct.Struct(">14sI")
+
+# Accepted column names in the source dump, mapped onto ItemCreate fields.
+FIELD_ALIASES = {
+    "barcode": ("barcode", "upc", "ean", "gtin", "code"),
+    "name": ("name", "title", "product_name", "description"),
+    "brand": ("brand", "brand_name", "manufacturer"),
+    "model_number": ("model_number", "model", "mpn"),
+    "category": ("category", "category_name"),
+}
+
+
+def normalize_barcode(value: Any) -> Optional[bytes]:
+    """Return the GTIN-14 form of a UPC-A/EAN-8/EAN-13/GTIN-14 code.
+
+    Left-padding with zeros makes a UPC-A scan match its EAN-13 twin.
+    """
+    if value is None:
+        return None
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    if len(digits) not in (8, 12, 13, 14):
+        return None
+    return digits.zfill(KEY_WIDTH).encode("ascii")
+
+
+def _pick(row: Dict[str, Any], field: str) -> Optional[str]:
+    for alias in FIELD_ALIASES[field]:
+        value = row.get(alias)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def _iter_rows(source_path: str) -> Iterator[Dict[str, Any]]:
+    if source_path.endswith((".jsonl", ".ndjson")):
+        with open(source_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(row, dict):
+                    yield {str(k).lower(): v for k, v in row.items()}
+    else:
+        with open(source_path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield {str(k).lower(): v for k, v in row.items() if k}
+
+
+def _iter_records(source_path: str) -> Iterator[Tuple[bytes, bytes]]:
+    for row in _iter_rows(source_path):
+        key = normalize_barcode(_pick(row, "barcode"))
+        name = _pick(row, "name")
+        if key is None or not name:
+            continue
+        payload = {"name": name}
+        for field in ("brand", "model_number", "category"):
+            value = _pick(row, field)
+            if value:
+                payload[field] = value
+        yield key, json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _write_run(records, directory: str) -> str:
+    records.sort(key=lambda record: record[0])
+    fd, path = tempfile.mkstemp(prefix="run_", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for key, payload in records:
+            f.write(RUN_RECORD.pack(key, len(payload)))
+            f.write(payload)
+    return path
+
+
+def _read_run(path: str) -> Iterator[Tuple[bytes, bytes]]:
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(RUN_RECORD.size)
+            if not head:
+                return
+            key, length = RUN_RECORD.unpack(head)
+            yield key, f.read(length)
+
+
+def build_catalog(source_path: str, output_path: str, run_size: int = 200_000) -> int:
+    """Compile a product dump into an index file and return the record count.
+
+    Duplicate barcodes keep the first row seen in the dump. The output is
+    written next to ``output_path`` and swapped in with an atomic rename so
+    a running server never observes a half-written catalog.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="catalog_", dir=output_dir)
+    try:
+        runs = []
+        buffer = []
+        for record in _iter_records(source_path):
+            buffer.append(record)
+            if len(buffer) >= run_size:
+                runs.append(_write_run(buffer, work_dir))
+                buffer = []
+        if buffer:
+            runs.append(_write_run(buffer, work_dir))
+
+        index_path = os.path.join(work_dir, "index")
+        data_path = os.path.join(work_dir, "data")
+        count = 0
+        offset = 0
+        last_key = None
+        # heapq.merge is stable across its inputs, so ties resolve to the
+        # earliest run, i.e. the earliest row in the dump.
+        merged = heapq.merge(*(_read_run(path) for path in runs), key=lambda record: record[0])
+        with open(index_path, "wb") as index_f, open(data_path, "wb") as data_f:
+            for key, payload in merged:
+                if key == last_key:
+                    continue
+                last_key = key
+                index_f.write(ENTRY.pack(key, offset, len(payload)))
+                data_f.write(payload)
+                offset += len(payload)
+                count += 1
+
+        fd, tmp_output = tempfile.mkstemp(prefix="catalog_", suffix=".tmp", dir=output_dir)
+        with os.fdopen(fd, "wb") as out:
+            out.write(HEADER.pack(MAGIC, count))
+            for part in (index_path, data_path):
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(tmp_output, output_path)
+        logger.info("built product catalog with %d entries at %s", count, output_path)
+        return count
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class ProductCatalog:
+    """Read-only, memory-mapped view over a compiled catalog file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Catalog file is empty: {path}")
+        magic, self._count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a WHIS product catalog: {path}")
+        self._data_start = HEADER.size + self._count * ENTRY.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _key_at(self, position: int) -> bytes:
+        start = HEADER.size + position * ENTRY.size
+        return self._mm[start:start + KEY_WIDTH]
+
+    def lookup(self, barcode: Any) -> Optional[Dict[str, Any]]:
+        key = normalize_barcode(barcode)
+        if key is None:
+            return None
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._count or self._key_at(lo) != key:
+            return None
+        _, offset, length = ENTRY.unpack_from(self._mm, HEADER.size + lo * ENTRY.size)
+        start = self._data_start + offset
+        return json.loads(self._mm[start:start + length])
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+
+_catalog: Optional[ProductCatalog] = None
+_catalog_stamp: Optional[Tuple[str, float]] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> Optional[ProductCatalog]:
+    """Return the catalog at ``settings.CATALOG_PATH``, or None if absent.
+
+    The mapping is reopened whenever the file is replaced, so rebuilding the
+    catalog takes effect without restarting the server.
+    """
+    global _catalog, _catalog_stamp
+    path = str(settings.catalog_path)
+    try:
+        stamp = (path, os.stat(path).st_mtime)
+    except OSError:
+        return None
+    with _catalog_lock:
+        if _catalog is None or _catalog_stamp != stamp:
+            # The previous mapping is left for the garbage collector rather
+            # than closed, since another request may still be reading it.
+            try:
+                _catalog = ProductCatalog(path)
+            except (OSError, ValueError, struct.error):
+                logger.exception("could not open product catalog at %s", path)
+                _catalog = None
+                return None
+            _catalog_stamp = stamp
+        return _catalog
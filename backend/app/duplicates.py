@@ -0,0 +1,215 @@
+"""Near-duplicate photo detection over ``ItemImage.phash``.
+
+Each owner's hashes are held in a BK-tree keyed by Hamming distance, so a
+radius query only descends into children whose edge distance is within
+``max_distance`` of the query's distance to the node, and identical hashes
+(the same blob attached to several items) collapse into one node.
+
+Trees are built lazily per owner and reused until the owner's set of hashed
+images changes, which is detected with a cheap ``count`` / ``max(created_at)``
+query. Cluster listings are memoized on the same signature.
+"""
+
+import logging
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Metric tree over 64-bit hashes; each node carries the ids sharing it.
+
+    Not thread-safe: cached trees are only read or changed under ``_lock``.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self) -> None:
+        # Node layout: [hash, [ids], {distance: child}]
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, key) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [key], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [key], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int, list]]:
+        """Return ``(distance, hash, ids)`` for every node within range."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0], node[1]))
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in node[2].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        return found
+
+    def nodes(self):
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            yield node[0], node[1]
+            stack.extend(node[2].values())
+
+
+class _OwnerIndex:
+    def __init__(self, signature, tree: BKTree):
+        self.signature = signature
+        self.tree = tree
+        self.clusters: Dict[int, List[List[uuid.UUID]]] = {}
+
+
+_indexes: Dict[uuid.UUID, _OwnerIndex] = {}
+_lock = threading.Lock()
+
+
+def _owner_images(db: Session, owner_id: uuid.UUID):
+    return (
+        db.query(models.ItemImage)
+        .join(models.Item, models.ItemImage.item_id == models.Item.id)
+        .filter(models.Item.owner_id == owner_id, models.ItemImage.phash.isnot(None))
+    )
+
+
+def _signature(db: Session, owner_id: uuid.UUID):
+    count, newest = _owner_images(db, owner_id).with_entities(
+        func.count(models.ItemImage.id), func.max(models.ItemImage.created_at)
+    ).one()
+    return count, newest
+
+
+def owner_index(db: Session, owner_id: uuid.UUID, allow_stale: bool = False) -> _OwnerIndex:
+    """The BK-tree for ``owner_id``'s images, rebuilt if their set changed.
+
+    ``allow_stale`` reuses any cached tree without checking, for callers
+    that would otherwise force a full rebuild on every write.
+    """
+    with _lock:
+        index = _indexes.get(owner_id)
+    if index is not None and allow_stale:
+        return index
+    signature = _signature(db, owner_id)
+    if index is not None and index.signature == signature:
+        return index
+    tree = BKTree()
+    rows = _owner_images(db, owner_id).with_entities(models.ItemImage.id, models.ItemImage.phash)
+    for image_id, phash in rows.yield_per(5000):
+        tree.add(int(phash, 16), image_id)
+    index = _OwnerIndex(signature, tree)
+    with _lock:
+        _indexes[owner_id] = index
+    logger.debug("built duplicate index for %s with %d images", owner_id, tree.size)
+    return index
+
+
+def find_similar(
+    db: Session,
+    owner_id: uuid.UUID,
+    phash: str,
+    max_distance: int,
+) -> List[uuid.UUID]:
+    """Ids of the owner's images within ``max_distance`` bits of ``phash``.
+
+    Meant for the upload-time hint: it searches the cached tree even if it
+    is stale (uploads are folded in with ``remember``), then drops ids that
+    have since been deleted.
+    """
+    index = owner_index(db, owner_id, allow_stale=True)
+    # ``remember`` grows the cached tree from other request threads.
+    with _lock:
+        matches = index.tree.search(int(phash, 16), max_distance)
+        matches.sort(key=lambda match: match[0])
+        candidates = [image_id for _, _, ids in matches for image_id in ids]
+    if not candidates:
+        return []
+    live = {
+        row[0] for row in db.query(models.ItemImage.id).filter(models.ItemImage.id.in_(candidates))
+    }
+    return [image_id for image_id in candidates if image_id in live]
+
+
+def remember(owner_id: uuid.UUID, image_id: uuid.UUID, phash: str) -> None:
+    """Add a freshly uploaded image to the owner's cached tree, if any."""
+    with _lock:
+        index = _indexes.get(owner_id)
+        if index is None:
+            return
+        value = int(phash, 16)
+        if not any(image_id in ids for _, _, ids in index.tree.search(value, 0)):
+            index.tree.add(value, image_id)
+        index.clusters.clear()
+
+
+def clusters(db: Session, owner_id: uuid.UUID, max_distance: int) -> List[List[uuid.UUID]]:
+    """Groups of two or more images connected by near-duplicate links.
+
+    Linking is transitive (single-linkage): A~B and B~C puts A, B and C in
+    one cluster even if A and C are further apart than ``max_distance``.
+    """
+    index = owner_index(db, owner_id)
+    with _lock:
+        cached = index.clusters.get(max_distance)
+        if cached is None:
+            cached = index.clusters[max_distance] = _link(index.tree, max_distance)
+    return cached
+
+
+def _link(tree: BKTree, max_distance: int) -> List[List[uuid.UUID]]:
+    """Single-linkage clusters of ``tree``; the caller holds ``_lock``."""
+    parent: Dict[int, int] = {}
+
+    def find(value: int) -> int:
+        root = value
+        while parent[root] != root:
+            root = parent[root]
+        while parent[value] != root:
+            parent[value], value = root, parent[value]
+        return root
+
+    members: Dict[int, list] = {}
+    for value, ids in tree.nodes():
+        parent[value] = value
+        members[value] = ids
+    for value in members:
+        for _, other, _ in tree.search(value, max_distance):
+            a, b = find(value), find(other)
+            if a != b:
+                parent[b] = a
+
+    groups: Dict[int, List[uuid.UUID]] = {}
+    for value, ids in members.items():
+        groups.setdefault(find(value), []).extend(ids)
+    return sorted((ids for ids in groups.values() if len(ids) > 1), key=len, reverse=True)
+
+
+def reset() -> None:
+    with _lock:
+        _indexes.clear()
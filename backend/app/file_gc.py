@@ -0,0 +1,369 @@
+"""Garbage collection for files no database row points at.
+
+Uploads that fail between writing a file and committing its row, crashes
+mid-restore and interrupted backups can all leave bytes behind. ``collect``
+sweeps them up:
+
+- ``UPLOAD_DIR`` (and ``IMAGE_ORIGINALS_DIR``) is walked with ``os.scandir``
+  one directory at a time. Blob files and their variants are keyed by the
+  digest in their name and checked against ``image_blobs``; flat pre-2.1
+  uploads are checked against ``item_images.filename``. Lookups are one
+  ``IN`` query per batch of files, so memory stays flat however large the
+  store is.
+- ``BACKUP_DIR`` loses abandoned ``temp_*`` / ``restore_*`` / ``upload_*``
+  working directories and archives no ``backups`` row refers to; its
+  ``repository/`` loses pack files no ``backup_packs`` row refers to.
+- Restore staging areas under ``UPLOAD_DIR/.staging`` are skipped by the
+  walk and removed whole once no restore holds their lock.
+- Upload temp files (``.upload-*.part``, ``*.tmp``) are removed outright,
+  as are resumable upload sessions idle past ``UPLOAD_SESSION_TTL_SECONDS``
+  together with their ``.session-*.part`` files.
+
+Nothing younger than the grace period is touched, which covers uploads and
+backups that are still in flight. Age is taken from the later of mtime and
+ctime, because linking a file into place (``os.replace``, hard links)
+updates ctime but keeps the original mtime.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from . import backup_repository, database, models, storage
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+BACKUP_WORK_PREFIXES = ("temp_", "restore_", "upload_")
+LEGACY_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif")
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}")
+_SESSION_FILE = re.compile(r"^\.session-(?P<id>[0-9a-f-]{36})\.part$")
+_LEGACY_VARIANT = re.compile(r"^(?P<stem>.+)_\d+\.webp$")
+
+
+@dataclass
+class GCReport:
+    scanned_files: int = 0
+    removed_files: int = 0
+    removed_dirs: int = 0
+    reclaimed_bytes: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+def _age(stat_result: os.stat_result, now: float) -> float:
+    return now - max(stat_result.st_mtime, stat_result.st_ctime)
+
+
+def _walk_files(root: str, skip: Tuple[str, ...] = ()) -> Iterator[os.DirEntry]:
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if directory != root or entry.name not in skip:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def _is_temp(name: str) -> bool:
+    return (name.startswith(".upload-") and name.endswith(".part")) or name.endswith(".tmp")
+
+
+def _expire_upload_sessions(db: Session, report: GCReport, dry_run: bool) -> set:
+    """Drop idle upload sessions; returns the ids of the ones still live."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+    live = set()
+    for session in db.query(models.UploadSession):
+        if session.updated_at is not None and session.updated_at < cutoff:
+            path = storage.upload_session_path(session.kind, session.id)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            _remove(path, size, report, dry_run)
+            if not dry_run:
+                db.delete(session)
+        else:
+            live.add(str(session.id))
+    if not dry_run:
+        db.commit()
+    return live
+
+
+def _is_dead_session_file(name: str, live_sessions: set) -> bool:
+    match = _SESSION_FILE.match(name)
+    return match is not None and match.group("id") not in live_sessions
+
+
+def _remove(path: str, size: int, report: GCReport, dry_run: bool) -> None:
+    if not dry_run:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            logger.warning("gc could not remove %s: %s", path, exc)
+            return
+    report.removed_files += 1
+    report.reclaimed_bytes += size
+
+
+def _live_digests(db: Session, digests: List[str]) -> set:
+    if not digests:
+        return set()
+    rows = db.query(models.ImageBlob.sha256).filter(models.ImageBlob.sha256.in_(set(digests)))
+    return {row[0] for row in rows}
+
+
+def _live_legacy_names(db: Session, names: List[str]) -> set:
+    """Flat names still owned by an ``ItemImage`` (directly or as a variant)."""
+    if not names:
+        return set()
+    wanted: Dict[str, List[str]] = {}
+    for name in names:
+        wanted.setdefault(name, []).append(name)
+        match = _LEGACY_VARIANT.match(name)
+        if match:
+            for extension in LEGACY_EXTENSIONS:
+                wanted.setdefault(match.group("stem") + extension, []).append(name)
+    rows = db.query(models.ItemImage.filename).filter(
+        models.ItemImage.blob_sha256.is_(None),
+        models.ItemImage.filename.in_(list(wanted)),
+    )
+    return {owner for row in rows for owner in wanted.get(row[0], [])}
+
+
+def _sweep_batch(db: Session, batch: List[Tuple[os.DirEntry, int, Optional[str]]],
+                 report: GCReport, dry_run: bool) -> None:
+    live_digests = _live_digests(db, [key for _, _, key in batch if key is not None])
+    live_names = _live_legacy_names(db, [entry.name for entry, _, key in batch if key is None])
+    for entry, size, key in batch:
+        referenced = key in live_digests if key is not None else entry.name in live_names
+        if not referenced:
+            _remove(entry.path, size, report, dry_run)
+
+
+def collect_uploads(
+    db: Session,
+    root: str,
+    grace_seconds: int,
+    report: GCReport,
+    batch_size: int = 500,
+    flat_is_legacy: bool = True,
+    dry_run: bool = False,
+    live_sessions: frozenset = frozenset(),
+) -> None:
+    """Remove unreferenced files under ``root`` (an upload or originals dir)."""
+    now = time.time()
+    batch: List[Tuple[os.DirEntry, int, Optional[str]]] = []
+    for entry in _walk_files(root, skip=(storage.LEGACY_STUB_DIR, storage.STAGING_DIR)):
+        report.scanned_files += 1
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if _age(stat_result, now) < grace_seconds:
+            continue
+        if _is_temp(entry.name) or _is_dead_session_file(entry.name, live_sessions):
+            _remove(entry.path, stat_result.st_size, report, dry_run)
+            continue
+        if _SESSION_FILE.match(entry.name):
+            continue
+        flat = os.path.dirname(entry.path) == root
+        digest = _DIGEST.match(entry.name)
+        if digest and not flat:
+            batch.append((entry, stat_result.st_size, digest.group(0)))
+        elif flat and flat_is_legacy:
+            batch.append((entry, stat_result.st_size, None))
+        else:
+            continue  # Not ours; leave it alone.
+        if len(batch) >= batch_size:
+            _sweep_batch(db, batch, report, dry_run)
+            batch = []
+    if batch:
+        _sweep_batch(db, batch, report, dry_run)
+
+
+def collect_staging(root: str, grace_seconds: int, report: GCReport, dry_run: bool = False) -> None:
+    """Remove restore staging areas under ``root`` left by restores that died."""
+    now = time.time()
+    try:
+        entries = list(os.scandir(os.path.join(root, storage.STAGING_DIR)))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False) or storage.staging_in_use(entry.path):
+            continue
+        size, newest = _tree_usage(entry.path)
+        if now - newest < grace_seconds:
+            continue
+        if not dry_run:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        report.removed_dirs += 1
+        report.reclaimed_bytes += size
+
+
+def _tree_usage(path: str) -> Tuple[int, float]:
+    """Total size and newest change time of everything under ``path``."""
+    total, newest = 0, 0.0
+    for root, _, files in os.walk(path):
+        try:
+            stat_result = os.stat(root)
+            newest = max(newest, stat_result.st_mtime, stat_result.st_ctime)
+        except OSError:
+            pass
+        for name in files:
+            try:
+                stat_result = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += stat_result.st_size
+            newest = max(newest, stat_result.st_mtime, stat_result.st_ctime)
+    return total, newest
+
+
+def collect_backups(
+    db: Session,
+    root: str,
+    grace_seconds: int,
+    report: GCReport,
+    dry_run: bool = False,
+    live_sessions: frozenset = frozenset(),
+) -> None:
+    """Remove stale working directories and untracked archives in ``root``."""
+    now = time.time()
+    archives: List[Tuple[os.DirEntry, int]] = []
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith(BACKUP_WORK_PREFIXES):
+                continue
+            size, newest = _tree_usage(entry.path)
+            if now - newest < grace_seconds:
+                continue
+            if not dry_run:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            report.removed_dirs += 1
+            report.reclaimed_bytes += size
+        elif entry.is_file(follow_symlinks=False):
+            report.scanned_files += 1
+            stat_result = entry.stat(follow_symlinks=False)
+            if _age(stat_result, now) < grace_seconds:
+                continue
+            if _is_temp(entry.name) or _is_dead_session_file(entry.name, live_sessions):
+                _remove(entry.path, stat_result.st_size, report, dry_run)
+            elif entry.name.endswith((".zip", ".tar.zst")):
+                archives.append((entry, stat_result.st_size))
+
+    # Archives are matched by path or by name, so a BACKUP_DIR that moved
+    # since the rows were written does not make every backup look orphaned.
+    for start in range(0, len(archives), 500):
+        chunk = archives[start:start + 500]
+        rows = db.query(models.Backup.file_path, models.Backup.filename).filter(or_(
+            models.Backup.file_path.in_([entry.path for entry, _ in chunk]),
+            models.Backup.filename.in_([entry.name for entry, _ in chunk]),
+        ))
+        known = set()
+        for file_path, filename in rows:
+            known.add(os.path.basename(file_path or ""))
+            known.add(filename)
+        for entry, size in chunk:
+            if entry.name not in known:
+                _remove(entry.path, size, report, dry_run)
+
+    collect_repository(db, os.path.join(root, backup_repository.REPOSITORY_DIR), grace_seconds, report, dry_run)
+
+
+def collect_repository(db: Session, root: str, grace_seconds: int, report: GCReport, dry_run: bool = False) -> None:
+    """Remove temp files and pack files no ``backup_packs`` row refers to.
+
+    Packs are only written to the database when their snapshot commits, so
+    orphaned packs are left alone while a backup is running.
+    """
+    now = time.time()
+    running = db.query(models.Backup.id).filter(models.Backup.status == "in_progress").first()
+    packs: List[Tuple[os.DirEntry, int]] = []
+    for entry in _walk_files(root):
+        report.scanned_files += 1
+        stat_result = entry.stat(follow_symlinks=False)
+        if _age(stat_result, now) < grace_seconds:
+            continue
+        if _is_temp(entry.name):
+            _remove(entry.path, stat_result.st_size, report, dry_run)
+        elif entry.name.endswith(".pack") and not running:
+            packs.append((entry, stat_result.st_size))
+    for start in range(0, len(packs), 500):
+        chunk = packs[start:start + 500]
+        ids = [entry.name[:-len(".pack")] for entry, _ in chunk]
+        known = {row[0] for row in db.query(models.BackupPack.id).filter(models.BackupPack.id.in_(ids))}
+        for (entry, size), pack_id in zip(chunk, ids):
+            if pack_id not in known:
+                _remove(entry.path, size, report, dry_run)
+
+
+def collect(db: Session, grace_seconds: Optional[int] = None, dry_run: bool = False) -> GCReport:
+    """Sweep uploads, kept originals and backups; returns what was reclaimed."""
+    if grace_seconds is None:
+        grace_seconds = settings.GC_GRACE_SECONDS
+    started = time.monotonic()
+    report = GCReport()
+    live_sessions = frozenset(_expire_upload_sessions(db, report, dry_run))
+    collect_uploads(
+        db, str(settings.upload_path), grace_seconds, report, dry_run=dry_run, live_sessions=live_sessions
+    )
+    collect_staging(str(settings.upload_path), grace_seconds, report, dry_run=dry_run)
+    if settings.originals_path is not None:
+        collect_uploads(
+            db, str(settings.originals_path), grace_seconds, report, flat_is_legacy=False, dry_run=dry_run
+        )
+    collect_backups(
+        db, str(settings.backup_path), grace_seconds, report, dry_run=dry_run, live_sessions=live_sessions
+    )
+    logger.info(
+        "gc %s %d files and %d directories (%d bytes) after scanning %d files in %.1fs",
+        "would remove" if dry_run else "removed",
+        report.removed_files,
+        report.removed_dirs,
+        report.reclaimed_bytes,
+        report.scanned_files,
+        time.monotonic() - started,
+    )
+    return report
+
+
+def _collect_once() -> GCReport:
+    db = database.SessionLocal()
+    try:
+        return collect(db)
+    finally:
+        db.close()
+
+
+async def run_periodically(interval_seconds: int) -> None:
+    """Run ``collect`` every ``interval_seconds`` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(_collect_once)
+        except Exception:
+            logger.exception("scheduled gc run failed")
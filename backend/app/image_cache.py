@@ -0,0 +1,160 @@
+"""Disk cache for on-demand resized images.
+
+Renders are keyed by source file, target box and format, stored under
+``IMAGE_CACHE_DIR`` and evicted least-recently-used once the directory
+exceeds ``IMAGE_CACHE_MAX_BYTES``. Recency is tracked in memory and mirrored
+to file mtimes, so the order survives a restart (the index is rebuilt from a
+directory scan on first use).
+
+Concurrent requests for the same missing variant are collapsed: the first
+caller starts one render task in ``workers.cpu_pool`` and every caller
+awaits it shielded, so a caller that goes away does not cancel the render
+for the others.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from . import imaging, workers
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_index: "Optional[OrderedDict[str, int]]" = None  # path -> size, oldest first
+_total_bytes = 0
+_inflight: Dict[str, "asyncio.Task[str]"] = {}
+
+
+def cache_dir() -> str:
+    return str(settings.image_cache_path)
+
+
+def cache_path(source_path: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+    key = hashlib.sha256(f"{source_path}|{width}|{height}|{fmt}".encode()).hexdigest()
+    return os.path.join(cache_dir(), key[:2], f"{key}.{fmt}")
+
+
+def _load_index() -> "OrderedDict[str, int]":
+    global _index, _total_bytes
+    if _index is None:
+        entries = []
+        for root, _, files in os.walk(cache_dir()):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        _index = OrderedDict((path, size) for _, path, size in entries)
+        _total_bytes = sum(_index.values())
+    return _index
+
+
+def _touch(path: str) -> bool:
+    """Mark a cached file as most recently used; False if it is gone."""
+    with _lock:
+        index = _load_index()
+        if path not in index:
+            return False
+        index.move_to_end(path)
+    try:
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError:
+        with _lock:
+            _forget(path)
+        return False
+    return True
+
+
+def _forget(path: str) -> None:
+    global _total_bytes
+    size = _load_index().pop(path, None)
+    if size is not None:
+        _total_bytes -= size
+
+
+def _admit(path: str, size: int) -> None:
+    """Record a new render and evict the oldest entries past the size cap."""
+    global _total_bytes
+    evicted = []
+    with _lock:
+        index = _load_index()
+        _forget(path)
+        index[path] = size
+        _total_bytes += size
+        while _total_bytes > settings.IMAGE_CACHE_MAX_BYTES and len(index) > 1:
+            old_path, old_size = index.popitem(last=False)
+            _total_bytes -= old_size
+            evicted.append(old_path)
+    for old_path in evicted:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        index = _load_index()
+        return {"entries": len(index), "bytes": _total_bytes, "max_bytes": settings.IMAGE_CACHE_MAX_BYTES}
+
+
+async def get_resized(
+    source_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    fmt: str,
+) -> str:
+    """Return the path of a cached render, producing it if necessary."""
+    target = cache_path(source_path, width, height, fmt)
+    if await workers.run_io(_touch, target):
+        return target
+
+    pending = _inflight.get(target)
+    if pending is None:
+        pending = asyncio.ensure_future(_render(source_path, target, width, height, fmt))
+        _inflight[target] = pending
+        pending.add_done_callback(lambda task: _finished(target, task))
+    return await asyncio.shield(pending)
+
+
+async def _render(source_path: str, target: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+    size = await workers.run_cpu(
+        imaging.render_resized,
+        source_path,
+        target,
+        width,
+        height,
+        fmt,
+        settings.IMAGE_VARIANT_QUALITY,
+    )
+    await workers.run_io(_admit, target, size)
+    return target
+
+
+def _finished(target: str, task: "asyncio.Task[str]") -> None:
+    if _inflight.get(target) is task:
+        del _inflight[target]
+    if not task.cancelled():
+        # Waiters re-raise it; don't also warn if they have all gone away.
+        task.exception()
+
+
+def reset() -> None:
+    """Forget the in-memory index so the next use rescans the directory."""
+    global _index, _total_bytes
+    with _lock:
+        _index = None
+        _total_bytes = 0
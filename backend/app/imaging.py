@@ -0,0 +1,280 @@
+"""Pillow helpers for derived image files.
+
+Everything in this module that is submitted to ``workers.cpu_pool`` must
+stay a plain top-level function taking and returning picklable values, and
+must not touch the database or request state.
+"""
+
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+try:  # Optional: HEIC/HEIF decoding for phone photos.
+    from pillow_heif import register_heif_opener
+except ImportError:  # pragma: no cover - depends on the deployment
+    register_heif_opener = None
+else:
+    register_heif_opener()
+
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+
+
+def probe_image(path: str) -> Tuple[str, int, int]:
+    """Return ``(format, width, height)`` from the file header alone."""
+    with Image.open(path) as img:
+        return (img.format or "").upper(), img.size[0], img.size[1]
+
+
+def variant_filename(filename: str, width: int) -> str:
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}_{width}{VARIANT_EXTENSION}"
+
+
+def _open_oriented(img: Image.Image) -> Image.Image:
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return img
+
+
+def _write_variants(img: Image.Image, directory: str, filename: str,
+                    widths: Iterable[int], quality: int) -> Dict[str, str]:
+    written: Dict[str, str] = {}
+    long_edge = max(img.size)
+    # Largest first so each smaller variant resamples from fewer pixels.
+    for width in sorted(set(widths), reverse=True):
+        if width >= long_edge:
+            continue
+        img = img.copy()
+        img.thumbnail((width, width), Image.Resampling.LANCZOS)
+        name = variant_filename(filename, width)
+        target = os.path.join(directory, name)
+        tmp_target = f"{target}.tmp"
+        img.save(tmp_target, format=VARIANT_FORMAT, quality=quality, method=4)
+        os.replace(tmp_target, target)
+        written[str(width)] = name
+    return written
+
+
+def generate_variants(
+    source_path: str,
+    widths: Iterable[int],
+    quality: int,
+) -> Dict[str, str]:
+    """Write downscaled WebP copies of ``source_path`` next to it.
+
+    Returns ``{str(width): filename}`` for each variant written. Widths at or
+    above the source's long edge are skipped; clients fall back to the
+    original for those.
+    """
+    directory, filename = os.path.split(source_path)
+    with Image.open(source_path) as img:
+        return _write_variants(_open_oriented(img), directory, filename, widths, quality)
+
+
+RESIZE_FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "png": "PNG"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def render_resized(
+    source_path: str,
+    target_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    fmt: str,
+    quality: int,
+) -> int:
+    """Fit ``source_path`` inside ``width`` x ``height`` and write it as ``fmt``.
+
+    Either bound may be None to constrain only the other. Images are never
+    upscaled. Returns the size of the written file.
+    """
+    with Image.open(source_path) as img:
+        img = _open_oriented(img)
+        box = (width or img.size[0], height or img.size[1])
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+        pil_format = RESIZE_FORMATS[fmt]
+        if pil_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_target = f"{target_path}.tmp"
+        options = {"quality": quality, "optimize": True} if pil_format != "PNG" else {"optimize": True}
+        img.save(tmp_target, format=pil_format, **options)
+    os.replace(tmp_target, target_path)
+    return os.path.getsize(target_path)
+
+
+def reencode_image(
+    source_path: str,
+    target_path: str,
+    fmt: str,
+    quality: int,
+    max_edge: int,
+) -> Tuple[str, int, int]:
+    """Write an ingest copy of ``source_path`` to ``target_path``.
+
+    The copy is auto-oriented, capped to ``max_edge`` px on its long side
+    (0 disables the cap) and saved as progressive JPEG or WebP without EXIF,
+    XMP or other metadata; only the ICC profile is kept so colors survive.
+    Returns the written ``(format, width, height)``.
+    """
+    pil_format = RESIZE_FORMATS[fmt]
+    with Image.open(source_path) as img:
+        icc_profile = img.info.get("icc_profile")
+        img = _open_oriented(img)
+        if max_edge and max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and img.mode != "RGB":
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A") if img.mode == "RGBA" else None)
+            img = background
+        options: Dict[str, Any] = {"quality": quality}
+        if pil_format == "JPEG":
+            options.update(progressive=True, optimize=True)
+        else:
+            options.update(method=4)
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        img.save(target_path, format=pil_format, **options)
+        return pil_format, img.size[0], img.size[1]
+
+
+# --- Metadata / placeholders ---------------------------------------------
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(img: Image.Image, x_components: int = 4, y_components: int = 3) -> str:
+    """Encode a BlurHash (https://blurha.sh) placeholder for ``img``.
+
+    The image is reduced to 32px first; the hash only carries a handful of
+    DCT components, so more pixels add cost without changing the result.
+    """
+    small = img.convert("RGB")
+    small.thumbnail((32, 32), Image.Resampling.BILINEAR)
+    width, height = small.size
+    pixels = [tuple(_srgb_to_linear(c) for c in px) for px in small.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                cy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised + 1) / 166
+        result += _base83(quantised, 1)
+    else:
+        max_value = 1.0
+        result += _base83(0, 1)
+    result += _base83(
+        (_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4
+    )
+
+    def quantise(v: float) -> int:
+        return max(0, min(18, int(math.copysign(abs(v / max_value) ** 0.5, v) * 9 + 9.5)))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+def dominant_color(img: Image.Image) -> str:
+    """Most common color of a 5-color quantization, as ``#rrggbb``."""
+    small = img.convert("RGB")
+    small.thumbnail((64, 64), Image.Resampling.BILINEAR)
+    quantized = small.quantize(colors=5)
+    palette = quantized.getpalette() or []
+    _, index = max(quantized.getcolors())
+    r, g, b = palette[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def dhash(img: Image.Image, size: int = 8) -> str:
+    """64-bit difference hash as 16 hex digits.
+
+    Each bit records whether a pixel of a ``size+1`` x ``size`` grayscale
+    thumbnail is brighter than its right neighbour, so re-encodes, resizes
+    and small exposure changes flip few bits and the Hamming distance
+    between two hashes tracks visual similarity.
+    """
+    gray = img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def _describe(img: Image.Image, source_format: str, byte_size: int) -> Dict[str, Any]:
+    return {
+        "width": img.size[0],
+        "height": img.size[1],
+        "byte_size": byte_size,
+        "format": source_format,
+        "dominant_color": dominant_color(img),
+        "blurhash": blurhash(img),
+        "phash": dhash(img),
+    }
+
+
+def describe_image(source_path: str) -> Dict[str, Any]:
+    """Display dimensions, size, format, dominant color, BlurHash and dHash."""
+    with Image.open(source_path) as img:
+        source_format = (img.format or "").upper()
+        return _describe(_open_oriented(img), source_format, os.path.getsize(source_path))
+
+
+def process_image(
+    source_path: str,
+    widths: Iterable[int],
+    quality: int,
+) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """``generate_variants`` and ``describe_image`` from a single decode."""
+    directory, filename = os.path.split(source_path)
+    with Image.open(source_path) as img:
+        source_format = (img.format or "").upper()
+        img = _open_oriented(img)
+        metadata = _describe(img, source_format, os.path.getsize(source_path))
+        variants = _write_variants(img, directory, filename, widths, quality)
+    return variants, metadata
@@ -0,0 +1,228 @@
+"""Point-in-time snapshots of the whole instance for disaster recovery.
+
+A snapshot is a directory under ``SNAPSHOT_DIR``::
+
+    snapshot-20261019T120000Z/
+        whis.db          SQLite online-backup copy of the database
+        uploads/         the upload store, hard-linked where possible
+        originals/       IMAGE_ORIGINALS_DIR, when set
+        snapshot.json    what was copied and how
+
+Unlike the per-user JSON backups this copies the database page by page
+with ``sqlite3.Connection.backup``, so the result is one consistent
+transaction-level image of every table. Pages are copied in steps of
+``SNAPSHOT_PAGES_PER_STEP``; the read lock is released between steps, so
+writers only ever wait for one step. SQLite restarts the copy if another
+connection writes mid-way, so what lands on disk is always consistent.
+
+Upload files never change once written (blobs are content addressed and
+replaced atomically), which makes hard links a safe, free snapshot of
+them. Across filesystems a reflink (``FICLONE``) is tried, then a copy.
+The store is linked before and after the database copy: files the
+database refers to are either in the first pass or were added since and
+are in the second. Files deleted in between are harmless extras that the
+file GC removes after a restore.
+
+To restore, stop the server and put ``whis.db`` and ``uploads/`` back in
+place of the database file and ``UPLOAD_DIR``.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy.engine import Engine
+
+from .settings import settings
+
+try:  # reflinks are Linux-only
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DATABASE_ENTRY = "whis.db"
+UPLOADS_ENTRY = "uploads"
+ORIGINALS_ENTRY = "originals"
+MANIFEST_ENTRY = "snapshot.json"
+SNAPSHOT_PREFIX = "snapshot-"
+# ioctl(dest, FICLONE, src) from linux/fs.h.
+FICLONE = 0x40049409
+
+Progress = Callable[[int, int, int], None]
+
+
+@dataclass
+class SnapshotReport:
+    path: str
+    database_bytes: int = 0
+    linked: int = 0
+    reflinked: int = 0
+    copied: int = 0
+    copied_bytes: int = 0
+
+
+def snapshot_database(
+    engine: Engine,
+    dest: str,
+    pages: Optional[int] = None,
+    progress: Optional[Progress] = None,
+) -> int:
+    """Copy the live database to ``dest`` with the online backup API.
+
+    ``progress(status, remaining, total)`` is called after every step.
+    Returns the size of the copy in bytes.
+    """
+    if engine.dialect.name != "sqlite":
+        raise ValueError(f"Instance snapshots need SQLite, not {engine.dialect.name}")
+    pages = pages or settings.SNAPSHOT_PAGES_PER_STEP
+    tmp = f"{dest}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    target = sqlite3.connect(tmp)
+    source = engine.raw_connection()
+    try:
+        source.driver_connection.backup(
+            target,
+            pages=pages,
+            progress=progress,
+            sleep=settings.SNAPSHOT_STEP_SLEEP_SECONDS,
+        )
+        (result,) = target.execute("PRAGMA quick_check").fetchone()
+        if result != "ok":
+            raise RuntimeError(f"Database snapshot failed its integrity check: {result}")
+    except BaseException:
+        target.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+
+def _reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def _is_partial(name: str) -> bool:
+    # In-flight uploads and atomically replaced files (see storage.py).
+    return name.endswith(".part") or name.endswith(".tmp")
+
+
+def snapshot_tree(src_root: str, dest_root: str, report: SnapshotReport) -> None:
+    """Mirror ``src_root`` into ``dest_root``, linking files that are not
+    there yet. Files that vanish while walking are skipped."""
+    for directory, dirs, files in os.walk(src_root):
+        rel = os.path.relpath(directory, src_root)
+        target_dir = os.path.normpath(os.path.join(dest_root, rel))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in files:
+            if _is_partial(name):
+                continue
+            src = os.path.join(directory, name)
+            dst = os.path.join(target_dir, name)
+            if os.path.lexists(dst):
+                continue
+            try:
+                os.link(src, dst)
+                report.linked += 1
+                continue
+            except FileNotFoundError:
+                continue
+            except OSError:
+                pass
+            if _reflink(src, dst):
+                report.reflinked += 1
+                continue
+            try:
+                shutil.copy2(src, dst)
+            except FileNotFoundError:
+                continue
+            report.copied += 1
+            report.copied_bytes += os.path.getsize(dst)
+
+
+def _sources() -> List[tuple]:
+    sources = [(str(settings.upload_path), UPLOADS_ENTRY)]
+    if settings.originals_path is not None:
+        sources.append((str(settings.originals_path), ORIGINALS_ENTRY))
+    return sources
+
+
+def create_snapshot(
+    engine: Engine,
+    root: Optional[str] = None,
+    progress: Optional[Progress] = None,
+) -> SnapshotReport:
+    """Write a new snapshot directory under ``root`` (``SNAPSHOT_DIR``)."""
+    root = os.path.abspath(root or str(settings.snapshot_path))
+    for src, _ in _sources():
+        if os.path.commonpath([root, src]) == src:
+            raise ValueError(f"SNAPSHOT_DIR must not be inside {src}")
+    name = f"{SNAPSHOT_PREFIX}{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}"
+    final = os.path.join(root, name)
+    if os.path.exists(final):
+        raise FileExistsError(f"Snapshot {final} already exists")
+    work = f"{final}.tmp"
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+
+    report = SnapshotReport(path=final)
+    try:
+        for src, entry in _sources():
+            snapshot_tree(src, os.path.join(work, entry), report)
+        report.database_bytes = snapshot_database(engine, os.path.join(work, DATABASE_ENTRY), progress=progress)
+        for src, entry in _sources():
+            snapshot_tree(src, os.path.join(work, entry), report)
+        manifest = {"created_at": datetime.utcnow().isoformat(), **asdict(report)}
+        with open(os.path.join(work, MANIFEST_ENTRY), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    os.replace(work, final)
+    logger.info(
+        "snapshot %s: %d db bytes, %d linked, %d reflinked, %d copied",
+        final, report.database_bytes, report.linked, report.reflinked, report.copied,
+    )
+    return report
+
+
+def list_snapshots(root: Optional[str] = None) -> List[str]:
+    """Completed snapshots under ``root``, oldest first."""
+    root = root or str(settings.snapshot_path)
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        os.path.join(root, name)
+        for name in names
+        if name.startswith(SNAPSHOT_PREFIX) and not name.endswith(".tmp")
+    )
+
+
+def prune_snapshots(keep: int, root: Optional[str] = None) -> List[str]:
+    """Delete all but the newest ``keep`` snapshots; returns what was removed."""
+    doomed = list_snapshots(root)[:-keep] if keep > 0 else []
+    for path in doomed:
+        shutil.rmtree(path, ignore_errors=True)
+    return doomed
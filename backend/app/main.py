@@ -1,13 +1,16 @@
+import asyncio
 import logging
 import os
 import traceback
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 
-from .routers import analytics, auth, backups, ebay, images, items
+from .routers import analytics, auth, backups, ebay, images, items, uploads
+from . import backup_jobs, database, file_gc, workers
+from .static import UploadFiles
 from .settings import settings
 
 logging.basicConfig(
@@ -20,11 +23,25 @@ UPLOAD_DIR = str(settings.upload_path)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 logger.info("upload directory: %s", UPLOAD_DIR)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(backup_jobs.recover_on_startup, database.SessionLocal)
+    gc_task = None
+    if settings.GC_INTERVAL_SECONDS > 0:
+        gc_task = asyncio.create_task(file_gc.run_periodically(settings.GC_INTERVAL_SECONDS))
+    yield
+    if gc_task is not None:
+        gc_task.cancel()
+    workers.shutdown()
+
+
 app = FastAPI(
     title="WHIS - Whole-Home Inventory System",
     description="A self-hosted platform for managing household inventories",
     version="2.0.0",
     redirect_slashes=False,
+    lifespan=lifespan,
 )
 
 
@@ -47,7 +64,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=CORS_ALLOW_METHODS,
     allow_headers=CORS_ALLOW_HEADERS,
-    expose_headers=["Content-Type", "Content-Disposition", "Authorization"],
+    expose_headers=[
+        "Content-Type", "Content-Disposition", "Authorization", "X-Possible-Duplicates",
+        "Location", "Upload-Offset", "Upload-Length", "Tus-Resumable",
+    ],
     max_age=3600,
 )
 
@@ -78,13 +98,14 @@ async def preflight_handler(request):
     return JSONResponse(content={"status": "ok"}, headers=get_cors_headers(request))
 
 
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", UploadFiles(directory=UPLOAD_DIR), name="uploads")
 
 app.include_router(auth.router, prefix="/api")
 app.include_router(items.router, prefix="/api")
 app.include_router(images.router, prefix="/api")
 app.include_router(analytics.router, prefix="/api")
 app.include_router(backups.router, prefix="/api")
+app.include_router(uploads.router, prefix="/api")
 app.include_router(ebay.router, prefix="/api")
 
 
@@ -93,6 +114,12 @@ async def health_check():
     return {"status": "healthy", "version": "2.0.0"}
 
 
+@app.get("/api/health/workers")
+async def worker_stats():
+    """Queue depth and throughput counters for the image worker pools."""
+    return workers.stats()
+
+
 def get_cors_headers(request):
     origin = request.headers.get("origin")
     if origin in CORS_ORIGINS:
@@ -101,7 +128,10 @@ def get_cors_headers(request):
             "Access-Control-Allow-Credentials": "true",
             "Access-Control-Allow-Methods": ", ".join(CORS_ALLOW_METHODS),
             "Access-Control-Allow-Headers": ", ".join(CORS_ALLOW_HEADERS),
-            "Access-Control-Expose-Headers": "Content-Type, Content-Disposition, Authorization",
+            "Access-Control-Expose-Headers": (
+                "Content-Type, Content-Disposition, Authorization, X-Possible-Duplicates, "
+                "Location, Upload-Offset, Upload-Length, Tus-Resumable"
+            ),
         }
     return {}
 
@@ -111,7 +141,7 @@ async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail, "status_code": exc.status_code},
-        headers=get_cors_headers(request),
+        headers={**(exc.headers or {}), **get_cors_headers(request)},
     )
 
 
@@ -81,9 +81,35 @@ class ItemImage(Base):
     item_id = Column(UUID, ForeignKey("items.id"))
     filename = Column(String)
     file_path = Column(String)
+    variants = Column(JSON)  # {"<width>": "uploads/<file>_<width>.webp"}
+    blob_sha256 = Column(String(64), ForeignKey("image_blobs.sha256"), index=True, nullable=True)
+    # Display metadata extracted at ingest so clients can lay out and paint
+    # placeholders before the image itself downloads.
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    byte_size = Column(Integer, nullable=True)
+    format = Column(String, nullable=True)
+    dominant_color = Column(String, nullable=True)  # "#rrggbb"
+    blurhash = Column(String, nullable=True)
+    phash = Column(String(16), nullable=True)  # 64-bit dHash, hex; see app/duplicates.py
     created_at = Column(DateTime, default=datetime.utcnow)
     
     item = relationship("Item", back_populates="images")
+    blob = relationship("ImageBlob")
+
+IMAGE_METADATA_FIELDS = ("width", "height", "byte_size", "format", "dominant_color", "blurhash", "phash")
+
+class ImageBlob(Base):
+    """Deduplicated image file, shared by every ItemImage with the same bytes."""
+    __tablename__ = "image_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    filename = Column(String)
+    file_path = Column(String)
+    size_bytes = Column(Integer)
+    ref_count = Column(Integer, nullable=False, default=0)
+    variants = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class Backup(Base):
     __tablename__ = "backups"
@@ -98,5 +124,55 @@ class Backup(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String)  # 'completed', 'failed', 'in_progress'
     error_message = Column(String, nullable=True)
+    # Progress of an in_progress backup: items serialized so far, image
+    # bytes added to the archive, and the estimated total of those bytes.
+    progress_items = Column(Integer, nullable=False, default=0)
+    progress_bytes = Column(Integer, nullable=False, default=0)
+    total_bytes = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 'full', or 'incremental' on top of parent_id (see app/backup_archive.py).
+    kind = Column(String, nullable=False, default="full")
+    parent_id = Column(UUID, ForeignKey("backups.id"), nullable=True, index=True)
+    # 'zip', or 'repository' when file_path is a snapshot manifest whose
+    # data lives in the chunk store (see app/backup_repository.py).
+    storage = Column(String, nullable=False, default="zip")
     
     owner = relationship("User", back_populates="backups")
+
+
+class BackupPack(Base):
+    """A pack file in the backup repository holding many chunks."""
+    __tablename__ = "backup_packs"
+
+    id = Column(String(32), primary_key=True)
+    size_bytes = Column(Integer, nullable=False)
+    live_bytes = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BackupChunk(Base):
+    """A content-defined chunk, shared by every snapshot that contains it."""
+    __tablename__ = "backup_chunks"
+
+    sha256 = Column(String(64), primary_key=True)
+    pack_id = Column(String(32), ForeignKey("backup_packs.id"), nullable=False, index=True)
+    offset = Column(Integer, nullable=False)
+    length = Column(Integer, nullable=False)  # bytes in the pack
+    raw_length = Column(Integer, nullable=False)
+    compressed = Column(Boolean, nullable=False, default=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+
+
+class UploadSession(Base):
+    """A resumable upload in progress; see app/routers/uploads.py."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(UUID, primary_key=True, default=uuid.uuid4)
+    owner_id = Column(UUID, ForeignKey("users.id"), index=True)
+    kind = Column(String, nullable=False)  # 'image' or 'backup'
+    item_id = Column(UUID, ForeignKey("items.id"), nullable=True)
+    filename = Column(String)
+    size_bytes = Column(Integer, nullable=False)
+    received_bytes = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,16 +1,16 @@
+import asyncio
 import json
 import logging
 import os
 import shutil
 import zipfile
-from datetime import datetime
-from typing import List
+from typing import Iterator, List, Literal, Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .. import models, schemas
+from .. import backup_archive, backup_jobs, backup_repository, backup_restore, models, schemas, storage, workers
 from ..database import get_db
 from ..security import get_current_active_user
 from ..settings import settings
@@ -23,131 +23,119 @@ BACKUP_DIR = str(settings.backup_path)
 os.makedirs(BACKUP_DIR, exist_ok=True)
 logger.info("backup directory: %s", BACKUP_DIR)
 
+SSE_POLL_SECONDS = 1.0
 
-async def create_backup_file(
-    user_id: str,
-    db: Session,
-    backup_record: models.Backup
-) -> None:
-    try:
-        logger.info("starting backup for user %s", user_id)
-        items = db.query(models.Item).filter(models.Item.owner_id == user_id).all()
-
-        temp_dir = os.path.join(BACKUP_DIR, f"temp_{user_id}")
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Prepare the data structure
-        backup_data = {
-            "items": [],
-            "created_at": datetime.utcnow().isoformat(),
-            "version": "1.0"
-        }
-        
-        # Create images directory in the temp folder
-        images_dir = os.path.join(temp_dir, "images")
-        os.makedirs(images_dir, exist_ok=True)
-        
-        image_count = 0
-        # Process each item and its images
-        for item in items:
-            item_data = {
-                "id": str(item.id),
-                "name": item.name,
-                "category": item.category,
-                "location": item.location,
-                "brand": item.brand,
-                "model_number": item.model_number,
-                "serial_number": item.serial_number,
-                "purchase_date": item.purchase_date.isoformat() if item.purchase_date else None,
-                "purchase_price": item.purchase_price,
-                "current_value": item.current_value,
-                "warranty_expiration": item.warranty_expiration.isoformat() if item.warranty_expiration else None,
-                "notes": item.notes,
-                "custom_fields": item.custom_fields,
-                "created_at": item.created_at.isoformat(),
-                "updated_at": item.updated_at.isoformat(),
-                "images": []
-            }
-            
-            # Process images
-            for image in item.images:
-                image_count += 1
-                # Copy image file to backup directory
-                if os.path.exists(image.file_path):
-                    backup_image_path = os.path.join(images_dir, image.filename)
-                    shutil.copy2(image.file_path, backup_image_path)
-                    item_data["images"].append({
-                        "id": str(image.id),
-                        "filename": image.filename,
-                        "created_at": image.created_at.isoformat()
-                    })
-            
-            backup_data["items"].append(item_data)
-        
-        # Write the JSON data
-        with open(os.path.join(temp_dir, "data.json"), "w") as f:
-            json.dump(backup_data, f, indent=2)
-        
-        # Create the zip file
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        zip_filename = f"backup_{user_id}_{timestamp}.zip"
-        zip_path = os.path.join(BACKUP_DIR, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zf.write(file_path, arcname)
-        
-        # Update backup record
-        backup_record.filename = zip_filename
-        backup_record.file_path = zip_path
-        backup_record.size_bytes = os.path.getsize(zip_path)
-        backup_record.item_count = len(items)
-        backup_record.image_count = image_count
-        backup_record.status = "completed"
-        db.commit()
-        
-        # Cleanup
-        shutil.rmtree(temp_dir)
-        
-    except Exception as exc:
-        logger.exception("error during backup creation")
-        backup_record.status = "failed"
-        backup_record.error_message = str(exc)
-        db.commit()
-        raise
 
-@router.post("/backups", response_model=schemas.Backup)
+def _get_backup(db: Session, backup_id: str, owner: models.User) -> models.Backup:
+    backup = db.query(models.Backup).filter(
+        models.Backup.id == backup_id,
+        models.Backup.owner_id == owner.id
+    ).first()
+    if not backup:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return backup
+
+
+def _reject_in_progress(backup: models.Backup) -> None:
+    if backup.status == "in_progress":
+        raise HTTPException(status_code=409, detail="Backup is still being created")
+
+
+@router.post("/backups", response_model=schemas.Backup, status_code=202)
 async def create_backup(
     background_tasks: BackgroundTasks,
+    mode: Literal["full", "incremental"] = "full",
+    format: Optional[Literal["zip", "repository", "tar.zst"]] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
+    """Start a backup job; poll ``/backups/{id}/progress`` or ``/events``.
+
+    ``mode=incremental`` archives only what changed since the latest
+    completed backup. ``format`` overrides ``BACKUP_FORMAT``; repository
+    snapshots and tar.zst archives are always full, so an incremental
+    request for them takes a full backup, as it does with no parent.
+    """
+    storage_format = format or settings.BACKUP_FORMAT
+    if storage_format == "tar.zst" and backup_archive.zstandard is None:
+        raise HTTPException(status_code=400, detail="tar.zst backups need the zstandard package")
     owner_id = str(current_user.id) if not isinstance(current_user.id, str) else current_user.id
-    backup = None
+    running = db.query(models.Backup.id).filter(
+        models.Backup.owner_id == current_user.id,
+        models.Backup.status == "in_progress"
+    ).first()
+    if running:
+        raise HTTPException(status_code=409, detail=f"Backup {running[0]} is already in progress")
     try:
-        backup = models.Backup(owner_id=owner_id, status="in_progress")
-        db.add(backup)
-        db.flush()
-        db.commit()
-        db.refresh(backup)
+        backup = backup_jobs.start_backup(
+            db, owner_id, incremental=mode == "incremental", storage=storage_format
+        )
     except Exception:
         logger.exception("failed to create backup record")
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to create backup record")
 
+    # Runs in a worker thread after the response is sent, with its own session.
+    background_tasks.add_task(backup_jobs.run_backup, db.get_bind(), backup.id)
+    return backup
+
+@router.get("/backups/{backup_id}/progress", response_model=schemas.BackupProgress)
+async def get_backup_progress(
+    backup_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return _get_backup(db, backup_id, current_user)
+
+def _progress_snapshot(bind, backup_id) -> dict:
+    db = Session(bind=bind)
     try:
-        await create_backup_file(owner_id, db, backup)
-        db.refresh(backup)
-        return backup
-    except Exception:
-        logger.exception("backup creation failed")
-        backup.status = "failed"
-        backup.error_message = "Failed to create backup"
-        db.commit()
-        raise HTTPException(status_code=500, detail="Failed to create backup")
+        backup = db.query(models.Backup).filter(models.Backup.id == backup_id).first()
+        if backup is None:
+            return {"status": "deleted"}
+        return schemas.BackupProgress.model_validate(backup).model_dump(mode="json")
+    finally:
+        db.close()
+
+@router.get("/backups/{backup_id}/events")
+async def stream_backup_progress(
+    backup_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Server-sent ``progress`` events until the backup stops running."""
+    backup_uuid = _get_backup(db, backup_id, current_user).id
+    bind = db.get_bind()
+
+    async def events():
+        last = None
+        while True:
+            snapshot = await workers.run_io(_progress_snapshot, bind, backup_uuid)
+            if snapshot != last:
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+                last = snapshot
+            if snapshot["status"] != "in_progress" or await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/backups/repository", response_model=schemas.BackupRepositoryStats)
+def get_repository_stats(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """What the caller's snapshots take up in the shared chunk store.
+
+    A plain ``def``: it reads every snapshot manifest, so it runs in the
+    threadpool rather than on the event loop.
+    """
+    return backup_repository.repository_stats(db, current_user.id)
 
 @router.get("/backups", response_model=schemas.BackupList)
 async def list_backups(
@@ -174,149 +162,116 @@ async def list_backups(
 @router.post("/backups/{backup_id}/restore", response_model=schemas.RestoreResponse)
 async def restore_backup(
     backup_id: str,
+    mode: Literal["replace", "merge"] = "replace",
+    delete_missing: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    backup = db.query(models.Backup).filter(
-        models.Backup.id == backup_id,
-        models.Backup.owner_id == current_user.id
-    ).first()
-    
-    if not backup:
-        raise HTTPException(status_code=404, detail="Backup not found")
+    """Restore the user's items from a backup.
+
+    ``mode=replace`` swaps in the backup's items under new ids;
+    ``mode=merge`` keeps the archived ids and writes only items that
+    changed, deleting items the backup lacks if ``delete_missing``.
+    """
+    backup = _get_backup(db, backup_id, current_user)
+    _reject_in_progress(backup)
+    chain = None
+    if backup.kind == "incremental":
+        try:
+            chain = backup_jobs.backup_chain(db, backup)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
     
     try:
-        # Create a temporary directory for restoration
-        temp_dir = os.path.join(BACKUP_DIR, f"restore_{current_user.id}")
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Extract the backup
-        with zipfile.ZipFile(backup.file_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        
-        # Read the backup data
-        with open(os.path.join(temp_dir, "data.json")) as f:
-            backup_data = json.load(f)
-        
-        items_restored = 0
-        images_restored = 0
-        errors = []
-        
-        # Clear existing items
-        db.query(models.Item).filter(models.Item.owner_id == current_user.id).delete()
-        
-        # Restore items and images
-        for item_data in backup_data["items"]:
-            try:
-                # Create new item
-                new_item = models.Item(
-                    owner_id=current_user.id,
-                    name=item_data["name"],
-                    category=item_data["category"],
-                    location=item_data["location"],
-                    brand=item_data["brand"],
-                    model_number=item_data["model_number"],
-                    serial_number=item_data["serial_number"],
-                    purchase_date=datetime.fromisoformat(item_data["purchase_date"]) if item_data["purchase_date"] else None,
-                    purchase_price=item_data["purchase_price"],
-                    current_value=item_data["current_value"],
-                    warranty_expiration=datetime.fromisoformat(item_data["warranty_expiration"]) if item_data["warranty_expiration"] else None,
-                    notes=item_data["notes"],
-                    custom_fields=item_data["custom_fields"]
-                )
-                db.add(new_item)
-                db.flush()  # Get the new item ID
-                
-                # Restore images
-                upload_dir = str(settings.upload_path)
-                os.makedirs(upload_dir, exist_ok=True)
-                for image_data in item_data["images"]:
-                    backup_image_path = os.path.join(temp_dir, "images", image_data["filename"])
-                    if os.path.exists(backup_image_path):
-                        on_disk_path = os.path.join(upload_dir, image_data["filename"])
-                        shutil.copy2(backup_image_path, on_disk_path)
-
-                        new_image = models.ItemImage(
-                            item_id=new_item.id,
-                            filename=image_data["filename"],
-                            file_path=os.path.join("uploads", image_data["filename"]),
-                        )
-                        db.add(new_image)
-                        images_restored += 1
-                
-                items_restored += 1
-                
-            except Exception as e:
-                errors.append(f"Error restoring item {item_data['name']}: {str(e)}")
-        
-        db.commit()
-        
-        # Cleanup
-        shutil.rmtree(temp_dir)
-        
-        return {
-            "success": True,
-            "message": "Backup restored successfully",
-            "items_restored": items_restored,
-            "images_restored": images_restored,
-            "errors": errors if errors else None
-        }
-        
+        result = await workers.run_io(
+            _restore_backup, db.get_bind(), backup.id, current_user.id,
+            [link.file_path for link in chain] if chain else None, mode, delete_missing,
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error restoring backup: {str(e)}"
         )
+    return {
+        "success": True,
+        "message": "Backup restored successfully",
+        "items_restored": result.items_restored,
+        "images_restored": result.images_restored,
+        "items_unchanged": result.items_unchanged if mode == "merge" else None,
+        "items_deleted": result.items_deleted if mode == "merge" else None,
+        "errors": result.errors or None
+    }
 
-@router.post("/backups/upload")
-async def upload_backup(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
-):
-    if not file.filename.endswith('.zip'):
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid file format. Only .zip files are allowed."
+def _restore_backup(bind, backup_id, owner_id, chain_paths, mode, delete_missing) -> backup_restore.RestoreResult:
+    """Run a restore in a worker thread with its own session, so the event
+    loop keeps serving reads while images are hashed and items staged."""
+    db = Session(bind=bind, autoflush=False)
+    temp_dir = os.path.join(BACKUP_DIR, f"restore_{owner_id}")
+    try:
+        backup = db.get(models.Backup, backup_id)
+        # An incremental backup is restored from its chain folded into one
+        # synthetic full archive, a repository snapshot from a rebuilt one;
+        # everything else is read in place.
+        archive_path = backup.file_path
+        if chain_paths or backup.storage == "repository":
+            os.makedirs(temp_dir, exist_ok=True)
+            archive_path = os.path.join(temp_dir, "restore.zip")
+            if chain_paths:
+                backup_archive.merge_chain(chain_paths, archive_path)
+            else:
+                backup_repository.materialize(db, backup, archive_path)
+
+        result, doomed = backup_restore.restore_archive(
+            db, owner_id, archive_path, tar=backup.storage == "tar.zst",
+            mode=mode, delete_missing=delete_missing,
         )
+        db.commit()
+        storage.remove_unreferenced(db, doomed)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    try:
+        backup_restore.render_missing_variants(db, owner_id)
+        return result
+    finally:
+        db.close()
 
-    # Create a temporary directory for validation
-    temp_dir = os.path.join(BACKUP_DIR, f"upload_{current_user.id}")
-    os.makedirs(temp_dir, exist_ok=True)
 
+def _stream_snapshot(bind, backup_id) -> Iterator[bytes]:
+    db = Session(bind=bind)
     try:
-        # Save the uploaded file
-        file_path = os.path.join(BACKUP_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Try to extract and validate the backup
-        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-
-        # Check for required backup structure
-        data_file = os.path.join(temp_dir, "data.json")
-        if not os.path.exists(data_file):
-            raise ValueError("Invalid backup file: missing data.json")
-
-        # Read and validate backup data
-        with open(data_file) as f:
-            backup_data = json.load(f)
-            if not isinstance(backup_data, dict) or 'items' not in backup_data:
-                raise ValueError("Invalid backup data structure")
-
-        # Count items and images
-        item_count = len(backup_data['items'])
-        image_count = sum(len(item.get('images', [])) for item in backup_data['items'])
+        backup = db.get(models.Backup, backup_id)
+        yield from backup_repository.iter_zip(db, backup)
+    except Exception:
+        # Headers are already sent; the client sees a truncated archive.
+        logger.exception("error rebuilding backup snapshot %s", backup_id)
+        raise
+    finally:
+        db.close()
+
+async def register_archive(db: Session, owner_id, file_path: str, filename: str) -> models.Backup:
+    """Validate an archive already saved in BACKUP_DIR and record it.
+
+    Nothing is extracted: see ``backup_restore.summarize_archive``, which
+    runs in the io pool since it may stream all of ``data.json``. The
+    archive is removed again if it is not a usable backup. Raises
+    HTTPException on failure.
+    """
+    try:
+        summary = await workers.run_io(backup_restore.summarize_archive, file_path)
+        if summary.kind == "incremental":
+            raise ValueError("Incremental backups cannot be uploaded without the backups they build on")
 
         # Create backup record
         backup = models.Backup(
-            owner_id=current_user.id,
-            filename=file.filename,
+            owner_id=owner_id,
+            filename=filename,
             file_path=file_path,
             size_bytes=os.path.getsize(file_path),
-            item_count=item_count,
-            image_count=image_count,
+            item_count=summary.item_count,
+            image_count=summary.image_count,
             status="completed"
         )
         db.add(backup)
@@ -341,25 +296,58 @@ async def upload_backup(
             status_code=500,
             detail=f"Error processing backup file: {str(e)}"
         )
-    finally:
-        # Clean up temporary directory
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+
+
+def _save_upload(src, file_path: str) -> None:
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(src, buffer, 1024 * 1024)
+
+@router.post("/backups/upload")
+async def upload_backup(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    if not file.filename.endswith('.zip'):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file format. Only .zip files are allowed."
+        )
+
+    # Save the uploaded file
+    file_path = os.path.join(BACKUP_DIR, file.filename)
+    try:
+        await workers.run_io(_save_upload, file.file, file_path)
+    except Exception as e:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing backup file: {str(e)}"
+        )
+    return await register_archive(db, current_user.id, file_path, file.filename)
 
 @router.delete("/backups/{backup_id}")
-async def delete_backup(
+def delete_backup(
     backup_id: str,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    backup = db.query(models.Backup).filter(
-        models.Backup.id == backup_id,
-        models.Backup.owner_id == current_user.id
-    ).first()
-    
-    if not backup:
-        raise HTTPException(status_code=404, detail="Backup not found")
+    # Sync on purpose: pruning a snapshot waits for the repository lock,
+    # which a running snapshot holds for its whole chunking pass.
+    backup = _get_backup(db, backup_id, current_user)
+    _reject_in_progress(backup)
+    dependent = db.query(models.Backup.id).filter(models.Backup.parent_id == backup.id).first()
+    if dependent:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Incremental backup {dependent[0]} builds on this backup; delete it first"
+        )
     
+    if backup.storage == "repository":
+        backup_repository.delete_snapshot(db, backup)
+        return {"message": "Backup deleted successfully"}
+
     # Delete the backup file if it exists
     if os.path.exists(backup.file_path):
         os.remove(backup.file_path)
@@ -392,10 +380,19 @@ async def download_backup(
         logger.error("backup file not readable: %s", backup.file_path)
         raise HTTPException(status_code=500, detail="Backup file is not readable")
 
+    if backup.storage == "repository":
+        # Snapshots are rebuilt into a regular archive as it is sent. The
+        # sync generator is iterated in the threadpool, off the event loop.
+        return StreamingResponse(
+            _stream_snapshot(db.get_bind(), backup.id),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{backup.filename}"'},
+        )
+
     try:
         response = FileResponse(
             backup.file_path,
-            media_type="application/zip",
+            media_type="application/zstd" if backup.storage == "tar.zst" else "application/zip",
             filename=backup.filename,
         )
         response.headers["Content-Disposition"] = f'attachment; filename="{backup.filename}"'
@@ -1,16 +1,19 @@
-import io
+import asyncio
+import hashlib
 import logging
 import os
+import tempfile
 import uuid
-from datetime import datetime
-from typing import Any, List
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from PIL import Image, UnidentifiedImageError
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.responses import FileResponse
+from PIL import UnidentifiedImageError
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
 
-from .. import database, models, schemas, security
+from .. import database, duplicates, image_cache, imaging, models, schemas, security, storage, workers
 from ..settings import settings
 
 logger = logging.getLogger(__name__)
@@ -20,6 +23,8 @@ router = APIRouter(tags=["images"])
 UPLOAD_DIR = str(settings.upload_path)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
 ALLOWED_PIL_FORMATS = {"JPEG", "PNG", "WEBP", "HEIC", "HEIF"}
 EXT_BY_FORMAT = {
     "JPEG": ".jpg",
@@ -30,45 +35,327 @@ EXT_BY_FORMAT = {
 }
 
 
-def _validate_image_bytes(data: bytes) -> str:
-    """Return the normalized Pillow format name, or raise HTTPException."""
-    if len(data) == 0:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty")
-    if len(data) > settings.MAX_UPLOAD_BYTES:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File exceeds maximum size of {settings.MAX_UPLOAD_BYTES} bytes",
+async def _process_image(relpath: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Render variants and extract display metadata in the process pool.
+
+    A decode failure leaves the upload usable (clients fall back to the
+    original and to header-derived metadata) and is only logged.
+    ``WorkerBusy`` propagates: blobs are deduplicated, so one stored without
+    variants would never get them from a later upload of the same bytes.
+    """
+    file_path = os.path.join(UPLOAD_DIR, relpath)
+    try:
+        written, metadata = await workers.run_cpu(
+            imaging.process_image,
+            file_path,
+            list(settings.IMAGE_VARIANT_WIDTHS),
+            settings.IMAGE_VARIANT_QUALITY,
         )
+    except workers.WorkerBusy:
+        raise
+    except Exception:
+        logger.warning("could not generate variants for %s", file_path, exc_info=True)
+        return {}, {}
+    directory = os.path.dirname(relpath)
+    variants = {width: storage.public_path(os.path.join(directory, name)) for width, name in written.items()}
+    return variants, metadata
+
+
+def _move_into_place(tmp_path: str, file_path: str) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    os.replace(tmp_path, file_path)
+
+
+def _temp_upload_file() -> Tuple[int, str]:
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=UPLOAD_DIR)
+    # mkstemp creates 0600; finalized blobs must stay readable by the static
+    # file server like files written with open() were.
+    os.fchmod(fd, 0o644)
+    return fd, tmp_path
+
+
+def _hash_file(path: str) -> Tuple[int, str]:
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            sha.update(chunk)
+    return size, sha.hexdigest()
+
+
+async def _stream_to_temp(file: UploadFile) -> Tuple[str, int, str]:
+    """Copy an upload into a temp file inside UPLOAD_DIR, chunk by chunk.
+
+    Returns ``(temp_path, size, sha256_hex)``. The size cap is enforced as
+    bytes arrive, so an oversized upload is rejected after at most one chunk
+    past the limit instead of after buffering the whole body. The temp file
+    lives on the same filesystem as the blob store so finalizing is a rename.
+    """
+    fd, tmp_path = _temp_upload_file()
+    sha = hashlib.sha256()
+    size = 0
     try:
-        with Image.open(io.BytesIO(data)) as img:
-            img.verify()
-        # verify() leaves the image unusable for further ops; reopen for dimension check.
-        with Image.open(io.BytesIO(data)) as img:
-            fmt = (img.format or "").upper()
-            if fmt not in ALLOWED_PIL_FORMATS:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Unsupported image format: {fmt or 'unknown'}",
-                )
-            width, height = img.size
-            if max(width, height) > settings.MAX_IMAGE_DIMENSION:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Image dimensions exceed {settings.MAX_IMAGE_DIMENSION}px",
-                )
-            return fmt
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > settings.MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds maximum size of {settings.MAX_UPLOAD_BYTES} bytes",
+                    )
+                sha.update(chunk)
+                await workers.run_io(buffer.write, chunk)
+    except BaseException:
+        await workers.run_io(storage.remove_files, [tmp_path])
+        raise
+    return tmp_path, size, sha.hexdigest()
+
+
+async def _validate_image_file(path: str, size: int) -> Tuple[str, int, int]:
+    """Return ``(format, width, height)``, or raise HTTPException.
+
+    ``Image.open`` only parses the header, which is enough to identify the
+    format and dimensions without decoding pixel data. Truncated or corrupt
+    pixel data is caught later, when variants are rendered.
+    """
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    try:
+        fmt, width, height = await workers.run_io(imaging.probe_image, path)
     except UnidentifiedImageError:
         raise HTTPException(status_code=400, detail="File is not a valid image")
-    except HTTPException:
-        raise
     except Exception as exc:  # noqa: BLE001 - surface Pillow parse failures as 400
         logger.warning("image validation failed: %s", exc)
         raise HTTPException(status_code=400, detail="File is not a valid image")
+    if fmt not in ALLOWED_PIL_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported image format: {fmt or 'unknown'}",
+        )
+    if max(width, height) > settings.MAX_IMAGE_DIMENSION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Image dimensions exceed {settings.MAX_IMAGE_DIMENSION}px",
+        )
+    return fmt, width, height
+
+
+@dataclass
+class _StagedUpload:
+    """A validated upload sitting in its temp file, not yet in the store."""
+    tmp_path: str
+    size: int
+    digest: str
+    format: str
+    width: int
+    height: int
+    # The upload as sent, when re-encoding replaced it and originals are kept.
+    original_path: Optional[str] = None
+    original_extension: str = ""
+
+    @property
+    def extension(self) -> str:
+        return EXT_BY_FORMAT.get(self.format, ".bin")
+
+    def temp_files(self) -> List[str]:
+        return [path for path in (self.tmp_path, self.original_path) if path]
+
+    def header_metadata(self) -> Dict[str, Any]:
+        return {"width": self.width, "height": self.height, "byte_size": self.size, "format": self.format}
+
+
+@dataclass
+class _StoredBlob:
+    variants: Dict[str, str]
+    metadata: Dict[str, Any]
+    is_new: bool
+    written: List[str] = field(default_factory=list)
+
+
+def _ensure_capacity() -> None:
+    # Shed load before reading the body when the image pool is backed up,
+    # rather than accepting work that would only queue behind it.
+    if workers.cpu_pool.saturated():
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing is busy, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def _reencode(staged: _StagedUpload) -> _StagedUpload:
+    """Apply the ``IMAGE_INGEST_FORMAT`` policy to a validated upload.
+
+    Returns ``staged`` untouched when the policy is off. Otherwise the
+    re-encoded copy becomes the upload, and the bytes as sent either ride
+    along for cold storage or are dropped.
+    """
+    fmt = settings.IMAGE_INGEST_FORMAT
+    if not fmt:
+        return staged
+    fd, out_path = _temp_upload_file()
+    os.close(fd)
+    try:
+        pil_format, width, height = await workers.run_cpu(
+            imaging.reencode_image,
+            staged.tmp_path,
+            out_path,
+            fmt,
+            settings.IMAGE_INGEST_QUALITY,
+            settings.IMAGE_INGEST_MAX_EDGE,
+        )
+        size, digest = await workers.run_io(_hash_file, out_path)
+    except workers.WorkerBusy:
+        await workers.run_io(storage.remove_files, [out_path])
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing is busy, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    except Exception:
+        logger.warning("could not re-encode upload %s", staged.tmp_path, exc_info=True)
+        await workers.run_io(storage.remove_files, [out_path])
+        raise HTTPException(status_code=400, detail="File is not a valid image")
+
+    original_path = staged.tmp_path if settings.originals_path is not None else None
+    if original_path is None:
+        await workers.run_io(storage.remove_files, [staged.tmp_path])
+    return _StagedUpload(
+        out_path, size, digest, pil_format, width, height,
+        original_path=original_path,
+        original_extension=staged.extension,
+    )
+
+
+async def _stage_file(tmp_path: str, size: int, digest: str) -> _StagedUpload:
+    """Validate (and re-encode) a file in UPLOAD_DIR; it is removed on failure."""
+    try:
+        pil_format, width, height = await _validate_image_file(tmp_path, size)
+        return await _reencode(_StagedUpload(tmp_path, size, digest, pil_format, width, height))
+    except HTTPException:
+        await workers.run_io(storage.remove_files, [tmp_path])
+        raise
+
+
+async def _stage_upload(file: UploadFile) -> _StagedUpload:
+    tmp_path, size, digest = await _stream_to_temp(file)
+    return await _stage_file(tmp_path, size, digest)
+
+
+def _keep_original(staged: _StagedUpload) -> List[str]:
+    """Move the pre-encoding upload into cold storage; returns paths written."""
+    if not staged.original_path:
+        return []
+    target = storage.original_path(staged.digest, staged.original_extension)
+    if target is None or os.path.exists(target):
+        storage.remove_files([staged.original_path])
+        return []
+    _move_into_place(staged.original_path, target)
+    return [target]
+
+
+async def _store_blob(db: Session, staged: _StagedUpload) -> _StoredBlob:
+    """Move a staged upload into the blob store and render its variants."""
+    # Identical bytes already on disk: reuse the blob and skip the write and
+    # the variant rendering entirely.
+    existing = storage.find_blob(db, staged.digest)
+    if existing is not None:
+        await workers.run_io(storage.remove_files, staged.temp_files())
+        sibling = db.query(models.ItemImage).filter(
+            models.ItemImage.blob_sha256 == staged.digest
+        ).first()
+        metadata = staged.header_metadata()
+        if sibling is not None:
+            metadata.update({
+                name: getattr(sibling, name)
+                for name in models.IMAGE_METADATA_FIELDS
+                if getattr(sibling, name) is not None
+            })
+        return _StoredBlob(variants=existing.variants or {}, metadata=metadata, is_new=False)
+
+    relpath = storage.blob_relpath(staged.digest, staged.extension)
+    file_path = os.path.join(UPLOAD_DIR, relpath)
+    try:
+        await workers.run_io(_move_into_place, staged.tmp_path, file_path)
+        originals = await workers.run_io(_keep_original, staged)
+    except OSError as exc:
+        logger.exception("failed moving upload into place at %s", file_path)
+        await workers.run_io(storage.remove_files, staged.temp_files() + [file_path])
+        raise HTTPException(status_code=500, detail="Could not persist upload") from exc
+    try:
+        variants, metadata = await _process_image(relpath)
+    except workers.WorkerBusy:
+        # The session stays on the loop thread; batch siblings share it.
+        storage.remove_unreferenced(db, [file_path] + originals)
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing is busy, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    written = [file_path] + [storage.absolute_path(path) for path in variants.values()] + originals
+    return _StoredBlob(
+        variants=variants,
+        metadata={**staged.header_metadata(), **metadata},
+        is_new=True,
+        written=written,
+    )
+
+
+def _record_image(
+    db: Session,
+    item_id: uuid.UUID,
+    staged: _StagedUpload,
+    stored: _StoredBlob,
+) -> models.ItemImage:
+    """Add the blob reference and ItemImage row; the caller commits."""
+    blob = storage.acquire_blob(db, staged.digest, staged.extension, staged.size)
+    if stored.is_new:
+        blob.variants = stored.variants
+    db_image = models.ItemImage(
+        item_id=item_id,
+        filename=blob.filename,
+        file_path=blob.file_path,
+        variants=stored.variants,
+        blob_sha256=staged.digest,
+        **{name: stored.metadata.get(name) for name in models.IMAGE_METADATA_FIELDS},
+    )
+    db.add(db_image)
+    return db_image
+
+
+def _flag_duplicates(
+    db: Session,
+    owner_id: uuid.UUID,
+    images: List[models.ItemImage],
+    response: Response,
+) -> None:
+    """Name the owner's existing near-duplicates in ``X-Possible-Duplicates``.
+
+    Advisory only: the upload has already been stored, and any failure
+    here is logged rather than surfaced.
+    """
+    new_ids = {image.id for image in images}
+    similar: List[str] = []
+    try:
+        for image in images:
+            if not image.phash:
+                continue
+            for match in duplicates.find_similar(db, owner_id, image.phash, settings.IMAGE_DUPLICATE_DISTANCE):
+                if match not in new_ids and str(match) not in similar:
+                    similar.append(str(match))
+            duplicates.remember(owner_id, image.id, image.phash)
+    except Exception:
+        logger.warning("duplicate check failed for owner %s", owner_id, exc_info=True)
+        return
+    if similar:
+        response.headers["X-Possible-Duplicates"] = ",".join(similar)
 
 
 @router.post("/items/{item_id}/images", response_model=schemas.ItemImage)
 async def upload_item_image(
     item_id: uuid.UUID,
+    response: Response,
     file: UploadFile = File(...),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(security.get_current_active_user),
@@ -79,41 +366,168 @@ async def upload_item_image(
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
-    contents = await file.read()
-    pil_format = _validate_image_bytes(contents)
-
-    extension = EXT_BY_FORMAT.get(pil_format, ".bin")
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{uuid.uuid4()}{extension}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    _ensure_capacity()
+    staged = await _stage_upload(file)
+    db_image = await _ingest(db, item_id, staged)
+    _flag_duplicates(db, current_user.id, [db_image], response)
+    return db_image
 
-    try:
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
-    except OSError as exc:
-        logger.exception("failed writing upload to %s", file_path)
-        raise HTTPException(status_code=500, detail="Could not persist upload") from exc
 
+async def _ingest(db: Session, item_id: uuid.UUID, staged: _StagedUpload) -> models.ItemImage:
+    stored = await _store_blob(db, staged)
     try:
-        db_image = models.ItemImage(
-            item_id=item_id,
-            filename=filename,
-            file_path=os.path.join("uploads", filename),
-        )
-        db.add(db_image)
+        db_image = _record_image(db, item_id, staged, stored)
         db.commit()
         db.refresh(db_image)
         return db_image
     except Exception:
         logger.exception("failed creating image record for item %s", item_id)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except OSError:
-                logger.warning("could not clean up orphan file at %s", file_path)
+        db.rollback()
+        storage.remove_unreferenced(db, stored.written)
         raise HTTPException(status_code=500, detail="Could not create image record")
 
 
+async def ingest_file(
+    db: Session,
+    owner_id: uuid.UUID,
+    item_id: uuid.UUID,
+    path: str,
+    response: Response,
+) -> models.ItemImage:
+    """Run a complete file in UPLOAD_DIR through the normal upload pipeline.
+
+    Used by resumable uploads once every chunk has arrived. Past the
+    capacity check ``path`` is consumed: it ends up in the blob store or is
+    removed.
+    """
+    _ensure_capacity()
+    size, digest = await workers.run_io(_hash_file, path)
+    staged = await _stage_file(path, size, digest)
+    db_image = await _ingest(db, item_id, staged)
+    _flag_duplicates(db, owner_id, [db_image], response)
+    return db_image
+
+
+async def _upload_batch(
+    db: Session,
+    current_user: models.User,
+    files: List[UploadFile],
+    targets: List[uuid.UUID],
+) -> List[models.ItemImage]:
+    """Ingest ``files[i]`` for item ``targets[i]`` as one all-or-nothing batch."""
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > settings.MAX_BATCH_UPLOAD_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.MAX_BATCH_UPLOAD_FILES} files may be uploaded per batch",
+        )
+
+    owned = {
+        row[0] for row in db.query(models.Item.id).filter(
+            and_(models.Item.id.in_(set(targets)), models.Item.owner_id == current_user.id)
+        )
+    }
+    if owned != set(targets):
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    _ensure_capacity()
+    results = await asyncio.gather(*(_stage_upload(f) for f in files), return_exceptions=True)
+    staged = [r for r in results if isinstance(r, _StagedUpload)]
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            await workers.run_io(storage.remove_files, [path for s in staged for path in s.temp_files()])
+            if isinstance(result, HTTPException):
+                raise HTTPException(
+                    status_code=result.status_code,
+                    detail=f"{files[index].filename or f'file {index}'}: {result.detail}",
+                )
+            raise result
+
+    # Files with identical bytes are stored once; the extra temp copies are
+    # dropped and every row shares the first copy's blob.
+    unique: Dict[str, _StagedUpload] = {}
+    duplicates = []
+    for upload in staged:
+        if upload.digest in unique:
+            duplicates.extend(upload.temp_files())
+        else:
+            unique[upload.digest] = upload
+    await workers.run_io(storage.remove_files, duplicates)
+
+    # Rendering is admitted to the bounded image pool, so a large batch is
+    # fed to it a few blobs at a time rather than overflowing it at once.
+    rendering = asyncio.Semaphore(max(settings.IMAGE_WORKERS, 1))
+
+    async def store(upload: _StagedUpload) -> _StoredBlob:
+        async with rendering:
+            return await _store_blob(db, upload)
+
+    stored_results = await asyncio.gather(
+        *(store(upload) for upload in unique.values()), return_exceptions=True
+    )
+    written = [path for r in stored_results if isinstance(r, _StoredBlob) for path in r.written]
+    for result in stored_results:
+        if isinstance(result, BaseException):
+            storage.remove_unreferenced(db, written)
+            raise result
+    stored_by_digest = dict(zip(unique, stored_results))
+
+    try:
+        images = []
+        recorded = set()
+        for item_id, upload in zip(targets, staged):
+            stored = stored_by_digest[upload.digest]
+            if upload.digest in recorded:
+                stored = _StoredBlob(variants=stored.variants, metadata=stored.metadata, is_new=False)
+            recorded.add(upload.digest)
+            images.append(_record_image(db, item_id, upload, stored))
+        db.commit()
+        for image in images:
+            db.refresh(image)
+        return images
+    except Exception:
+        logger.exception("failed creating image records for batch upload")
+        db.rollback()
+        storage.remove_unreferenced(db, written)
+        raise HTTPException(status_code=500, detail="Could not create image records")
+
+
+@router.post("/items/{item_id}/images/batch", response_model=List[schemas.ItemImage])
+async def upload_item_images(
+    item_id: uuid.UUID,
+    response: Response,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    images = await _upload_batch(db, current_user, files, [item_id] * len(files))
+    _flag_duplicates(db, current_user.id, images, response)
+    return images
+
+
+@router.post("/images/batch", response_model=List[schemas.ItemImage])
+async def upload_images(
+    response: Response,
+    files: List[UploadFile] = File(...),
+    item_ids: List[uuid.UUID] = Form(...),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    """Upload files for several items. ``item_ids`` pairs with ``files`` by
+    position; a single ``item_ids`` value applies to every file."""
+    if len(item_ids) == 1:
+        item_ids = item_ids * len(files)
+    if len(item_ids) != len(files):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide one item_ids value, or one per uploaded file",
+        )
+    images = await _upload_batch(db, current_user, files, item_ids)
+    _flag_duplicates(db, current_user.id, images, response)
+    return images
+
+
 @router.get("/items/{item_id}/images", response_model=List[schemas.ItemImage])
 def list_item_images(
     item_id: uuid.UUID,
@@ -128,6 +542,70 @@ def list_item_images(
     return item.images
 
 
+@router.get("/images/duplicates", response_model=List[schemas.ImageDuplicateCluster])
+def list_duplicate_images(
+    max_distance: Optional[int] = Query(None, ge=0, le=32),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    """Clusters of the current user's visually near-identical images, largest first."""
+    if max_distance is None:
+        max_distance = settings.IMAGE_DUPLICATE_DISTANCE
+    groups = duplicates.clusters(db, current_user.id, max_distance)[:limit]
+    wanted = [image_id for group in groups for image_id in group]
+    images = {}
+    for start in range(0, len(wanted), 500):
+        for image in db.query(models.ItemImage).filter(models.ItemImage.id.in_(wanted[start:start + 500])):
+            images[image.id] = image
+    result = []
+    for group in groups:
+        members = [images[image_id] for image_id in group if image_id in images]
+        if len(members) > 1:
+            result.append({"images": members})
+    return result
+
+
+@router.get("/images/{image_id}")
+async def get_resized_image(
+    image_id: uuid.UUID,
+    w: Optional[int] = Query(None, ge=1, le=4096),
+    h: Optional[int] = Query(None, ge=1, le=4096),
+    fmt: str = Query("webp", pattern="^(webp|jpeg|png)$"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    """Serve the image fitted inside ``w`` x ``h`` (never upscaled) as ``fmt``."""
+    image = db.query(models.ItemImage).join(models.Item).filter(
+        and_(models.ItemImage.id == image_id, models.Item.owner_id == current_user.id)
+    ).first()
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    source_path = storage.absolute_path(image.file_path)
+    if not os.path.exists(source_path):
+        raise HTTPException(status_code=404, detail="Image file not found")
+
+    try:
+        rendered = await image_cache.get_resized(source_path, w, h, fmt)
+    except workers.WorkerBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing is busy, retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    except Exception:
+        logger.exception("could not render %s at %sx%s as %s", source_path, w, h, fmt)
+        raise HTTPException(status_code=500, detail="Could not render image")
+
+    # The source bytes behind an image id never change, so renders can be
+    # cached by the browser; "private" keeps shared proxies out of it.
+    return FileResponse(
+        rendered,
+        media_type=imaging.MEDIA_TYPES[fmt],
+        headers={"Cache-Control": "private, max-age=31536000, immutable"},
+    )
+
+
 @router.delete("/images/{image_id}")
 def delete_image(
     image_id: uuid.UUID,
@@ -140,13 +618,7 @@ def delete_image(
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    on_disk = os.path.join(UPLOAD_DIR, image.filename)
-    if os.path.exists(on_disk):
-        try:
-            os.remove(on_disk)
-        except OSError as exc:
-            logger.warning("could not remove image file %s: %s", on_disk, exc)
-
-    db.delete(image)
+    doomed = storage.release_images(db, [image])
     db.commit()
+    storage.remove_unreferenced(db, doomed)
     return {"status": "success"}
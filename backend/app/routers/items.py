@@ -10,9 +10,9 @@ from fastapi import APIRouter, Body, Depends, File, HTTPException, Query, Upload
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy import and_, or_
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-from .. import database, models, schemas, security
+from .. import catalog, database, models, schemas, security, storage
 
 logger = logging.getLogger(__name__)
 
@@ -218,6 +218,56 @@ async def lookup_by_barcode(
         )
     return item
 
+@router.get("/items/catalog/{barcode}", response_model=schemas.CatalogProduct, responses={404: {"model": schemas.Error}})
+def lookup_catalog_product(
+    barcode: str,
+    current_user: models.User = Depends(security.get_current_active_user_or_none)
+) -> Any:
+    if not current_user:
+        raise HTTPException(
+            status_code=401,
+            detail="Authentication required"
+        )
+    product_catalog = catalog.get_catalog()
+    if product_catalog is None:
+        raise HTTPException(status_code=404, detail="No product catalog is loaded")
+    product = product_catalog.lookup(barcode)
+    if product is None:
+        raise HTTPException(status_code=404, detail="No catalog product found with this barcode")
+    return {"barcode": barcode, **product}
+
+@router.post("/items/barcode/lookup", response_model=schemas.BarcodeLookupResult)
+def lookup_barcodes(
+    request: schemas.BarcodeLookupRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user_or_none)
+) -> Any:
+    if not current_user:
+        raise HTTPException(
+            status_code=401,
+            detail="Authentication required"
+        )
+
+    # Preserve the caller's scan order while collapsing repeated scans.
+    barcodes = list(dict.fromkeys(code.strip() for code in request.barcodes if code.strip()))
+    if not barcodes:
+        return {"items": [], "unknown": []}
+
+    # One IN query against ix_items_barcode; images are batch-loaded so the
+    # response serializer does not issue a query per item.
+    items = db.query(models.Item).options(selectinload(models.Item.images)).filter(
+        and_(
+            models.Item.barcode.in_(barcodes),
+            models.Item.owner_id == current_user.id
+        )
+    ).all()
+
+    found = {item.barcode for item in items}
+    return {
+        "items": items,
+        "unknown": [code for code in barcodes if code not in found]
+    }
+
 @router.get("/items/{item_id}", response_model=schemas.Item)
 def get_item(
     item_id: uuid.UUID,
@@ -283,8 +333,10 @@ def delete_item(
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
+    doomed = storage.release_item_images(db, [db_item.id])
     db.delete(db_item)
     db.commit()
+    storage.remove_unreferenced(db, doomed)
     return {"status": "success"}
 
 @router.post("/items/bulk-delete")
@@ -299,15 +351,22 @@ def bulk_delete_items(
             detail="Authentication required"
         )
     
-    # Delete all items that belong to the user
-    deleted_count = db.query(models.Item).filter(
+    # Only items that belong to the user
+    item_ids = [row[0] for row in db.query(models.Item.id).filter(
         and_(
             models.Item.id.in_(request.item_ids),
             models.Item.owner_id == current_user.id
         )
+    )]
+
+    # A bulk query delete skips ORM cascades, so release image blobs first.
+    doomed = storage.release_item_images(db, item_ids)
+    deleted_count = db.query(models.Item).filter(
+        models.Item.id.in_(item_ids)
     ).delete(synchronize_session=False)
     
     db.commit()
+    storage.remove_unreferenced(db, doomed)
     
     return {
         "status": "success",
@@ -0,0 +1,282 @@
+"""Resumable uploads for photos and backup archives.
+
+A tus-style protocol (https://tus.io/protocols/resumable-upload) reduced to
+what the app needs:
+
+1. ``POST /uploads`` declares the kind, total size and filename and returns
+   a session id.
+2. ``PATCH /uploads/{id}`` appends the request body at ``Upload-Offset``.
+   Bytes received before a dropped connection are kept, so the client
+   resumes from whatever offset ``HEAD /uploads/{id}`` reports.
+3. ``POST /uploads/{id}/finalize`` runs the assembled file through the same
+   validation and storage as ``POST /items/{id}/images`` or
+   ``POST /backups/upload``.
+
+Chunks are appended to ``.session-<id>.part`` inside ``UPLOAD_DIR`` or
+``BACKUP_DIR`` so finalizing is a rename on the same filesystem. Sessions
+idle for ``UPLOAD_SESSION_TTL_SECONDS`` are removed by the file GC.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from .. import database, models, schemas, security, storage, workers
+from ..settings import settings
+from . import backups, images
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["uploads"])
+
+TUS_VERSION = "1.0.0"
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+# Per-session lock and the number of requests holding or waiting for it.
+_locks: Dict[uuid.UUID, List] = {}
+
+
+def _progress_headers(session: models.UploadSession) -> Dict[str, str]:
+    return {
+        "Upload-Offset": str(session.received_bytes),
+        "Upload-Length": str(session.size_bytes),
+        "Tus-Resumable": TUS_VERSION,
+        "Cache-Control": "no-store",
+    }
+
+
+def _get_session(db: Session, session_id: uuid.UUID, owner: models.User) -> models.UploadSession:
+    session = db.query(models.UploadSession).filter(
+        and_(models.UploadSession.id == session_id, models.UploadSession.owner_id == owner.id)
+    ).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+@asynccontextmanager
+async def _locked_session(
+    db: Session, session_id: uuid.UUID, owner: models.User
+) -> AsyncIterator[models.UploadSession]:
+    """Serialize requests that change one upload session; yields the row.
+
+    A lock only exists for a session that was found and only while a request
+    holds or awaits it, so 404s and expired sessions leave nothing behind.
+    The row is re-read once the lock is held, since an earlier holder may
+    have advanced, finalized or aborted it.
+    """
+    _get_session(db, session_id, owner)
+    entry = _locks.setdefault(session_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            db.expire_all()
+            yield _get_session(db, session_id, owner)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _locks.pop(session_id, None)
+
+
+def _create_file(path: str) -> None:
+    with open(path, "wb"):
+        pass
+    os.chmod(path, 0o644)
+
+
+def _open_at(path: str, offset: int):
+    """Open the session file for appending at ``offset``, discarding any
+    bytes past it left by an interrupted write."""
+    f = open(path, "r+b")
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+def _close_session(db: Session, session_id: uuid.UUID) -> None:
+    db.query(models.UploadSession).filter(models.UploadSession.id == session_id).delete()
+    db.commit()
+
+
+@router.post("/uploads", response_model=schemas.UploadSession, status_code=201)
+def create_upload_session(
+    payload: schemas.UploadSessionCreate,
+    response: Response,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    if payload.kind == "image":
+        if payload.item_id is None:
+            raise HTTPException(status_code=400, detail="item_id is required for image uploads")
+        item = db.query(models.Item).filter(
+            and_(models.Item.id == payload.item_id, models.Item.owner_id == current_user.id)
+        ).first()
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        limit = settings.MAX_UPLOAD_BYTES
+    else:
+        if not payload.filename.endswith(".zip"):
+            raise HTTPException(status_code=400, detail="Invalid file format. Only .zip files are allowed.")
+        limit = settings.MAX_BACKUP_UPLOAD_BYTES
+    if payload.size_bytes > limit:
+        raise HTTPException(status_code=413, detail=f"File exceeds maximum size of {limit} bytes")
+
+    session = models.UploadSession(
+        owner_id=current_user.id,
+        kind=payload.kind,
+        item_id=payload.item_id,
+        filename=os.path.basename(payload.filename),
+        size_bytes=payload.size_bytes,
+        received_bytes=0,
+    )
+    db.add(session)
+    db.flush()
+    _create_file(storage.upload_session_path(session.kind, session.id))
+    db.commit()
+    db.refresh(session)
+    response.headers.update(_progress_headers(session))
+    response.headers["Location"] = f"/api/uploads/{session.id}"
+    return session
+
+
+@router.get("/uploads/{session_id}", response_model=schemas.UploadSession)
+def get_upload_session(
+    session_id: uuid.UUID,
+    response: Response,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    session = _get_session(db, session_id, current_user)
+    response.headers.update(_progress_headers(session))
+    return session
+
+
+@router.head("/uploads/{session_id}")
+def upload_session_progress(
+    session_id: uuid.UUID,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Response:
+    session = _get_session(db, session_id, current_user)
+    return Response(status_code=200, headers=_progress_headers(session))
+
+
+@router.patch("/uploads/{session_id}")
+async def append_upload_chunk(
+    session_id: uuid.UUID,
+    request: Request,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Response:
+    """Append the body at ``Upload-Offset``; answers 204 with the new offset."""
+    if request.headers.get("content-type", "").split(";")[0].strip() != CHUNK_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Chunks must be sent as {CHUNK_CONTENT_TYPE}")
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+
+    async with _locked_session(db, session_id, current_user) as session:
+        if offset != session.received_bytes:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Offset mismatch: upload is at byte {session.received_bytes}",
+                headers=_progress_headers(session),
+            )
+        try:
+            path = storage.upload_session_path(session.kind, session.id)
+            f = await workers.run_io(_open_at, path, session.received_bytes)
+        except FileNotFoundError:
+            raise HTTPException(status_code=410, detail="Upload session data is gone; start a new upload")
+
+        received = session.received_bytes
+        try:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if received + len(chunk) > session.size_bytes:
+                    received = session.received_bytes
+                    await workers.run_io(f.truncate, received)
+                    raise HTTPException(
+                        status_code=413,
+                        detail="Chunk extends past the declared upload size",
+                        headers=_progress_headers(session),
+                    )
+                await workers.run_io(f.write, chunk)
+                received += len(chunk)
+        except ClientDisconnect:
+            logger.info("upload %s interrupted at byte %d", session.id, received)
+        finally:
+            await workers.run_io(f.close)
+            if received != session.received_bytes:
+                session.received_bytes = received
+                db.commit()
+    return Response(status_code=204, headers=_progress_headers(session))
+
+
+@router.post("/uploads/{session_id}/finalize", response_model=schemas.UploadSessionResult)
+async def finalize_upload(
+    session_id: uuid.UUID,
+    response: Response,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    """Validate and store a fully received upload, then close the session."""
+    async with _locked_session(db, session_id, current_user) as session:
+        if session.received_bytes != session.size_bytes:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete: {session.received_bytes} of {session.size_bytes} bytes received",
+                headers=_progress_headers(session),
+            )
+        path = storage.upload_session_path(session.kind, session.id)
+        kind, item_id, filename = session.kind, session.item_id, session.filename
+        if kind == "image":
+            item = db.query(models.Item).filter(
+                and_(models.Item.id == item_id, models.Item.owner_id == current_user.id)
+            ).first()
+            if not item:
+                raise HTTPException(status_code=404, detail="Item not found")
+            try:
+                image = await images.ingest_file(db, current_user.id, item_id, path, response)
+            except HTTPException as exc:
+                # Only a 503 leaves the file in place for another attempt.
+                if exc.status_code != 503:
+                    _close_session(db, session_id)
+                raise
+            _close_session(db, session_id)
+            result = {"image": image}
+        else:
+            target = os.path.join(backups.BACKUP_DIR, filename)
+            if os.path.exists(target):
+                stem, extension = os.path.splitext(filename)
+                filename = f"{stem}_{uuid.uuid4().hex[:8]}{extension}"
+                target = os.path.join(backups.BACKUP_DIR, filename)
+            await workers.run_io(os.replace, path, target)
+            _close_session(db, session_id)
+            result = {"backup": await backups.register_archive(db, current_user.id, target, filename)}
+    return result
+
+
+@router.delete("/uploads/{session_id}")
+async def abort_upload(
+    session_id: uuid.UUID,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(security.get_current_active_user),
+) -> Any:
+    # Waits for an in-flight PATCH or finalize rather than removing the
+    # file under it.
+    async with _locked_session(db, session_id, current_user) as session:
+        path = storage.upload_session_path(session.kind, session.id)
+        db.delete(session)
+        db.commit()
+        await workers.run_io(storage.remove_files, [path])
+    return {"status": "success"}
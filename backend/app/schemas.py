@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, EmailStr, UUID4
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, UUID4
 
 
 class UserBase(BaseModel):
@@ -71,11 +71,23 @@ class ItemImage(BaseModel):
     item_id: UUID4
     filename: str
     file_path: str
+    variants: Optional[Dict[str, str]] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    byte_size: Optional[int] = None
+    format: Optional[str] = None
+    dominant_color: Optional[str] = None
+    blurhash: Optional[str] = None
+    phash: Optional[str] = None
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class ImageDuplicateCluster(BaseModel):
+    images: List[ItemImage]
+
+
 class Item(ItemBase):
     id: UUID4
     owner_id: UUID4
@@ -86,6 +98,24 @@ class Item(ItemBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class BarcodeLookupRequest(BaseModel):
+    barcodes: List[str] = Field(..., min_length=1, max_length=500)
+
+
+class BarcodeLookupResult(BaseModel):
+    items: List[Item]
+    unknown: List[str]
+
+
+class CatalogProduct(BaseModel):
+    """Prefill values for ItemCreate taken from the offline product catalog."""
+    barcode: str
+    name: str
+    brand: Optional[str] = None
+    model_number: Optional[str] = None
+    category: Optional[str] = None
+
+
 class SearchFilter(BaseModel):
     query: Optional[str] = None
     category: Optional[str] = None
@@ -126,6 +156,27 @@ class Backup(BackupBase):
     created_at: datetime
     status: str
     error_message: Optional[str] = None
+    progress_items: int = 0
+    progress_bytes: int = 0
+    total_bytes: Optional[int] = None
+    kind: str = "full"
+    parent_id: Optional[UUID4] = None
+    storage: str = "zip"
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BackupProgress(BaseModel):
+    id: UUID4
+    status: str
+    item_count: Optional[int] = None
+    image_count: Optional[int] = None
+    progress_items: int = 0
+    progress_bytes: int = 0
+    total_bytes: Optional[int] = None
+    size_bytes: Optional[int] = None
+    error_message: Optional[str] = None
+    updated_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -134,6 +185,14 @@ class BackupList(BaseModel):
     backups: List[Backup]
 
 
+class BackupRepositoryStats(BaseModel):
+    snapshots: int
+    packs: int
+    chunks: int
+    stored_bytes: int
+    logical_bytes: int
+
+
 class ImportResult(BaseModel):
     success: bool
     message: str
@@ -154,4 +213,31 @@ class RestoreResponse(BaseModel):
     message: str
     items_restored: Optional[int] = None
     images_restored: Optional[int] = None
+    items_unchanged: Optional[int] = None
+    items_deleted: Optional[int] = None
     errors: Optional[List[str]] = None
+
+
+class UploadSessionCreate(BaseModel):
+    kind: Literal["image", "backup"]
+    size_bytes: int = Field(..., gt=0)
+    filename: str = Field(..., min_length=1, max_length=255)
+    item_id: Optional[UUID4] = None
+
+
+class UploadSession(BaseModel):
+    id: UUID4
+    kind: str
+    item_id: Optional[UUID4] = None
+    filename: str
+    size_bytes: int
+    received_bytes: int
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class UploadSessionResult(BaseModel):
+    image: Optional[ItemImage] = None
+    backup: Optional[Backup] = None
@@ -1,6 +1,6 @@
 from functools import lru_cache
 from pathlib import Path
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
@@ -33,6 +33,7 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "./uploads"
     BACKUP_DIR: str = "./backups"
     DATABASE_URL: str = ""
+    CATALOG_PATH: str = "./catalog/products.idx"
 
     # CORS — NoDecode prevents pydantic-settings from JSON-decoding before
     # our validator splits the comma-separated env form.
@@ -46,24 +47,125 @@ class Settings(BaseSettings):
         default_factory=lambda: ["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"]
     )
     CORS_ALLOW_HEADERS: Annotated[List[str], NoDecode] = Field(
-        default_factory=lambda: ["Content-Type", "Authorization", "Accept", "Origin", "X-Requested-With"]
+        default_factory=lambda: ["Content-Type", "Authorization", "Accept", "Origin", "X-Requested-With", "Upload-Offset"]
     )
 
     # Upload limits
     MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024
     MAX_IMAGE_DIMENSION: int = 8000
+    MAX_BATCH_UPLOAD_FILES: int = 50
+    # Resumable uploads (/api/uploads). Archives may be far larger than
+    # photos; sessions idle past the TTL are dropped by the file GC.
+    MAX_BACKUP_UPLOAD_BYTES: int = 20 * 1024 * 1024 * 1024
+    UPLOAD_SESSION_TTL_SECONDS: int = 24 * 3600
+
+    # Image processing — responsive WebP variants generated at upload time.
+    IMAGE_VARIANT_WIDTHS: Annotated[List[int], NoDecode] = Field(default_factory=lambda: [160, 480, 1280])
+    IMAGE_VARIANT_QUALITY: int = 80
+    # Ingest re-encoding. Empty IMAGE_INGEST_FORMAT stores uploads as sent;
+    # "jpeg" (progressive) or "webp" stores an auto-oriented, metadata-free
+    # copy capped at IMAGE_INGEST_MAX_EDGE px (0 = no cap). Originals are
+    # kept under IMAGE_ORIGINALS_DIR when it is set, otherwise discarded.
+    IMAGE_INGEST_FORMAT: str = ""
+    IMAGE_INGEST_QUALITY: int = 85
+    IMAGE_INGEST_MAX_EDGE: int = 3840
+    IMAGE_ORIGINALS_DIR: str = ""
+    # Process pool for decode/resize, its admission queue, and the thread
+    # pool used for upload file I/O. See app/workers.py.
+    IMAGE_WORKERS: int = 2
+    IMAGE_MAX_PENDING: int = 32
+    IMAGE_IO_THREADS: int = 4
+
+    # Near-duplicate detection: max Hamming distance between 64-bit dHashes.
+    IMAGE_DUPLICATE_DISTANCE: int = 6
+
+    # On-demand resize cache (GET /api/images/{id}?w=&h=&fmt=).
+    IMAGE_CACHE_DIR: str = "./cache/images"
+    IMAGE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # Orphaned file GC (app/file_gc.py). Files younger than the grace period
+    # are never collected; an interval of 0 disables the scheduled run.
+    GC_GRACE_SECONDS: int = 3600
+    GC_INTERVAL_SECONDS: int = 0
+
+    # Backups. An incremental that would make its chain (full + incrementals)
+    # longer than this is compacted into a synthetic full backup instead.
+    BACKUP_MAX_CHAIN_LENGTH: int = 7
+    # Default format for new backups: "zip" archives, "repository" snapshots
+    # deduplicated into a shared chunk store under BACKUP_DIR, or "tar.zst"
+    # archives (needs the optional zstandard package).
+    BACKUP_FORMAT: str = "zip"
+    # Repository pack files are sealed once they reach this size.
+    BACKUP_PACK_BYTES: int = 64 * 1024 * 1024
+    # Compression of JSON entries (zlib level 0-9) and of "tar.zst" backups
+    # (zstd level 1-22). Already-compressed media is always stored as is.
+    BACKUP_DEFLATE_LEVEL: int = 6
+    BACKUP_ZSTD_LEVEL: int = 3
+
+    # Whole-instance snapshots (app/instance_snapshot.py). The database is
+    # copied this many pages per step, and a step that finds it locked is
+    # retried after the sleep. Keep SNAPSHOT_DIR on the same filesystem as
+    # UPLOAD_DIR so uploads can be hard-linked rather than copied.
+    SNAPSHOT_DIR: str = "./snapshots"
+    SNAPSHOT_PAGES_PER_STEP: int = 256
+    SNAPSHOT_STEP_SLEEP_SECONDS: float = 0.05
+
+    # /uploads serving. "x-accel-redirect" (nginx) or "x-sendfile" hands the
+    # file transfer to the front-end; empty serves the bytes from the app.
+    UPLOADS_SENDFILE_MODE: str = ""
+    UPLOADS_ACCEL_PREFIX: str = "/_uploads/"
 
     # Logging / debug
     LOG_LEVEL: str = "INFO"
     DEBUG: bool = False
 
-    @field_validator("CORS_ORIGINS", "CORS_ALLOW_METHODS", "CORS_ALLOW_HEADERS", mode="before")
+    @field_validator(
+        "CORS_ORIGINS", "CORS_ALLOW_METHODS", "CORS_ALLOW_HEADERS", "IMAGE_VARIANT_WIDTHS", mode="before"
+    )
     @classmethod
     def _split_csv(cls, value):
         if isinstance(value, str):
             return [item.strip() for item in value.split(",") if item.strip()]
         return value
 
+    @field_validator("IMAGE_INGEST_FORMAT")
+    @classmethod
+    def _check_ingest_format(cls, value: str) -> str:
+        value = value.strip().lower()
+        if value not in ("", "jpeg", "webp"):
+            raise ValueError("IMAGE_INGEST_FORMAT must be empty, 'jpeg' or 'webp'")
+        return value
+
+    @field_validator("BACKUP_FORMAT")
+    @classmethod
+    def _check_backup_format(cls, value: str) -> str:
+        value = value.strip().lower()
+        if value not in ("zip", "repository", "tar.zst"):
+            raise ValueError("BACKUP_FORMAT must be 'zip', 'repository' or 'tar.zst'")
+        return value
+
+    @field_validator("BACKUP_DEFLATE_LEVEL")
+    @classmethod
+    def _check_deflate_level(cls, value: int) -> int:
+        if not 0 <= value <= 9:
+            raise ValueError("BACKUP_DEFLATE_LEVEL must be between 0 and 9")
+        return value
+
+    @field_validator("BACKUP_ZSTD_LEVEL")
+    @classmethod
+    def _check_zstd_level(cls, value: int) -> int:
+        if not 1 <= value <= 22:
+            raise ValueError("BACKUP_ZSTD_LEVEL must be between 1 and 22")
+        return value
+
+    @field_validator("UPLOADS_SENDFILE_MODE")
+    @classmethod
+    def _check_sendfile_mode(cls, value: str) -> str:
+        value = value.strip().lower()
+        if value not in ("", "x-accel-redirect", "x-sendfile"):
+            raise ValueError("UPLOADS_SENDFILE_MODE must be empty, 'x-accel-redirect' or 'x-sendfile'")
+        return value
+
     def model_post_init(self, _context) -> None:
         if not self.BYPASS_AUTH:
             if not self.SECRET_KEY or self.SECRET_KEY in _PLACEHOLDER_SECRETS:
@@ -80,6 +182,22 @@ class Settings(BaseSettings):
     def backup_path(self) -> Path:
         return Path(self.BACKUP_DIR).resolve()
 
+    @property
+    def snapshot_path(self) -> Path:
+        return Path(self.SNAPSHOT_DIR).resolve()
+
+    @property
+    def image_cache_path(self) -> Path:
+        return Path(self.IMAGE_CACHE_DIR).resolve()
+
+    @property
+    def originals_path(self) -> Optional[Path]:
+        return Path(self.IMAGE_ORIGINALS_DIR).resolve() if self.IMAGE_ORIGINALS_DIR else None
+
+    @property
+    def catalog_path(self) -> Path:
+        return Path(self.CATALOG_PATH).resolve()
+
 
 @lru_cache
 def get_settings() -> Settings:
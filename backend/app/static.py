@@ -0,0 +1,96 @@
+"""Static file serving for ``/uploads``.
+
+Every file under ``UPLOAD_DIR`` is written once under a name that is never
+reused (blobs are named by their SHA-256, legacy uploads by timestamp and
+UUID), so responses can be cached by browsers and proxies indefinitely:
+
+- ``Cache-Control: public, max-age=31536000, immutable``
+- a strong ``ETag``: the digest in the filename for blob files and their
+  variants, otherwise one derived from inode, size and mtime
+- ``Range`` / ``If-Range`` handled by Starlette's ``FileResponse``
+
+Paths with a component starting with ``.`` are never served: those are
+in-flight uploads (``.upload-*.part``, ``.session-*.part``), restore
+staging areas and the redirect stubs under ``.legacy``.
+
+Flat pre-2.1 upload names that ``scripts/migrate_upload_layout.py`` has
+moved into the fan-out answer with a permanent redirect to their new path.
+
+With ``UPLOADS_SENDFILE_MODE`` set, the application only resolves the path
+and answers with an ``X-Accel-Redirect`` (nginx) or ``X-Sendfile``
+(Apache / lighttpd) header, leaving the front-end to stream the bytes.
+"""
+
+import os
+import re
+from email.utils import formatdate
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from . import storage
+from .settings import settings
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}(_\d+)?$")
+
+
+def strong_etag(path: str, stat_result: os.stat_result) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _DIGEST_NAME.match(stem):
+        return f'"{stem}"'
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+class UploadFiles(StaticFiles):
+    """``StaticFiles`` with immutable caching and optional sendfile offload."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if any(part.startswith(".") for part in re.split(r"[/\\]", path)):
+            raise HTTPException(status_code=404)
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            if exc.status_code != 404:
+                raise
+            relpath = await anyio.to_thread.run_sync(storage.resolve_legacy, path)
+            if relpath is None:
+                raise
+            url = f"{scope.get('root_path', '')}/{quote(relpath)}"
+            return RedirectResponse(url, status_code=301, headers={"Cache-Control": CACHE_CONTROL})
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = {
+            "Cache-Control": CACHE_CONTROL,
+            "ETag": strong_etag(str(full_path), stat_result),
+        }
+        mode = settings.UPLOADS_SENDFILE_MODE
+        if mode:
+            headers["Last-Modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+            response = Response(status_code=status_code, headers=headers)
+            response.headers.update(self._sendfile_headers(mode, str(full_path)))
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _sendfile_headers(self, mode: str, full_path: str) -> dict:
+        if mode == "x-sendfile":
+            return {"X-Sendfile": full_path}
+        root = os.path.realpath(str(self.directory))
+        relpath = os.path.relpath(full_path, root).replace(os.sep, "/")
+        prefix = settings.UPLOADS_ACCEL_PREFIX.rstrip("/")
+        return {"X-Accel-Redirect": f"{prefix}/{quote(relpath)}"}
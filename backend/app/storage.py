@@ -0,0 +1,357 @@
+"""Content-addressed image blob store.
+
+Image bytes live once per SHA-256 digest under a two-level fan-out inside
+``UPLOAD_DIR``::
+
+    uploads/ab/cd/abcd1234...<ext>
+
+``models.ImageBlob`` tracks how many ``ItemImage`` rows point at each blob.
+Callers adjust reference counts inside their own transaction and unlink the
+returned paths only after that transaction commits, so a rollback never
+leaves a row pointing at a deleted file.
+
+When ingest re-encoding is on and ``IMAGE_ORIGINALS_DIR`` is set, the bytes
+as uploaded are kept there under the same fan-out, named by the digest of
+the stored blob, and share that blob's lifetime.
+
+Restores stream blobs into a private directory under ``STAGING_DIR`` and
+only move them into the store just before they commit, so the file GC
+never sees them as unreferenced while a long restore is running.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+URL_PREFIX = "uploads"
+# Keeps IN (...) lists under SQLite's bound parameter limit.
+QUERY_BATCH = 500
+# Redirect stubs for files moved out of the pre-2.1 flat layout, so their old
+# ``/uploads/<name>`` URLs keep resolving. See ``app/upload_layout.py``.
+LEGACY_STUB_DIR = ".legacy"
+# Per-restore working directories; each holds STAGING_LOCK while in use.
+STAGING_DIR = ".staging"
+STAGING_LOCK = ".lock"
+
+try:  # flock is POSIX-only; elsewhere staging areas are aged out like temp files
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+def upload_dir() -> str:
+    return str(settings.upload_path)
+
+
+def blob_relpath(sha256: str, extension: str) -> str:
+    """Path of a blob relative to ``UPLOAD_DIR``."""
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}{extension}")
+
+
+def public_path(relpath: str) -> str:
+    """The ``file_path`` form stored on rows and served under ``/uploads``."""
+    return os.path.join(URL_PREFIX, relpath)
+
+
+def absolute_path(file_path: str) -> str:
+    """Resolve a stored ``uploads/...`` path to its location on disk."""
+    relpath = file_path
+    prefix = URL_PREFIX + os.sep
+    if relpath.startswith(prefix):
+        relpath = relpath[len(prefix):]
+    return os.path.join(upload_dir(), relpath)
+
+
+@contextmanager
+def staging_area(prefix: str = "restore-") -> Iterator[str]:
+    """A private directory under ``UPLOAD_DIR/.staging`` that the file GC
+    leaves alone while it is held; removed with its contents on exit."""
+    root = os.path.join(upload_dir(), STAGING_DIR)
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=prefix, dir=root)
+    lock = open(os.path.join(path, STAGING_LOCK), "w")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        lock.close()
+
+
+def staging_in_use(path: str) -> bool:
+    """Whether the staging area at ``path`` is held by a running restore."""
+    if fcntl is None:
+        return False
+    try:
+        lock = open(os.path.join(path, STAGING_LOCK), "a")
+    except FileNotFoundError:
+        return False
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+
+def publish_staged(staging: str) -> int:
+    """Move every file staged under ``staging`` to the same relative path in
+    the store; returns how many were moved."""
+    moved = 0
+    for directory, _, files in os.walk(staging):
+        for name in files:
+            if name == STAGING_LOCK:
+                continue
+            src = os.path.join(directory, name)
+            target = os.path.join(upload_dir(), os.path.relpath(src, staging))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(src, target)
+            moved += 1
+    return moved
+
+
+def legacy_stub_path(name: str) -> str:
+    """Where the redirect target for the flat upload ``name`` is recorded."""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return os.path.join(upload_dir(), LEGACY_STUB_DIR, digest[:2], digest[2:4], name)
+
+
+def write_legacy_stub(name: str, relpath: str) -> None:
+    stub = legacy_stub_path(name)
+    os.makedirs(os.path.dirname(stub), exist_ok=True)
+    tmp = f"{stub}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(relpath)
+    os.replace(tmp, stub)
+
+
+def resolve_legacy(name: str) -> Optional[str]:
+    """The current path (relative to ``UPLOAD_DIR``) of a relocated flat upload."""
+    if not name or "/" in name or os.sep in name or name.startswith("."):
+        return None
+    try:
+        with open(legacy_stub_path(name), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def upload_session_path(kind: str, session_id) -> str:
+    """Where a resumable upload's chunks are assembled (see routers/uploads.py)."""
+    directory = upload_dir() if kind == "image" else str(settings.backup_path)
+    return os.path.join(directory, f".session-{session_id}.part")
+
+
+def original_path(sha256: str, extension: str) -> Optional[str]:
+    """Cold-storage location of the upload behind blob ``sha256``, if enabled."""
+    root = settings.originals_path
+    if root is None:
+        return None
+    return os.path.join(str(root), blob_relpath(sha256, extension))
+
+
+def _original_files(sha256: str) -> List[str]:
+    root = settings.originals_path
+    if root is None:
+        return []
+    directory = os.path.join(str(root), sha256[:2], sha256[2:4])
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in names if name.startswith(sha256)]
+
+
+def acquire_blob(
+    db: Session,
+    sha256: str,
+    extension: str,
+    size_bytes: int,
+) -> models.ImageBlob:
+    """Add one reference to the blob for ``sha256``, creating its row if new.
+
+    The caller is responsible for the file being present at the blob's path
+    and for committing.
+    """
+    relpath = blob_relpath(sha256, extension)
+    # A single upsert keeps concurrent uploads of the same bytes from racing
+    # between "does the row exist" and "insert it".
+    stmt = sqlite_insert(models.ImageBlob).values(
+        sha256=sha256,
+        filename=os.path.basename(relpath),
+        file_path=public_path(relpath),
+        size_bytes=size_bytes,
+        ref_count=1,
+        created_at=datetime.utcnow(),
+    ).on_conflict_do_update(
+        index_elements=[models.ImageBlob.sha256],
+        set_={"ref_count": models.ImageBlob.ref_count + 1},
+    )
+    db.execute(stmt)
+    blob = db.get(models.ImageBlob, sha256)
+    db.refresh(blob)
+    return blob
+
+
+def acquire_blobs(db: Session, refs: Dict[str, Tuple[str, int, int]]) -> Dict[str, models.ImageBlob]:
+    """``acquire_blob`` in bulk: ``refs`` maps a digest to its extension,
+    size and number of references to add. One executemany upsert."""
+    if not refs:
+        return {}
+    now = datetime.utcnow()
+    rows = []
+    for sha256, (extension, size_bytes, count) in refs.items():
+        relpath = blob_relpath(sha256, extension)
+        rows.append({
+            "sha256": sha256,
+            "filename": os.path.basename(relpath),
+            "file_path": public_path(relpath),
+            "size_bytes": size_bytes,
+            "ref_count": count,
+            "created_at": now,
+        })
+    stmt = sqlite_insert(models.ImageBlob)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.ImageBlob.sha256],
+            set_={"ref_count": models.ImageBlob.ref_count + stmt.excluded.ref_count},
+        ),
+        rows,
+    )
+    blobs = {}
+    digests = list(refs)
+    for start in range(0, len(digests), QUERY_BATCH):
+        batch = digests[start:start + QUERY_BATCH]
+        for blob in db.query(models.ImageBlob).filter(models.ImageBlob.sha256.in_(batch)).populate_existing():
+            blobs[blob.sha256] = blob
+    return blobs
+
+
+def find_blob(db: Session, sha256: str) -> Optional[models.ImageBlob]:
+    """Return the blob for ``sha256`` if its row and file both exist."""
+    blob = db.get(models.ImageBlob, sha256)
+    if blob is not None and os.path.exists(absolute_path(blob.file_path)):
+        return blob
+    return None
+
+
+def _blob_files(blob: models.ImageBlob) -> List[str]:
+    return [absolute_path(blob.file_path)] + [
+        absolute_path(path) for path in (blob.variants or {}).values()
+    ] + _original_files(blob.sha256)
+
+
+def _image_files(image: models.ItemImage) -> List[str]:
+    return [absolute_path(image.file_path)] + [
+        absolute_path(path) for path in (image.variants or {}).values()
+    ]
+
+
+def release_images(db: Session, images: Iterable[models.ItemImage]) -> List[str]:
+    """Drop the blob references held by ``images`` and delete the rows.
+
+    Returns the files that are no longer referenced; unlink them with
+    ``remove_files`` once the transaction has committed.
+    """
+    doomed: List[str] = []
+    for image in images:
+        if image.blob_sha256 is None:
+            # Pre-blob upload: the file belongs to this row alone.
+            doomed.extend(_image_files(image))
+        else:
+            db.query(models.ImageBlob).filter(models.ImageBlob.sha256 == image.blob_sha256).update(
+                {models.ImageBlob.ref_count: models.ImageBlob.ref_count - 1},
+                synchronize_session=False,
+            )
+            blob = db.get(models.ImageBlob, image.blob_sha256)
+            if blob is not None:
+                db.refresh(blob)
+                if blob.ref_count <= 0:
+                    doomed.extend(_blob_files(blob))
+                    db.delete(blob)
+        db.delete(image)
+    db.flush()
+    return doomed
+
+
+def release_item_images(db: Session, item_ids) -> List[str]:
+    """``release_images`` for every image attached to the given items."""
+    images = db.query(models.ItemImage).filter(models.ItemImage.item_id.in_(item_ids)).all()
+    return release_images(db, images)
+
+
+def release_owner_images(db: Session, owner_id) -> List[str]:
+    """``release_item_images`` for all of a user's items, in bulk.
+
+    Blob references are dropped with one executemany and the image rows
+    with one delete, so the cost does not grow with per-row round trips.
+    """
+    item_ids = select(models.Item.id).where(models.Item.owner_id == owner_id)
+    counts: Dict[str, int] = {}
+    doomed: List[str] = []
+    for image in db.query(models.ItemImage).filter(models.ItemImage.item_id.in_(item_ids)).yield_per(QUERY_BATCH):
+        if image.blob_sha256 is None:
+            doomed.extend(_image_files(image))
+        else:
+            counts[image.blob_sha256] = counts.get(image.blob_sha256, 0) + 1
+    if counts:
+        blobs = models.ImageBlob.__table__
+        db.execute(
+            update(blobs)
+            .where(blobs.c.sha256 == bindparam("digest"))
+            .values(ref_count=blobs.c.ref_count - bindparam("count")),
+            [{"digest": digest, "count": count} for digest, count in counts.items()],
+        )
+    digests = list(counts)
+    for start in range(0, len(digests), QUERY_BATCH):
+        batch = digests[start:start + QUERY_BATCH]
+        dead = db.query(models.ImageBlob).filter(
+            models.ImageBlob.sha256.in_(batch), models.ImageBlob.ref_count <= 0
+        ).populate_existing()
+        for blob in dead:
+            doomed.extend(_blob_files(blob))
+            db.delete(blob)
+    db.query(models.ItemImage).filter(models.ItemImage.item_id.in_(item_ids)).delete(synchronize_session=False)
+    db.flush()
+    return doomed
+
+
+def remove_files(paths: Iterable[str]) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as exc:
+                logger.warning("could not remove image file %s: %s", path, exc)
+
+
+def remove_unreferenced(db: Session, paths: Iterable[str]) -> None:
+    """``remove_files``, skipping blob files that are referenced again.
+
+    A restore can release a blob and re-acquire the same digest within one
+    transaction; its files must survive the post-commit cleanup.
+    """
+    paths = list(paths)
+    digests = list({os.path.basename(path)[:64] for path in paths})
+    live = set()
+    for start in range(0, len(digests), QUERY_BATCH):
+        batch = digests[start:start + QUERY_BATCH]
+        for blob in db.query(models.ImageBlob).filter(models.ImageBlob.sha256.in_(batch)):
+            live.update(_blob_files(blob))
+    remove_files(path for path in paths if path not in live)
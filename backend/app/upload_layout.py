@@ -0,0 +1,151 @@
+"""Move pre-2.1 flat uploads into the content-addressed fan-out.
+
+Images uploaded before the blob store sit directly in ``UPLOAD_DIR`` as
+``<timestamp>_<uuid>.<ext>`` (plus ``<stem>_<width>.webp`` variants) and have
+no ``blob_sha256``. ``migrate_legacy_images`` converts them batch by batch:
+
+1. hash the batch's files in a thread pool;
+2. hard-link (or copy) each file to ``ab/cd/<sha256><ext>`` and record a
+   redirect stub for its old name;
+3. point the rows at their blobs and commit;
+4. unlink the old flat files.
+
+The old files are only removed after the commit, so an interrupted run
+leaves every row pointing at a file that exists. Selection is on
+``blob_sha256 IS NULL``, so re-running resumes where the last run stopped.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple, Union
+
+from sqlalchemy import String, type_coerce
+from sqlalchemy.orm import Session
+
+from . import imaging, models, storage
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class MigrationReport:
+    migrated: int = 0
+    skipped: int = 0
+    bytes_moved: int = 0
+
+
+def _hash_file(path: str) -> Union[Tuple[int, str], Exception]:
+    try:
+        sha = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_BYTES):
+                size += len(chunk)
+                sha.update(chunk)
+        return size, sha.hexdigest()
+    except OSError as exc:
+        return exc
+
+
+def _link(source: str, target: str) -> None:
+    """Make ``target`` a second name for ``source``; copy across filesystems."""
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.tmp"
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+
+
+def _migrate_image(
+    db: Session,
+    image: models.ItemImage,
+    size: int,
+    digest: str,
+    doomed: List[str],
+) -> None:
+    old_path = storage.absolute_path(image.file_path)
+    old_variants = {width: storage.absolute_path(path) for width, path in (image.variants or {}).items()}
+    extension = os.path.splitext(image.filename or old_path)[1].lower() or ".bin"
+
+    existing = storage.find_blob(db, digest)
+    if existing is None:
+        relpath = storage.blob_relpath(digest, extension)
+        _link(old_path, os.path.join(storage.upload_dir(), relpath))
+        directory = os.path.dirname(relpath)
+        variants = {}
+        for width, path in old_variants.items():
+            if not os.path.exists(path):
+                continue
+            variant_relpath = os.path.join(directory, imaging.variant_filename(os.path.basename(relpath), int(width)))
+            _link(path, os.path.join(storage.upload_dir(), variant_relpath))
+            variants[width] = storage.public_path(variant_relpath)
+    blob = storage.acquire_blob(db, digest, extension, size)
+    if existing is None:
+        blob.variants = variants
+
+    new_relpath = blob.file_path[len(storage.URL_PREFIX) + 1:]
+    storage.write_legacy_stub(os.path.basename(old_path), new_relpath)
+    for width, path in old_variants.items():
+        target = (blob.variants or {}).get(width, blob.file_path)
+        storage.write_legacy_stub(os.path.basename(path), target[len(storage.URL_PREFIX) + 1:])
+
+    image.filename = blob.filename
+    image.file_path = blob.file_path
+    image.variants = blob.variants
+    image.blob_sha256 = digest
+    doomed.append(old_path)
+    doomed.extend(old_variants.values())
+
+
+def migrate_legacy_images(
+    db: Session,
+    batch_size: int = 200,
+    workers: int = 4,
+    progress: Optional[Callable[[MigrationReport], None]] = None,
+) -> MigrationReport:
+    """Convert every flat-layout ``ItemImage`` into a blob reference."""
+    report = MigrationReport()
+    last_id = ""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-layout") as pool:
+        while True:
+            # Keyset pagination on the raw id string; comparing through the
+            # UUID type would coerce the "" starting key into a random id.
+            batch = (
+                db.query(models.ItemImage)
+                .filter(
+                    models.ItemImage.blob_sha256.is_(None),
+                    type_coerce(models.ItemImage.id, String) > last_id,
+                )
+                .order_by(models.ItemImage.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = str(batch[-1].id)
+            paths = [storage.absolute_path(image.file_path) for image in batch]
+            doomed: List[str] = []
+            for image, path, result in zip(batch, paths, pool.map(_hash_file, paths)):
+                if isinstance(result, Exception):
+                    report.skipped += 1
+                    logger.warning("skipping image %s (%s): %s", image.id, path, result)
+                    continue
+                size, digest = result
+                _migrate_image(db, image, size, digest, doomed)
+                report.migrated += 1
+                report.bytes_moved += size
+            db.commit()
+            storage.remove_unreferenced(db, doomed)
+            if progress is not None:
+                progress(report)
+    return report
@@ -0,0 +1,132 @@
+"""Executors for blocking work triggered from async request handlers.
+
+Two pools keep the event loop free:
+
+- ``cpu_pool``: a process pool for Pillow decode / resize / transcode, sized
+  by ``IMAGE_WORKERS``. Admission is bounded by ``IMAGE_MAX_PENDING`` queued
+  jobs; past that, ``WorkerBusy`` is raised so the caller can shed load
+  (the upload endpoints answer 503) instead of queueing without limit.
+- ``io_pool``: a thread pool for file writes, renames and header probes,
+  sized by ``IMAGE_IO_THREADS``. It is never saturated on purpose, since work handed
+  to it is usually half of an operation that must finish.
+
+Both pools are created lazily and expose counters through ``stats()``.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerBusy(RuntimeError):
+    """Raised when a bounded pool has no room for another job."""
+
+
+class _Pool:
+    def __init__(self, name: str, factory: Callable[[int], Executor], workers: Callable[[], int],
+                 max_pending: Optional[Callable[[], int]] = None):
+        self.name = name
+        self._factory = factory
+        self._workers = workers
+        self._max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._factory(self._workers())
+            return self._executor
+
+    def _capacity(self) -> Optional[int]:
+        if self._max_pending is None:
+            return None
+        return self._workers() + self._max_pending()
+
+    def saturated(self) -> bool:
+        capacity = self._capacity()
+        return capacity is not None and self.in_flight >= capacity
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        capacity = self._capacity()
+        with self._lock:
+            if capacity is not None and self.in_flight >= capacity:
+                self.rejected += 1
+                raise WorkerBusy(f"{self.name} pool is saturated ({self.in_flight} jobs in flight)")
+            self.in_flight += 1
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        workers = self._workers()
+        with self._lock:
+            return {
+                "workers": workers,
+                "running": min(self.in_flight, workers),
+                "queued": max(self.in_flight - workers, 0),
+                "max_pending": self._max_pending() if self._max_pending else None,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+cpu_pool = _Pool(
+    "image-cpu",
+    lambda n: ProcessPoolExecutor(max_workers=n),
+    lambda: settings.IMAGE_WORKERS,
+    lambda: settings.IMAGE_MAX_PENDING,
+)
+io_pool = _Pool(
+    "image-io",
+    lambda n: ThreadPoolExecutor(max_workers=n, thread_name_prefix="image-io"),
+    lambda: settings.IMAGE_IO_THREADS,
+)
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await cpu_pool.run(fn, *args, **kwargs)
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await io_pool.run(fn, *args, **kwargs)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {"cpu": cpu_pool.stats(), "io": io_pool.stats()}
+
+
+def shutdown() -> None:
+    cpu_pool.shutdown()
+    io_pool.shutdown()
@@ -0,0 +1,85 @@
+"""Fill in display metadata for images uploaded before it was extracted.
+
+Usage:
+    python scripts/backfill_image_metadata.py [--batch-size 200] [--workers 4]
+
+Selects ``item_images`` rows with no BlurHash or perceptual hash in id
+order, decodes each file in a process pool, and writes width, height, byte
+size, format, dominant color, BlurHash and dHash back one committed batch
+at a time. Safe to interrupt and
+re-run: finished rows are skipped. Rows whose file is missing or unreadable
+are reported and left NULL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Maintenance job: no auth involved, skip the SECRET_KEY fail-fast.
+os.environ.setdefault("BYPASS_AUTH", "true")
+
+from sqlalchemy import String, or_, type_coerce  # noqa: E402
+
+from app import imaging, models, storage  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+
+
+def _describe(path: str):
+    try:
+        return imaging.describe_image(path)
+    except Exception as exc:  # noqa: BLE001 - report and keep going
+        return exc
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    updated = failed = 0
+    last_id = ""
+    db = SessionLocal()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            while True:
+                # Keyset pagination on the raw id string; comparing through the
+                # UUID type would coerce the "" starting key into a random id.
+                batch = (
+                    db.query(models.ItemImage)
+                    .filter(
+                        or_(models.ItemImage.blurhash.is_(None), models.ItemImage.phash.is_(None)),
+                        type_coerce(models.ItemImage.id, String) > last_id,
+                    )
+                    .order_by(models.ItemImage.id)
+                    .limit(args.batch_size)
+                    .all()
+                )
+                if not batch:
+                    break
+                last_id = str(batch[-1].id)
+                paths = [storage.absolute_path(image.file_path) for image in batch]
+                for image, path, result in zip(batch, paths, pool.map(_describe, paths)):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        print(f"[backfill] skipped {image.id} ({path}): {result}")
+                        continue
+                    for name in models.IMAGE_METADATA_FIELDS:
+                        setattr(image, name, result[name])
+                    updated += 1
+                db.commit()
+                print(f"[backfill] {updated} updated, {failed} skipped so far")
+    finally:
+        db.close()
+    print(f"[backfill] done: {updated} updated, {failed} skipped")
+
+
+if __name__ == "__main__":
+    main()
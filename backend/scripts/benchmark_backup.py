@@ -0,0 +1,107 @@
+"""Compare backup throughput and size across compression modes.
+
+Usage:
+    python scripts/benchmark_backup.py --email you@example.com [--levels 1,6,9] [--keep DIR]
+
+Writes one user's backup once per mode into a scratch directory and prints
+wall time, MB/s of archive content and the output/content ratio:
+
+- ``zip deflate-all``: every entry deflated at level 6 (the behaviour
+  before per-entry compression).
+- ``zip L<n>``: images stored, JSON deflated at level ``n``.
+- ``tar.zst L<n>``: zstd-compressed tar at ``BACKUP_ZSTD_LEVEL``, when the
+  ``zstandard`` package is installed.
+
+Only reads the database and ``UPLOAD_DIR``; nothing is recorded.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Maintenance job: no auth involved, skip the SECRET_KEY fail-fast.
+os.environ.setdefault("BYPASS_AUTH", "true")
+
+from app import backup_archive, models  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.settings import settings  # noqa: E402
+
+
+def _run(label: str, write, path: str, content_bytes: int) -> None:
+    started = time.perf_counter()
+    write(path)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    rate = content_bytes / elapsed / 1e6 if elapsed else float("inf")
+    ratio = size / content_bytes if content_bytes else 0.0
+    print(f"{label:<20} {elapsed:8.2f}s {size / 1e6:10.1f} MB {rate:9.1f} MB/s {ratio:7.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--email", required=True, help="user whose inventory is backed up")
+    parser.add_argument("--levels", default="1,6,9", help="deflate levels to try for JSON")
+    parser.add_argument("--keep", help="write archives here instead of a deleted temp dir")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+
+    db = SessionLocal()
+    work_dir = args.keep or tempfile.mkdtemp(prefix="backup-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        user = db.query(models.User).filter(models.User.email == args.email).first()
+        if user is None:
+            parser.error(f"no user with email {args.email}")
+
+        def write_zip(path: str) -> None:
+            backup_archive.write_archive(db, user.id, path)
+
+        # Uncompressed content size, from a throwaway run.
+        probe = os.path.join(work_dir, "probe.zip")
+        write_zip(probe)
+        with zipfile.ZipFile(probe) as zf:
+            content_bytes = sum(info.file_size for info in zf.infolist())
+        os.remove(probe)
+        print(f"{content_bytes / 1e6:.1f} MB of content for {args.email}")
+        print(f"{'mode':<20} {'time':>9} {'output':>13} {'rate':>14} {'ratio':>7}")
+
+        saved = backup_archive.PRECOMPRESSED_EXTENSIONS, settings.BACKUP_DEFLATE_LEVEL
+        try:
+            backup_archive.PRECOMPRESSED_EXTENSIONS, settings.BACKUP_DEFLATE_LEVEL = (), 6
+            _run("zip deflate-all", write_zip, os.path.join(work_dir, "deflate-all.zip"), content_bytes)
+        finally:
+            backup_archive.PRECOMPRESSED_EXTENSIONS, settings.BACKUP_DEFLATE_LEVEL = saved
+        try:
+            for level in levels:
+                settings.BACKUP_DEFLATE_LEVEL = level
+                _run(f"zip L{level}", write_zip, os.path.join(work_dir, f"policy-{level}.zip"), content_bytes)
+        finally:
+            settings.BACKUP_DEFLATE_LEVEL = saved[1]
+
+        if backup_archive.zstandard is None:
+            print("tar.zst skipped: the zstandard package is not installed")
+        else:
+            _run(
+                f"tar.zst L{settings.BACKUP_ZSTD_LEVEL}",
+                lambda path: backup_archive.write_tar_archive(db, user.id, path),
+                os.path.join(work_dir, "backup.tar.zst"),
+                content_bytes,
+            )
+    finally:
+        db.close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
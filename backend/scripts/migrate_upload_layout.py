@@ -0,0 +1,55 @@
+"""Move flat pre-2.1 uploads into the sharded ``ab/cd/<sha256>`` layout.
+
+Usage:
+    python scripts/migrate_upload_layout.py [--batch-size 200] [--workers 4]
+
+Hashes legacy files in parallel, links them into the content-addressed blob
+store, rewrites ``item_images.file_path`` one committed batch at a time and
+then removes the flat copies. Old ``/uploads/<name>`` URLs keep working
+through redirect stubs. Safe to interrupt and re-run: migrated rows are
+skipped. Rows whose file is missing are reported and left as they are.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Maintenance job: no auth involved, skip the SECRET_KEY fail-fast.
+os.environ.setdefault("BYPASS_AUTH", "true")
+
+from app.database import SessionLocal  # noqa: E402
+from app.upload_layout import migrate_legacy_images  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="hashing threads")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    db = SessionLocal()
+    try:
+        report = migrate_legacy_images(
+            db,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            progress=lambda r: print(f"[layout] {r.migrated} migrated, {r.skipped} skipped so far"),
+        )
+    finally:
+        db.close()
+    print(
+        f"[layout] done: {report.migrated} migrated ({report.bytes_moved} bytes), "
+        f"{report.skipped} skipped in {time.monotonic() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Take a consistent snapshot of the whole instance for disaster recovery.
+
+Usage:
+    python scripts/snapshot_instance.py [--dest DIR] [--keep N]
+
+Copies the SQLite database with the online backup API and hard-links the
+upload store (and ``IMAGE_ORIGINALS_DIR``) into a new directory under
+``SNAPSHOT_DIR``, as described in ``app/instance_snapshot.py``. Safe to run
+against a live server: writers are held up for at most one copy step.
+With ``--keep`` only the newest N snapshots are kept afterwards.
+
+To restore, stop the server and copy ``whis.db`` over the database file
+and ``uploads/`` over ``UPLOAD_DIR``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Maintenance job: no auth involved, skip the SECRET_KEY fail-fast.
+os.environ.setdefault("BYPASS_AUTH", "true")
+
+from app import instance_snapshot  # noqa: E402
+from app.database import engine  # noqa: E402
+from app.settings import settings  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dest", default=str(settings.snapshot_path), help="directory to write snapshots into")
+    parser.add_argument("--keep", type=int, default=0, help="delete all but the newest N snapshots")
+    args = parser.parse_args()
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        print(f"\r[snapshot] database {total - remaining}/{total} pages", end="", flush=True)
+
+    started = time.perf_counter()
+    report = instance_snapshot.create_snapshot(engine, args.dest, progress=progress)
+    print()
+    print(
+        f"[snapshot] {report.path} in {time.perf_counter() - started:.1f}s: "
+        f"{report.database_bytes} database bytes, {report.linked} files linked, "
+        f"{report.reflinked} reflinked, {report.copied} copied ({report.copied_bytes} bytes)"
+    )
+    if args.keep:
+        for path in instance_snapshot.prune_snapshots(args.keep, args.dest):
+            print(f"[snapshot] removed {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,675 @@
+import io
+import json
+import os
+import threading
+import uuid
+import zipfile
+
+import pytest
+from PIL import Image
+
+
+def _png_bytes(color="orange", size=(24, 24)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _seed(client, auth_headers, count=3):
+    items = []
+    for n in range(count):
+        item = client.post(
+            "/api/items/",
+            json={"name": f"Thing {n}", "category": "Misc", "location": "Attic"},
+            headers=auth_headers,
+        ).json()
+        # The first two items share one blob.
+        color = "orange" if n < 2 else "teal"
+        client.post(
+            f"/api/items/{item['id']}/images",
+            files={"file": (f"t{n}.png", _png_bytes(color), "image/png")},
+            headers=auth_headers,
+        )
+        items.append(item)
+    return items
+
+
+def test_backup_streams_archive_without_staging(client, auth_headers):
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    response = client.post("/api/backups", headers=auth_headers)
+    assert response.status_code == 202, response.text
+    backup = client.get(f"/api/backups/{response.json()['id']}/progress", headers=auth_headers).json()
+    assert backup["status"] == "completed"
+    assert backup["item_count"] == 3
+    assert backup["image_count"] == 3
+
+    with zipfile.ZipFile(response.json()["file_path"]) as zf:
+        names = zf.namelist()
+        data = json.loads(zf.read("data.json"))
+    assert names[0] == "data.json"
+    assert len([name for name in names if name.startswith("images/")]) == 2
+    assert sorted(item["name"] for item in data["items"]) == ["Thing 0", "Thing 1", "Thing 2"]
+    assert data["version"] == "1.0"
+    assert backup["size_bytes"] == os.path.getsize(response.json()["file_path"])
+    leftovers = [name for name in os.listdir(settings.backup_path) if not name.endswith(".zip")]
+    assert leftovers == []
+
+
+def test_backup_stores_images_and_deflates_json(client, auth_headers, monkeypatch):
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    monkeypatch.setattr(settings, "BACKUP_DEFLATE_LEVEL", 9)
+    created = client.post("/api/backups", headers=auth_headers).json()
+    with zipfile.ZipFile(created["file_path"]) as zf:
+        modes = {info.filename: info.compress_type for info in zf.infolist()}
+    assert modes["data.json"] == zipfile.ZIP_DEFLATED
+    assert modes["manifest.json"] == zipfile.ZIP_DEFLATED
+    assert {mode for name, mode in modes.items() if name.startswith("images/")} == {zipfile.ZIP_STORED}
+
+
+def test_tar_zst_backup_round_trip(client, auth_headers):
+    from app import backup_archive
+
+    _seed(client, auth_headers)
+    response = client.post("/api/backups?format=tar.zst", headers=auth_headers)
+    if backup_archive.zstandard is None:
+        assert response.status_code == 400
+        return
+    created = response.json()
+    assert created["filename"].endswith(".tar.zst")
+    assert client.get(f"/api/backups/{created['id']}/progress", headers=auth_headers).json()["status"] == "completed"
+    restored = client.post(f"/api/backups/{created['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert restored["images_restored"] == 3
+
+
+def test_backup_restore_round_trip(client, auth_headers):
+    _seed(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    client.post(
+        "/api/items/",
+        json={"name": "Added later", "category": "Misc", "location": "Attic"},
+        headers=auth_headers,
+    )
+
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert restored["images_restored"] == 3
+    items = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert sorted(item["name"] for item in items) == ["Thing 0", "Thing 1", "Thing 2"]
+
+
+def test_backup_runs_as_background_job_with_progress(client, auth_headers, monkeypatch):
+    from app import backup_jobs
+
+    _seed(client, auth_headers)
+    seen = []
+    original = backup_jobs.backup_archive.write_archive
+
+    def watched(db, owner_id, zip_path, progress=None, **kwargs):
+        seen.append(progress is not None)
+        return original(db, owner_id, zip_path, progress=progress, **kwargs)
+
+    monkeypatch.setattr(backup_jobs.backup_archive, "write_archive", watched)
+    monkeypatch.setattr(backup_jobs, "PROGRESS_INTERVAL_SECONDS", 0)
+
+    created = client.post("/api/backups", headers=auth_headers)
+    assert created.status_code == 202
+    job = created.json()
+    # The response is sent before the archive is written.
+    assert job["status"] == "in_progress"
+    assert job["item_count"] == 3
+    assert job["total_bytes"] > 0
+    assert seen == [True]
+
+    progress = client.get(f"/api/backups/{job['id']}/progress", headers=auth_headers).json()
+    assert progress["status"] == "completed"
+    assert progress["progress_items"] == 3
+    assert progress["progress_bytes"] == progress["total_bytes"]
+
+    with client.stream("GET", f"/api/backups/{job['id']}/events", headers=auth_headers) as events:
+        assert events.headers["content-type"].startswith("text/event-stream")
+        body = "".join(events.iter_text())
+    assert body.startswith("event: progress\n")
+    assert '"status": "completed"' in body
+
+
+def test_in_progress_backup_blocks_new_jobs_and_restore(client, auth_headers, db_session, user):
+    from app import backup_jobs, models
+
+    running = models.Backup(owner_id=user.id, status="in_progress", filename="x.zip", file_path="/nope/x.zip",
+                            size_bytes=0, item_count=0, image_count=0)
+    db_session.add(running)
+    db_session.commit()
+
+    assert client.post("/api/backups", headers=auth_headers).status_code == 409
+    assert client.post(f"/api/backups/{running.id}/restore", headers=auth_headers).status_code == 409
+    assert client.delete(f"/api/backups/{running.id}", headers=auth_headers).status_code == 409
+
+    assert backup_jobs.fail_interrupted(db_session) == 1
+    db_session.refresh(running)
+    assert running.status == "failed"
+
+
+def _names(zip_path):
+    with zipfile.ZipFile(zip_path) as zf:
+        data = json.loads(zf.read("data.json"))
+        images = [name for name in zf.namelist() if name.startswith("images/")]
+    return sorted(item["name"] for item in data["items"]), images
+
+
+def test_incremental_backup_chain_restore_and_compaction(client, auth_headers, monkeypatch):
+    from app.settings import settings
+
+    items = _seed(client, auth_headers)
+    full = client.post("/api/backups", headers=auth_headers).json()
+
+    client.put(f"/api/items/{items[0]['id']}", json={"name": "Thing 0 renamed"}, headers=auth_headers)
+    client.delete(f"/api/items/{items[2]['id']}", headers=auth_headers)
+    added = client.post(
+        "/api/items/",
+        json={"name": "New thing", "category": "Misc", "location": "Attic"},
+        headers=auth_headers,
+    ).json()
+    client.post(
+        f"/api/items/{added['id']}/images",
+        files={"file": ("new.png", _png_bytes("navy"), "image/png")},
+        headers=auth_headers,
+    )
+
+    created = client.post("/api/backups?mode=incremental", headers=auth_headers).json()
+    incremental = client.get(f"/api/backups/{created['id']}/progress", headers=auth_headers).json()
+    assert incremental["status"] == "completed"
+    assert created["kind"] == "incremental"
+    assert created["parent_id"] == full["id"]
+    names, images = _names(created["file_path"])
+    # Only the renamed and the new item, and only the new photo.
+    assert names == ["New thing", "Thing 0 renamed"]
+    assert len(images) == 1
+
+    # The parent cannot be deleted while the incremental depends on it.
+    assert client.delete(f"/api/backups/{full['id']}", headers=auth_headers).status_code == 409
+
+    client.post("/api/items/", json={"name": "Scratch", "category": "Misc", "location": "Attic"},
+                headers=auth_headers)
+    restored = client.post(f"/api/backups/{created['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert restored["images_restored"] == 3
+    listed = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert sorted(item["name"] for item in listed) == ["New thing", "Thing 0 renamed", "Thing 1"]
+
+    # A chain longer than the limit is folded into a synthetic full backup.
+    monkeypatch.setattr(settings, "BACKUP_MAX_CHAIN_LENGTH", 2)
+    client.post("/api/items/", json={"name": "Latest", "category": "Misc", "location": "Attic"},
+                headers=auth_headers)
+    compacted = client.post("/api/backups?mode=incremental", headers=auth_headers).json()
+    listed = {b["id"]: b for b in client.get("/api/backups", headers=auth_headers).json()["backups"]}
+    assert listed[compacted["id"]]["kind"] == "full"
+    assert listed[compacted["id"]]["parent_id"] is None
+    names, images = _names(compacted["file_path"])
+    assert names == ["Latest", "New thing", "Thing 0 renamed", "Thing 1"]
+    assert len(images) == 2
+
+
+def test_merge_chain_streams_data_json(client, auth_headers, monkeypatch, tmp_path):
+    from app import backup_archive
+
+    items = _seed(client, auth_headers)
+    full = client.post("/api/backups", headers=auth_headers).json()
+    client.put(f"/api/items/{items[1]['id']}", json={"name": "Thing 1 renamed"}, headers=auth_headers)
+    incremental = client.post("/api/backups?mode=incremental", headers=auth_headers).json()
+
+    read = zipfile.ZipFile.read
+
+    def no_whole_reads(self, name, *args, **kwargs):
+        assert name != "data.json", "data.json loaded whole"
+        return read(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", no_whole_reads)
+    merged = str(tmp_path / "merged.zip")
+    stats = backup_archive.merge_chain([full["file_path"], incremental["file_path"]], merged)
+    monkeypatch.undo()
+    assert (stats.item_count, stats.image_count) == (3, 3)
+    names, images = _names(merged)
+    assert names == ["Thing 0", "Thing 1 renamed", "Thing 2"]
+    assert len(images) == 2
+
+
+def test_chunker_boundaries_follow_content():
+    import random
+
+    from app.backup_repository import MAX_CHUNK, Chunker
+
+    data = random.Random(7).randbytes(3 * 1024 * 1024)
+
+    def chunks(payload, piece):
+        out = []
+        chunker = Chunker(out.append)
+        for start in range(0, len(payload), piece):
+            chunker.write(payload[start:start + piece])
+        chunker.close()
+        return out
+
+    whole = chunks(data, len(data))
+    assert b"".join(whole) == data
+    assert len(whole) > 1 and max(map(len, whole)) <= MAX_CHUNK
+    assert chunks(data, 65537) == whole
+    # An insertion near the start only disturbs the chunks around it.
+    shifted = chunks(b"inserted" + data, len(data))
+    assert set(whole[1:]) <= set(shifted)
+
+
+def test_repository_backups_share_chunks_and_prune_on_delete(client, auth_headers, db_session):
+    from app import models, security
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    first = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    first = client.get(f"/api/backups/{first['id']}/progress", headers=auth_headers).json()
+    assert first["status"] == "completed", first["error_message"]
+    stored = client.get("/api/backups/repository", headers=auth_headers).json()
+    assert stored["snapshots"] == 1 and stored["packs"] == 1
+
+    client.post("/api/items/", json={"name": "Lamp", "category": "Misc", "location": "Hall"},
+                headers=auth_headers)
+    second = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    second = client.get(f"/api/backups/{second['id']}/progress", headers=auth_headers).json()
+    assert second["status"] == "completed"
+    # Only the new JSON chunks were stored; the images were already there.
+    assert second["size_bytes"] < first["size_bytes"]
+    after = client.get("/api/backups/repository", headers=auth_headers).json()
+    assert after["stored_bytes"] == stored["stored_bytes"] + second["size_bytes"]
+    assert after["logical_bytes"] > after["stored_bytes"]
+    bob = models.User(email="bob@example.com", username="bob", hashed_password="x", is_active=True)
+    db_session.add(bob)
+    db_session.commit()
+    bob_headers = {"Authorization": f"Bearer {security.create_access_token(data={'sub': 'bob'})}"}
+    assert client.get("/api/backups/repository", headers=bob_headers).json() == {
+        "snapshots": 0, "packs": 0, "chunks": 0, "stored_bytes": 0, "logical_bytes": 0,
+    }
+
+    third = client.post("/api/backups?format=repository&mode=incremental", headers=auth_headers).json()
+    assert (third["kind"], third["storage"]) == ("full", "repository")
+
+    downloaded = client.get(f"/api/backups/{first['id']}/download", headers=auth_headers)
+    assert downloaded.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(downloaded.content)) as zf:
+        assert len([name for name in zf.namelist() if name.startswith("images/")]) == 2
+        assert zf.testzip() is None
+    # Streamed as it is rebuilt, with no scratch copy under BACKUP_DIR.
+    assert not any(name.startswith("temp_download_") for name in os.listdir(settings.backup_path))
+
+    restored = client.post(f"/api/backups/{first['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert restored["images_restored"] == 3
+
+    assert client.delete(f"/api/backups/{first['id']}", headers=auth_headers).status_code == 200
+    assert client.delete(f"/api/backups/{second['id']}", headers=auth_headers).status_code == 200
+    assert client.delete(f"/api/backups/{third['id']}", headers=auth_headers).status_code == 200
+    db_session.expire_all()
+    assert db_session.query(models.BackupChunk).count() == 0
+    assert db_session.query(models.BackupPack).count() == 0
+    repository = os.path.join(str(settings.backup_path), "repository")
+    assert [files for _, _, files in os.walk(repository) if files] == []
+
+
+def test_snapshot_delete_runs_off_the_event_loop(client, auth_headers, monkeypatch):
+    import asyncio
+
+    from app import backup_repository
+
+    _seed(client, auth_headers, count=1)
+    backup = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    delete_snapshot = backup_repository.delete_snapshot
+    loops = []
+
+    def record(db, target):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return delete_snapshot(db, target)
+
+    monkeypatch.setattr(backup_repository, "delete_snapshot", record)
+    assert client.delete(f"/api/backups/{backup['id']}", headers=auth_headers).status_code == 200
+    assert loops == [None]
+
+
+def test_snapshot_stream_holds_off_a_sibling_prune(client, auth_headers, testing_session_local):
+    from app import backup_repository, models
+
+    items = _seed(client, auth_headers)
+    first = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    client.put(f"/api/items/{items[0]['id']}", json={"name": "Renamed"}, headers=auth_headers)
+    second = client.post("/api/backups?format=repository", headers=auth_headers).json()
+
+    reader, pruner = testing_session_local(), testing_session_local()
+    try:
+        stream = backup_repository.iter_zip(reader, reader.get(models.Backup, uuid.UUID(second["id"])))
+        parts = [next(stream)]
+        prune = threading.Thread(
+            target=backup_repository.delete_snapshot,
+            args=(pruner, pruner.get(models.Backup, uuid.UUID(first["id"]))),
+        )
+        prune.start()
+        prune.join(0.5)
+        # The prune (and any repack of the packs being read) waits for the stream.
+        assert prune.is_alive()
+        parts.extend(stream)
+        prune.join(5)
+        assert not prune.is_alive()
+    finally:
+        reader.close()
+        pruner.close()
+    with zipfile.ZipFile(io.BytesIO(b"".join(parts))) as zf:
+        assert zf.testzip() is None
+        names = sorted(item["name"] for item in json.loads(zf.read("data.json"))["items"])
+    assert names == ["Renamed", "Thing 1", "Thing 2"]
+
+
+def test_deleting_snapshot_without_manifest_recounts_chunk_refs(client, auth_headers, db_session):
+    from app import models
+
+    items = _seed(client, auth_headers)
+    first = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    client.put(f"/api/items/{items[0]['id']}", json={"name": "Renamed"}, headers=auth_headers)
+    second = client.post("/api/backups?format=repository", headers=auth_headers).json()
+    os.remove(db_session.get(models.Backup, first["id"]).file_path)
+
+    assert client.delete(f"/api/backups/{first['id']}", headers=auth_headers).status_code == 200
+    db_session.expire_all()
+    # Only the second snapshot's chunks are left, each referenced once.
+    assert {chunk.ref_count for chunk in db_session.query(models.BackupChunk)} == {1}
+    assert client.delete(f"/api/backups/{second['id']}", headers=auth_headers).status_code == 200
+    db_session.expire_all()
+    assert db_session.query(models.BackupChunk).count() == 0
+
+
+def test_iter_items_parses_across_read_boundaries(monkeypatch):
+    from app import backup_archive, backup_restore
+
+    monkeypatch.setattr(backup_archive, "READ_BYTES", 7)
+    items = [{"id": n, "name": f"Café {n}", "price": 12345.5, "images": []} for n in range(20)]
+    document = json.dumps({"version": "1.0", "items": items, "trailer": [1, 2]}, ensure_ascii=False)
+    header = {}
+    assert list(backup_restore.iter_items(io.BytesIO(document.encode()), header)) == items
+    assert header == {"version": "1.0", "trailer": [1, 2]}
+    assert list(backup_restore.iter_items(io.BytesIO(b'{"items": []}'))) == []
+
+    truncated = io.BytesIO(document.encode()[:-40])
+    try:
+        list(backup_restore.iter_items(truncated))
+    except ValueError as e:
+        assert "data.json" in str(e)
+    else:
+        raise AssertionError("truncated data.json was accepted")
+
+
+def test_restore_streams_from_archive_in_batches(client, auth_headers, monkeypatch):
+    from app import backup_restore
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    monkeypatch.setattr(backup_restore, "RESTORE_BATCH_SIZE", 2)
+    extracted = []
+    monkeypatch.setattr(zipfile.ZipFile, "extractall", lambda *args, **kwargs: extracted.append(args))
+    threads = []
+    restore_archive = backup_restore.restore_archive
+
+    def off_loop(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return restore_archive(*args, **kwargs)
+
+    monkeypatch.setattr(backup_restore, "restore_archive", off_loop)
+
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert restored["images_restored"] == 3
+    assert extracted == []
+    assert len(threads) == 1 and threads[0].startswith("image-io")
+    assert not any(name.startswith("restore_") for name in os.listdir(settings.backup_path))
+    items = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert sorted(len(item["images"]) for item in items) == [1, 1, 1]
+    # The two items that shared a blob still share it.
+    paths = sorted(item["images"][0]["file_path"] for item in items)
+    assert len(set(paths)) == 2
+
+
+def _variant_files(client, auth_headers):
+    from app import storage
+
+    items = client.get("/api/items", headers=auth_headers).json()["items"]
+    variants = [image["variants"] for item in items for image in item["images"]]
+    assert variants and all(sorted(v or {}) == ["160", "480"] for v in variants)
+    paths = {storage.absolute_path(path) for v in variants for path in v.values()}
+    assert all(os.path.exists(path) for path in paths)
+    return paths
+
+
+def _seed_photo(client, auth_headers, name="Photo"):
+    item = client.post(
+        "/api/items/",
+        json={"name": name, "category": "Misc", "location": "Attic"},
+        headers=auth_headers,
+    ).json()
+    client.post(
+        f"/api/items/{item['id']}/images",
+        files={"file": ("photo.png", _png_bytes(size=(1200, 900)), "image/png")},
+        headers=auth_headers,
+    )
+    return item
+
+
+def test_replace_restore_keeps_image_variants(client, auth_headers):
+    _seed_photo(client, auth_headers)
+    before = _variant_files(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers)
+    assert restored.status_code == 200, restored.text
+    assert _variant_files(client, auth_headers) == before
+
+
+def test_restore_renders_variants_for_blobs_it_creates(client, auth_headers):
+    item = _seed_photo(client, auth_headers)
+    before = _variant_files(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    client.delete(f"/api/items/{item['id']}", headers=auth_headers)
+    assert not any(os.path.exists(path) for path in before)
+
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers)
+    assert restored.status_code == 200, restored.text
+    assert _variant_files(client, auth_headers) == before
+
+
+def test_restore_stages_blobs_out_of_reach_of_gc(client, auth_headers, monkeypatch):
+    from app import backup_restore, file_gc, storage
+
+    item = _seed_photo(client, auth_headers)
+    before = _variant_files(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    client.delete(f"/api/items/{item['id']}", headers=auth_headers)
+    dead = os.path.join(storage.upload_dir(), storage.STAGING_DIR, "restore-dead")
+    os.makedirs(dead)
+    open(os.path.join(dead, "leftover.png"), "wb").close()
+
+    stage_items = backup_restore.stage_items
+
+    def gc_mid_restore(*args, **kwargs):
+        # A restore slower than the grace period: the GC runs while the
+        # archive's blobs are written but no row refers to them yet.
+        # The test engine has one shared connection, so the sweep reads
+        # through the restore's session rather than closing a second one.
+        db, totals = args[0], stage_items(*args, **kwargs)
+        report = file_gc.GCReport()
+        file_gc.collect_uploads(db, storage.upload_dir(), 0, report)
+        file_gc.collect_staging(storage.upload_dir(), 0, report)
+        return totals
+
+    monkeypatch.setattr(backup_restore, "stage_items", gc_mid_restore)
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers)
+    assert restored.status_code == 200, restored.text
+    assert _variant_files(client, auth_headers) == before
+    assert os.listdir(os.path.join(storage.upload_dir(), storage.STAGING_DIR)) == []
+
+
+def test_merge_restore_replaces_only_changed_images(client, auth_headers):
+    item = _seed_photo(client, auth_headers)
+    before = _variant_files(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    client.post(
+        f"/api/items/{item['id']}/images",
+        files={"file": ("extra.png", _png_bytes("teal"), "image/png")},
+        headers=auth_headers,
+    )
+
+    merged = client.post(f"/api/backups/{backup['id']}/restore?mode=merge", headers=auth_headers).json()
+    assert (merged["items_restored"], merged["images_restored"]) == (1, 0)
+    listed = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert [len(entry["images"]) for entry in listed] == [1]
+    assert _variant_files(client, auth_headers) == before
+
+
+def test_merge_restore_keeps_ids_and_writes_only_changes(client, auth_headers):
+    items = _seed(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+
+    client.put(f"/api/items/{items[0]['id']}", json={"name": "Renamed"}, headers=auth_headers)
+    client.delete(f"/api/items/{items[2]['id']}", headers=auth_headers)
+    extra = client.post("/api/items/", json={"name": "Extra", "category": "Misc", "location": "Attic"},
+                        headers=auth_headers).json()
+
+    merged = client.post(f"/api/backups/{backup['id']}/restore?mode=merge", headers=auth_headers).json()
+    assert merged["items_restored"] == 2
+    assert merged["items_unchanged"] == 1
+    assert merged["items_deleted"] == 0
+    assert merged["images_restored"] == 1
+    listed = {item["id"]: item for item in client.get("/api/items", headers=auth_headers).json()["items"]}
+    assert set(listed) == {items[0]["id"], items[1]["id"], items[2]["id"], extra["id"]}
+    assert listed[items[0]["id"]]["name"] == "Thing 0"
+    assert len(listed[items[2]["id"]]["images"]) == 1
+
+    again = client.post(f"/api/backups/{backup['id']}/restore?mode=merge&delete_missing=true",
+                        headers=auth_headers).json()
+    assert again["items_restored"] == 0
+    assert again["items_unchanged"] == 3
+    assert again["items_deleted"] == 1
+    listed = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert sorted(item["id"] for item in listed) == sorted(item["id"] for item in items)
+
+
+def test_replace_restore_stages_then_swaps_and_keeps_live_data_on_failure(client, auth_headers, monkeypatch):
+    from app import backup_restore, models
+
+    _seed(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    client.post("/api/items/", json={"name": "Keep me", "category": "Misc", "location": "Attic"},
+                headers=auth_headers)
+
+    live_during_staging = []
+    verify = backup_restore._verify_staging
+
+    def watched(db, expected):
+        live_during_staging.append(db.query(models.Item).count())
+        verify(db, expected)
+
+    monkeypatch.setattr(backup_restore, "_verify_staging", watched)
+
+    def broken(db, refs):
+        raise RuntimeError("disk on fire")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(backup_restore.storage, "acquire_blobs", broken)
+        failed = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers)
+    assert failed.status_code == 500
+    # The swap had already released and deleted the live items; all rolled back.
+    items = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert len(items) == 4
+    assert sum(len(item["images"]) for item in items) == 3
+
+    restored = client.post(f"/api/backups/{backup['id']}/restore", headers=auth_headers).json()
+    assert restored["items_restored"] == 3
+    assert live_during_staging == [4, 4]
+    items = client.get("/api/items", headers=auth_headers).json()["items"]
+    assert sorted(item["name"] for item in items) == ["Thing 0", "Thing 1", "Thing 2"]
+
+
+def test_upload_validates_from_summary_without_extracting(client, auth_headers, monkeypatch):
+    from app import backup_restore
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    backup = client.post("/api/backups", headers=auth_headers).json()
+    with open(os.path.join(settings.backup_path, backup["filename"]), "rb") as f:
+        archive = f.read()
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert json.loads(zf.read("summary.json"))["item_count"] == 3
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("data.json parsed despite summary.json")
+
+    monkeypatch.setattr(backup_restore, "iter_items", no_parse)
+    monkeypatch.setattr(zipfile.ZipFile, "extractall", no_parse)
+    summarize_archive = backup_restore.summarize_archive
+    threads = []
+
+    def off_loop(path):
+        threads.append(threading.current_thread().name)
+        return summarize_archive(path)
+
+    monkeypatch.setattr(backup_restore, "summarize_archive", off_loop)
+    uploaded = client.post(
+        "/api/backups/upload",
+        headers=auth_headers,
+        files={"file": ("copy.zip", archive, "application/zip")},
+    )
+    assert uploaded.status_code == 200
+    assert (uploaded.json()["item_count"], uploaded.json()["image_count"]) == (3, 3)
+    assert len(threads) == 1 and threads[0].startswith("image-io")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("data.json", json.dumps({"items": []}))
+        zf.writestr("../escape.txt", "x")
+    rejected = client.post(
+        "/api/backups/upload",
+        headers=auth_headers,
+        files={"file": ("evil.zip", buffer.getvalue(), "application/zip")},
+    )
+    assert rejected.status_code == 400
+    assert "unsafe entry" in rejected.json()["detail"]
+
+
+def test_instance_snapshot_copies_database_and_links_uploads(client, auth_headers, engine, tmp_path, monkeypatch):
+    import sqlite3
+
+    from app import instance_snapshot
+    from app.settings import settings
+
+    _seed(client, auth_headers)
+    monkeypatch.setattr(settings, "SNAPSHOT_PAGES_PER_STEP", 1)
+    pages = []
+    report = instance_snapshot.create_snapshot(
+        engine, str(tmp_path), progress=lambda status, remaining, total: pages.append(total - remaining)
+    )
+    assert len(pages) > 1 and pages[-1] > pages[0]
+    assert report.linked > 0 and report.copied == 0
+    assert instance_snapshot.list_snapshots(str(tmp_path)) == [report.path]
+
+    copy = sqlite3.connect(os.path.join(report.path, "whis.db"))
+    try:
+        assert copy.execute("SELECT COUNT(*) FROM items").fetchone() == (3,)
+        (blob_path,) = copy.execute("SELECT file_path FROM image_blobs LIMIT 1").fetchone()
+    finally:
+        copy.close()
+    relpath = blob_path.split("/", 1)[1]
+    live = os.stat(os.path.join(settings.upload_path, relpath))
+    linked = os.stat(os.path.join(report.path, "uploads", relpath))
+    assert (live.st_ino, live.st_dev) == (linked.st_ino, linked.st_dev)
+
+    with pytest.raises(ValueError):
+        instance_snapshot.create_snapshot(engine, str(settings.upload_path / "snapshots"))
@@ -0,0 +1,53 @@
+import json
+
+from app import catalog
+
+
+def _write_dump(tmp_path):
+    source = tmp_path / "products.jsonl"
+    rows = [
+        {"upc": "024543026282", "title": "Alien (DVD)", "brand": "Fox", "category": "Media"},
+        {"ean": "9780441013593", "name": "Dune", "manufacturer": "Ace"},
+        {"upc": "024543026282", "title": "Duplicate row is ignored"},
+        {"upc": "not-a-code", "title": "Skipped"},
+    ]
+    rows += [{"gtin": f"{n:013d}", "name": f"Filler {n}"} for n in range(1, 50)]
+    source.write_text("\n".join(json.dumps(row) for row in rows))
+    return source
+
+
+def test_build_and_lookup_catalog(tmp_path):
+    output = tmp_path / "products.idx"
+    # A tiny run size forces several spill runs through the k-way merge.
+    count = catalog.build_catalog(str(_write_dump(tmp_path)), str(output), run_size=7)
+    assert count == 51
+
+    product_catalog = catalog.ProductCatalog(str(output))
+    try:
+        # UPC-A and its zero-padded EAN-13 form resolve to the same entry.
+        assert product_catalog.lookup("024543026282") == {
+            "name": "Alien (DVD)",
+            "brand": "Fox",
+            "category": "Media",
+        }
+        assert product_catalog.lookup("0024543026282")["name"] == "Alien (DVD)"
+        assert product_catalog.lookup("9780441013593")["brand"] == "Ace"
+        assert product_catalog.lookup("0000000000049")["name"] == "Filler 49"
+        assert product_catalog.lookup("1234567890128") is None
+    finally:
+        product_catalog.close()
+
+
+def test_catalog_endpoint(client, auth_headers, tmp_path, monkeypatch):
+    from app import settings as _settings
+
+    output = tmp_path / "products.idx"
+    catalog.build_catalog(str(_write_dump(tmp_path)), str(output))
+    monkeypatch.setattr(_settings.settings, "CATALOG_PATH", str(output))
+
+    resp = client.get("/api/items/catalog/9780441013593", headers=auth_headers)
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["name"] == "Dune"
+
+    missing = client.get("/api/items/catalog/1234567890128", headers=auth_headers)
+    assert missing.status_code == 404
@@ -0,0 +1,64 @@
+import io
+import os
+
+from PIL import Image
+
+
+def _write(path: str, size: int) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_gc_removes_only_unreferenced_files(client, auth_headers, db_session):
+    from app import file_gc, models, storage
+    from app.settings import settings
+
+    item = client.post(
+        "/api/items/",
+        json={"name": "Lamp", "category": "Furniture", "location": "Hall"},
+        headers=auth_headers,
+    ).json()
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), color="green").save(buf, format="PNG")
+    image = client.post(
+        f"/api/items/{item['id']}/images",
+        files={"file": ("lamp.png", buf.getvalue(), "image/png")},
+        headers=auth_headers,
+    ).json()
+    kept_blob = storage.absolute_path(image["file_path"])
+
+    upload_dir = storage.upload_dir()
+    backup_dir = str(settings.backup_path)
+    orphan_blob = _write(os.path.join(upload_dir, "ff", "ee", "ffee" + "0" * 60 + ".png"), 100)
+    stale_part = _write(os.path.join(upload_dir, ".upload-abc.part"), 10)
+    orphan_legacy = _write(os.path.join(upload_dir, "20240101_000000_dead.png"), 20)
+    kept_legacy = _write(os.path.join(upload_dir, "20240101_000000_live.png"), 30)
+    db_session.add(models.ItemImage(
+        item_id=item["id"], filename="20240101_000000_live.png", file_path="uploads/20240101_000000_live.png"
+    ))
+    db_session.commit()
+    stale_restore = _write(os.path.join(backup_dir, "restore_someone", "data.json"), 40)
+    orphan_zip = _write(os.path.join(backup_dir, "lost.zip"), 50)
+
+    dry = file_gc.collect(db_session, grace_seconds=0, dry_run=True)
+    assert dry.reclaimed_bytes >= 220
+    assert os.path.exists(orphan_blob)
+
+    report = file_gc.collect(db_session, grace_seconds=0)
+    assert report.reclaimed_bytes >= 220
+    assert report.removed_dirs >= 1
+    for path in (orphan_blob, stale_part, orphan_legacy, stale_restore, orphan_zip):
+        assert not os.path.exists(path)
+    assert os.path.exists(kept_blob)
+    assert os.path.exists(kept_legacy)
+
+
+def test_gc_respects_grace_period(db_session):
+    from app import file_gc, storage
+
+    fresh = _write(os.path.join(storage.upload_dir(), ".upload-fresh.part"), 10)
+    file_gc.collect(db_session, grace_seconds=3600)
+    assert os.path.exists(fresh)
+    os.remove(fresh)
@@ -1,4 +1,5 @@
 import io
+import os
 
 from PIL import Image
 
@@ -30,6 +31,57 @@ def test_upload_png_succeeds(client, auth_headers):
     assert resp.json()["filename"].endswith(".png")
 
 
+def test_upload_generates_webp_variants(client, auth_headers):
+    from app import storage
+
+    item_id = _new_item(client, auth_headers)
+    resp = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", _png_bytes(size=(600, 300)), "image/png")},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert (body["width"], body["height"], body["format"]) == (600, 300, "PNG")
+    assert body["dominant_color"] == "#ff0000"
+    assert len(body["blurhash"]) == 28
+    variants = body["variants"]
+    # 1280 is wider than the source, so only the downscaled widths exist.
+    assert sorted(variants) == ["160", "480"]
+    thumb = storage.absolute_path(variants["160"])
+    with Image.open(thumb) as img:
+        assert img.format == "WEBP"
+        assert img.size == (160, 80)
+
+    deleted = client.delete(f"/api/images/{resp.json()['id']}", headers=auth_headers)
+    assert deleted.status_code == 200
+    assert not os.path.exists(thumb)
+
+
+def test_identical_uploads_share_one_blob(client, auth_headers):
+    from app import storage
+
+    payload = _png_bytes(size=(200, 100))
+    first_item, second_item = _new_item(client, auth_headers), _new_item(client, auth_headers)
+    uploads = [
+        client.post(
+            f"/api/items/{item_id}/images",
+            files={"file": ("receipt.png", payload, "image/png")},
+            headers=auth_headers,
+        ).json()
+        for item_id in (first_item, second_item)
+    ]
+    assert uploads[0]["file_path"] == uploads[1]["file_path"]
+    on_disk = storage.absolute_path(uploads[0]["file_path"])
+    assert os.path.exists(on_disk)
+
+    # The blob survives until its last reference is gone.
+    assert client.delete(f"/api/images/{uploads[0]['id']}", headers=auth_headers).status_code == 200
+    assert os.path.exists(on_disk)
+    assert client.delete(f"/api/items/{second_item}", headers=auth_headers).status_code == 200
+    assert not os.path.exists(on_disk)
+
+
 def test_upload_non_image_rejected(client, auth_headers):
     item_id = _new_item(client, auth_headers)
     resp = client.post(
@@ -53,6 +105,7 @@ def test_upload_empty_rejected(client, auth_headers):
 
 def test_upload_oversize_rejected(client, auth_headers, monkeypatch):
     from app import settings as _settings
+    from app.routers.images import UPLOAD_DIR
 
     monkeypatch.setattr(_settings.settings, "MAX_UPLOAD_BYTES", 128)
     item_id = _new_item(client, auth_headers)
@@ -64,3 +117,417 @@ def test_upload_oversize_rejected(client, auth_headers, monkeypatch):
         headers=auth_headers,
     )
     assert resp.status_code == 413
+    # The partial temp file is discarded as soon as the cap is crossed.
+    assert not [name for name in os.listdir(UPLOAD_DIR) if name.startswith(".upload-")]
+
+
+def test_upload_sheds_load_when_image_pool_is_saturated(client, auth_headers, monkeypatch):
+    from app import settings as _settings
+
+    item_id = _new_item(client, auth_headers)
+    monkeypatch.setattr(_settings.settings, "IMAGE_WORKERS", 0)
+    monkeypatch.setattr(_settings.settings, "IMAGE_MAX_PENDING", 0)
+    resp = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", _png_bytes(), "image/png")},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "5"
+
+    stats = client.get("/api/health/workers").json()
+    assert stats["cpu"]["max_pending"] == 0
+
+
+def test_batch_upload_for_one_item(client, auth_headers):
+    item_id = _new_item(client, auth_headers)
+    files = [
+        ("files", (f"photo{n}.png", _png_bytes(size=(32 + n, 32)), "image/png"))
+        for n in range(3)
+    ]
+    resp = client.post(f"/api/items/{item_id}/images/batch", files=files, headers=auth_headers)
+    assert resp.status_code == 200, resp.text
+    assert len(resp.json()) == 3
+
+    listed = client.get(f"/api/items/{item_id}/images", headers=auth_headers)
+    assert len(listed.json()) == 3
+
+
+def test_batch_upload_maps_files_to_items_and_is_atomic(client, auth_headers):
+    first_item, second_item = _new_item(client, auth_headers), _new_item(client, auth_headers)
+    resp = client.post(
+        "/api/images/batch",
+        files=[
+            ("files", ("a.png", _png_bytes(size=(40, 40)), "image/png")),
+            ("files", ("b.png", _png_bytes(size=(50, 50)), "image/png")),
+        ],
+        data={"item_ids": [first_item, second_item]},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200, resp.text
+    assert [image["item_id"] for image in resp.json()] == [first_item, second_item]
+
+    # One bad file rejects the whole batch and records nothing.
+    resp = client.post(
+        "/api/images/batch",
+        files=[
+            ("files", ("ok.png", _png_bytes(size=(60, 60)), "image/png")),
+            ("files", ("evil.png", b"not-a-real-image-payload", "image/png")),
+        ],
+        data={"item_ids": [first_item]},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 400
+    assert "evil.png" in resp.json()["detail"]
+    assert len(client.get(f"/api/items/{first_item}/images", headers=auth_headers).json()) == 1
+
+
+def test_on_demand_resize_is_cached_and_lru_bounded(client, auth_headers, monkeypatch, tmp_path):
+    from app import image_cache
+    from app import settings as _settings
+
+    monkeypatch.setattr(_settings.settings, "IMAGE_CACHE_DIR", str(tmp_path))
+    image_cache.reset()
+    item_id = _new_item(client, auth_headers)
+    image_id = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", _png_bytes(size=(400, 200)), "image/png")},
+        headers=auth_headers,
+    ).json()["id"]
+
+    resp = client.get(f"/api/images/{image_id}?w=100&fmt=jpeg", headers=auth_headers)
+    assert resp.status_code == 200, resp.text
+    assert resp.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(resp.content)) as img:
+        assert img.size == (100, 50)
+    assert image_cache.stats()["entries"] == 1
+
+    # A repeat request is a cache hit, not a second render.
+    client.get(f"/api/images/{image_id}?w=100&fmt=jpeg", headers=auth_headers)
+    assert image_cache.stats()["entries"] == 1
+
+    # With a tiny cap only the newest render is kept.
+    monkeypatch.setattr(_settings.settings, "IMAGE_CACHE_MAX_BYTES", 1)
+    client.get(f"/api/images/{image_id}?w=50", headers=auth_headers)
+    assert image_cache.stats()["entries"] == 1
+    image_cache.reset()
+
+
+def test_concurrent_resizes_render_once(monkeypatch, tmp_path):
+    import asyncio
+
+    from app import image_cache, imaging, workers
+    from app import settings as _settings
+
+    monkeypatch.setattr(_settings.settings, "IMAGE_CACHE_DIR", str(tmp_path / "cache"))
+    image_cache.reset()
+    source = tmp_path / "source.png"
+    source.write_bytes(_png_bytes(size=(300, 300)))
+    renders = []
+
+    async def fake_run_cpu(fn, *args):
+        renders.append(args)
+        await asyncio.sleep(0.05)
+        return imaging.render_resized(*args)
+
+    monkeypatch.setattr(workers, "run_cpu", fake_run_cpu)
+
+    async def burst():
+        return await asyncio.gather(
+            *(image_cache.get_resized(str(source), 64, 64, "webp") for _ in range(5))
+        )
+
+    paths = asyncio.run(burst())
+    assert len(set(paths)) == 1
+    assert len(renders) == 1
+    image_cache.reset()
+
+
+def test_cancelled_first_resize_does_not_fail_the_others(monkeypatch, tmp_path):
+    import asyncio
+
+    from app import image_cache, imaging, workers
+    from app import settings as _settings
+
+    monkeypatch.setattr(_settings.settings, "IMAGE_CACHE_DIR", str(tmp_path / "cache"))
+    image_cache.reset()
+    source = tmp_path / "source.png"
+    source.write_bytes(_png_bytes(size=(300, 300)))
+
+    async def fake_run_cpu(fn, *args):
+        await asyncio.sleep(0.05)
+        return imaging.render_resized(*args)
+
+    monkeypatch.setattr(workers, "run_cpu", fake_run_cpu)
+
+    async def abandon_first():
+        first = asyncio.ensure_future(image_cache.get_resized(str(source), 64, 64, "webp"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(image_cache.get_resized(str(source), 64, 64, "webp"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    path = asyncio.run(abandon_first())
+    assert os.path.exists(path)
+    assert image_cache.stats()["entries"] == 1
+    image_cache.reset()
+
+
+def test_uploads_are_served_immutable_with_etag_and_ranges(client, auth_headers):
+    item_id = _new_item(client, auth_headers)
+    image = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", _png_bytes(), "image/png")},
+        headers=auth_headers,
+    ).json()
+    url = "/" + image["file_path"]
+
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert "immutable" in resp.headers["cache-control"]
+    etag = resp.headers["etag"]
+    assert etag == f'"{os.path.splitext(image["filename"])[0]}"'
+    assert resp.headers["accept-ranges"] == "bytes"
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    partial = client.get(url, headers={"Range": "bytes=0-3"})
+    assert partial.status_code == 206
+    assert partial.content == resp.content[:4]
+
+
+def test_uploads_hide_dotfiles(client):
+    from app import storage
+
+    hidden = [
+        ".upload-abc.part",
+        ".session-00000000-0000-0000-0000-000000000000.part",
+        os.path.join(storage.STAGING_DIR, "restore-x", "ab", "blob.png"),
+    ]
+    for relpath in hidden:
+        path = os.path.join(storage.upload_dir(), relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        assert client.get("/uploads/" + relpath.replace(os.sep, "/")).status_code == 404
+        os.remove(path)
+
+
+def test_uploads_sendfile_mode_delegates_to_front_end(client, auth_headers, monkeypatch):
+    from app import settings as _settings
+
+    item_id = _new_item(client, auth_headers)
+    image = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", _png_bytes(), "image/png")},
+        headers=auth_headers,
+    ).json()
+    monkeypatch.setattr(_settings.settings, "UPLOADS_SENDFILE_MODE", "x-accel-redirect")
+
+    resp = client.get("/" + image["file_path"])
+    assert resp.status_code == 200
+    assert resp.content == b""
+    relpath = image["file_path"].split("/", 1)[1]
+    assert resp.headers["x-accel-redirect"] == f"/_uploads/{relpath}"
+    assert "immutable" in resp.headers["cache-control"]
+
+
+def test_ingest_policy_reencodes_and_keeps_original(client, auth_headers, monkeypatch, tmp_path):
+    from app import settings as _settings
+    from app import storage
+
+    monkeypatch.setattr(_settings.settings, "IMAGE_INGEST_FORMAT", "jpeg")
+    monkeypatch.setattr(_settings.settings, "IMAGE_INGEST_MAX_EDGE", 100)
+    monkeypatch.setattr(_settings.settings, "IMAGE_ORIGINALS_DIR", str(tmp_path / "originals"))
+
+    # A rotated phone photo: stored 400x200 with EXIF orientation 6 (90° CW).
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    Image.new("RGB", (400, 200), color="blue").save(buf, format="JPEG", exif=exif.tobytes())
+
+    item_id = _new_item(client, auth_headers)
+    resp = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.jpg", buf.getvalue(), "image/jpeg")},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200, resp.text
+    image = resp.json()
+    assert image["format"] == "JPEG"
+    assert (image["width"], image["height"]) == (50, 100)
+
+    stored = storage.absolute_path(image["file_path"])
+    with Image.open(stored) as img:
+        assert img.size == (50, 100)
+        assert img.info.get("progressive")
+        assert not img.getexif()
+    assert os.path.getsize(stored) < len(buf.getvalue())
+
+    digest = image["filename"][:64]
+    original = storage.original_path(digest, ".jpg")
+    with open(original, "rb") as f:
+        assert f.read() == buf.getvalue()
+
+    assert client.delete(f"/api/images/{image['id']}", headers=auth_headers).status_code == 200
+    assert not os.path.exists(stored)
+    assert not os.path.exists(original)
+
+
+def _textured_bytes(size=(256, 256), flip=False, fmt="PNG") -> bytes:
+    img = Image.linear_gradient("L").convert("RGB")
+    for x in range(0, 256, 32):
+        img.paste((200, 30, 30), (x, x, x + 24, x + 24))
+    if flip:
+        img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    img = img.resize(size)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=70)
+    return buf.getvalue()
+
+
+def test_near_duplicate_uploads_are_flagged_and_clustered(client, auth_headers):
+    from app import duplicates
+
+    duplicates.reset()
+    first_item = _new_item(client, auth_headers)
+    second_item = _new_item(client, auth_headers)
+    original = client.post(
+        f"/api/items/{first_item}/images",
+        files={"file": ("a.png", _textured_bytes(), "image/png")},
+        headers=auth_headers,
+    )
+    assert "x-possible-duplicates" not in original.headers
+    other = client.post(
+        f"/api/items/{first_item}/images",
+        files={"file": ("b.png", _textured_bytes(flip=True), "image/png")},
+        headers=auth_headers,
+    )
+    assert "x-possible-duplicates" not in other.headers
+
+    # Same photo, re-encoded at another size on a different device.
+    again = client.post(
+        f"/api/items/{second_item}/images",
+        files={"file": ("a.jpg", _textured_bytes(size=(200, 200), fmt="JPEG"), "image/jpeg")},
+        headers=auth_headers,
+    )
+    assert again.status_code == 200, again.text
+    assert again.headers["x-possible-duplicates"] == original.json()["id"]
+
+    resp = client.get("/api/images/duplicates", headers=auth_headers)
+    assert resp.status_code == 200, resp.text
+    clusters = resp.json()
+    assert len(clusters) == 1
+    assert {image["id"] for image in clusters[0]["images"]} == {original.json()["id"], again.json()["id"]}
+    duplicates.reset()
+
+
+def test_bk_tree_matches_brute_force():
+    import random
+
+    from app.duplicates import BKTree, hamming
+
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:50]]
+    tree = BKTree()
+    for index, value in enumerate(hashes):
+        tree.add(value, index)
+    for query in hashes[:20]:
+        expected = {i for i, value in enumerate(hashes) if hamming(query, value) <= 4}
+        found = {i for _, _, ids in tree.search(query, 4) for i in ids}
+        assert found == expected
+
+
+def test_duplicate_index_is_traversed_under_its_lock(db_session, monkeypatch):
+    import uuid
+
+    from app import duplicates
+
+    owner = uuid.uuid4()
+    tree = duplicates.BKTree()
+    for value in (0b0000, 0b0001, 0b1111_0000):
+        tree.add(value, uuid.uuid4())
+    index = duplicates._OwnerIndex(None, tree)
+    monkeypatch.setattr(duplicates, "owner_index", lambda *args, **kwargs: index)
+
+    # ``remember`` mutates cached trees from other threads under ``_lock``.
+    search, nodes = duplicates.BKTree.search, duplicates.BKTree.nodes
+
+    def locked_search(self, *args):
+        assert duplicates._lock.locked()
+        return search(self, *args)
+
+    def locked_nodes(self):
+        assert duplicates._lock.locked()
+        return nodes(self)
+
+    monkeypatch.setattr(duplicates.BKTree, "search", locked_search)
+    monkeypatch.setattr(duplicates.BKTree, "nodes", locked_nodes)
+    assert [len(group) for group in duplicates.clusters(None, owner, 1)] == [2]
+    # The matches are not stored images, so the live-id filter drops them.
+    assert duplicates.find_similar(db_session, owner, "0000000000000000", 1) == []
+
+
+def test_flat_uploads_migrate_to_sharded_layout(client, auth_headers, db_session):
+    from app import models, storage
+    from app.upload_layout import migrate_legacy_images
+
+    item_id = _new_item(client, auth_headers)
+    payload = _png_bytes(size=(40, 40))
+    names = ["20240101_000000_aaaa.png", "20240101_000000_bbbb.png"]
+    for name in names:
+        with open(os.path.join(storage.upload_dir(), name), "wb") as f:
+            f.write(payload)
+        db_session.add(models.ItemImage(item_id=item_id, filename=name, file_path=f"uploads/{name}"))
+    db_session.commit()
+
+    report = migrate_legacy_images(db_session, batch_size=1, workers=2)
+    assert (report.migrated, report.skipped) == (2, 0)
+
+    images = client.get(f"/api/items/{item_id}/images", headers=auth_headers).json()
+    paths = {image["file_path"] for image in images}
+    assert len(paths) == 1
+    new_path = paths.pop()
+    assert new_path.count("/") == 3
+    blob = db_session.get(models.ImageBlob, os.path.basename(new_path)[:64])
+    assert blob.ref_count == 2
+    for name in names:
+        assert not os.path.exists(os.path.join(storage.upload_dir(), name))
+        resp = client.get(f"/uploads/{name}", follow_redirects=False)
+        assert resp.status_code == 301
+        assert resp.headers["location"] == "/" + new_path
+
+    # Nothing left to do on a re-run.
+    assert migrate_legacy_images(db_session).migrated == 0
+
+
+def test_upload_is_refused_rather_than_stored_without_variants(client, auth_headers, monkeypatch):
+    from app import workers
+    from app.routers import images
+
+    item_id = _new_item(client, auth_headers)
+    photo = _png_bytes(size=(600, 300))
+
+    async def busy(*args, **kwargs):
+        raise workers.WorkerBusy("image-cpu pool is saturated")
+
+    monkeypatch.setattr(images.workers, "run_cpu", busy)
+    resp = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", photo, "image/png")},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "5"
+    monkeypatch.undo()
+
+    # Nothing was kept, so the retry renders variants for the blob.
+    retried = client.post(
+        f"/api/items/{item_id}/images",
+        files={"file": ("photo.png", photo, "image/png")},
+        headers=auth_headers,
+    )
+    assert retried.status_code == 200, retried.text
+    assert sorted(retried.json()["variants"]) == ["160", "480"]
@@ -33,3 +33,32 @@ def test_item_crud_round_trip(client, auth_headers):
 def test_list_requires_auth(client):
     resp = client.get("/api/items")
     assert resp.status_code == 401
+
+
+def test_batch_barcode_lookup(client, auth_headers):
+    for name, barcode in (("Dune", "9780441013593"), ("Alien", "024543026282")):
+        resp = client.post(
+            "/api/items/",
+            json={"name": name, "category": "Media", "location": "Den", "barcode": barcode},
+            headers=auth_headers,
+        )
+        assert resp.status_code == 200, resp.text
+
+    resp = client.post(
+        "/api/items/barcode/lookup",
+        json={"barcodes": ["024543026282", "000000000000", "9780441013593", "024543026282"]},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert sorted(i["name"] for i in body["items"]) == ["Alien", "Dune"]
+    assert body["unknown"] == ["000000000000"]
+
+
+def test_batch_barcode_lookup_caps_request_size(client, auth_headers):
+    resp = client.post(
+        "/api/items/barcode/lookup",
+        json={"barcodes": [str(n) for n in range(501)]},
+        headers=auth_headers,
+    )
+    assert resp.status_code == 422
@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import zipfile
+
+from PIL import Image
+
+CHUNK_HEADERS = {"Content-Type": "application/offset+octet-stream"}
+
+
+def _png_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), color="purple").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _patch(client, auth_headers, session_id, offset, body):
+    return client.patch(
+        f"/api/uploads/{session_id}",
+        content=body,
+        headers={**auth_headers, **CHUNK_HEADERS, "Upload-Offset": str(offset)},
+    )
+
+
+def test_resumable_image_upload(client, auth_headers):
+    item = client.post(
+        "/api/items/",
+        json={"name": "Vase", "category": "Decor", "location": "Hall"},
+        headers=auth_headers,
+    ).json()
+    data = _png_bytes()
+    created = client.post(
+        "/api/uploads",
+        json={"kind": "image", "size_bytes": len(data), "filename": "vase.png", "item_id": item["id"]},
+        headers=auth_headers,
+    )
+    assert created.status_code == 201
+    session_id = created.json()["id"]
+    assert created.headers["location"] == f"/api/uploads/{session_id}"
+    assert created.headers["upload-offset"] == "0"
+
+    half = len(data) // 2
+    first = _patch(client, auth_headers, session_id, 0, data[:half])
+    assert first.status_code == 204
+    assert first.headers["upload-offset"] == str(half)
+
+    # A client that lost track of the offset is told where to resume.
+    stale = _patch(client, auth_headers, session_id, 0, data[:half])
+    assert stale.status_code == 409
+    progress = client.head(f"/api/uploads/{session_id}", headers=auth_headers)
+    assert progress.headers["upload-offset"] == str(half)
+
+    early = client.post(f"/api/uploads/{session_id}/finalize", headers=auth_headers)
+    assert early.status_code == 409
+
+    assert _patch(client, auth_headers, session_id, half, data[half:]).status_code == 204
+    done = client.post(f"/api/uploads/{session_id}/finalize", headers=auth_headers)
+    assert done.status_code == 200, done.text
+    image = done.json()["image"]
+    assert image["item_id"] == item["id"]
+    assert image["width"] == 64
+
+    assert client.get(f"/api/uploads/{session_id}", headers=auth_headers).status_code == 404
+    assert not any(name.startswith(".session-") for name in os.listdir(os.environ["UPLOAD_DIR"]))
+
+
+def test_resumable_backup_upload_and_rejections(client, auth_headers):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("data.json", json.dumps({"items": [{"name": "Chair", "images": [{}, {}]}]}))
+    data = buf.getvalue()
+
+    wrong = client.post(
+        "/api/uploads",
+        json={"kind": "backup", "size_bytes": len(data), "filename": "export.tar"},
+        headers=auth_headers,
+    )
+    assert wrong.status_code == 400
+
+    session_id = client.post(
+        "/api/uploads",
+        json={"kind": "backup", "size_bytes": len(data), "filename": "export.zip"},
+        headers=auth_headers,
+    ).json()["id"]
+    too_long = _patch(client, auth_headers, session_id, 0, data + b"extra")
+    assert too_long.status_code == 413
+    assert too_long.headers["upload-offset"] == "0"
+    bad_type = client.patch(
+        f"/api/uploads/{session_id}",
+        content=data,
+        headers={**auth_headers, "Content-Type": "application/zip", "Upload-Offset": "0"},
+    )
+    assert bad_type.status_code == 415
+
+    assert _patch(client, auth_headers, session_id, 0, data).status_code == 204
+    done = client.post(f"/api/uploads/{session_id}/finalize", headers=auth_headers)
+    assert done.status_code == 200, done.text
+    backup = done.json()["backup"]
+    assert backup["item_count"] == 1
+    assert backup["image_count"] == 2
+    listed = client.get("/api/backups", headers=auth_headers).json()["backups"]
+    assert [b["filename"] for b in listed] == ["export.zip"]
+
+
+def test_session_locks_do_not_outlive_requests(client, auth_headers):
+    from app.routers import uploads
+
+    missing = _patch(client, auth_headers, "00000000-0000-0000-0000-000000000000", 0, b"x")
+    assert missing.status_code == 404
+    session_id = client.post(
+        "/api/uploads",
+        json={"kind": "backup", "size_bytes": 4, "filename": "export.zip"},
+        headers=auth_headers,
+    ).json()["id"]
+    assert _patch(client, auth_headers, session_id, 2, b"ab").status_code == 409
+    assert _patch(client, auth_headers, session_id, 0, b"ab").status_code == 204
+    assert uploads._locks == {}
+
+    assert client.delete(f"/api/uploads/{session_id}", headers=auth_headers).status_code == 200
+    assert uploads._locks == {}
+    assert client.head(f"/api/uploads/{session_id}", headers=auth_headers).status_code == 404
+
+
+def test_gc_expires_idle_upload_sessions(client, auth_headers, db_session, monkeypatch):
+    from app import file_gc, models, storage
+    from app.settings import settings
+
+    session_id = client.post(
+        "/api/uploads",
+        json={"kind": "backup", "size_bytes": 10, "filename": "slow.zip"},
+        headers=auth_headers,
+    ).json()["id"]
+    assert _patch(client, auth_headers, session_id, 0, b"12345").status_code == 204
+    path = storage.upload_session_path("backup", session_id)
+
+    file_gc.collect(db_session, grace_seconds=0)
+    assert os.path.exists(path)
+
+    monkeypatch.setattr(settings, "UPLOAD_SESSION_TTL_SECONDS", -1)
+    file_gc.collect(db_session, grace_seconds=0)
+    assert not os.path.exists(path)
+    assert db_session.query(models.UploadSession).count() == 0
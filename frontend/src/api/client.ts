@@ -116,6 +116,14 @@ export interface ItemImage {
   id: string;
   filename: string;
   file_path: string;
+  /** Downscaled WebP copies keyed by target width ("160", "480", "1280"). */
+  variants?: Record<string, string> | null;
+  width?: number | null;
+  height?: number | null;
+  byte_size?: number | null;
+  format?: string | null;
+  dominant_color?: string | null;
+  blurhash?: string | null;
   created_at: string;
 }
 
@@ -292,6 +300,11 @@ export interface Backup {
   created_at: string;
   status: 'completed' | 'failed' | 'in_progress' | string;
   error_message?: string;
+  progress_items?: number;
+  progress_bytes?: number;
+  total_bytes?: number | null;
+  kind?: 'full' | 'incremental' | string;
+  parent_id?: string | null;
 }
 
 export interface BackupList {
@@ -303,6 +316,8 @@ export interface RestoreResult {
   message: string;
   items_restored?: number;
   images_restored?: number;
+  items_unchanged?: number | null;
+  items_deleted?: number | null;
   errors?: string[] | null;
 }
 
@@ -311,12 +326,17 @@ export const backups = {
     const response = await apiClient.get<BackupList>('/api/backups');
     return response.data;
   },
-  create: async (): Promise<Backup> => {
-    const response = await apiClient.post<Backup>('/api/backups');
+  // Starts a background job; the returned backup is still in_progress.
+  // An incremental backup only archives what changed since the last one.
+  create: async (mode: 'full' | 'incremental' = 'full'): Promise<Backup> => {
+    const response = await apiClient.post<Backup>('/api/backups', null, { params: { mode } });
     return response.data;
   },
-  restore: async (backupId: string): Promise<RestoreResult> => {
-    const response = await apiClient.post<RestoreResult>(`/api/backups/${backupId}/restore`);
+  // 'merge' keeps item ids and only rewrites items that changed.
+  restore: async (backupId: string, mode: 'replace' | 'merge' = 'replace'): Promise<RestoreResult> => {
+    const response = await apiClient.post<RestoreResult>(`/api/backups/${backupId}/restore`, null, {
+      params: { mode },
+    });
     return response.data;
   },
   upload: async (file: File): Promise<Backup> => {
@@ -23,7 +23,7 @@ export default function ImageGallery({ images, onDelete }: ImageGalleryProps) {
       {images.map((image) => (
         <div key={image.id} className="relative group">
           <img
-            src={image.file_path}
+            src={image.variants?.['480'] ?? image.file_path}
             alt={image.filename}
             className="h-40 w-full object-cover rounded-lg"
           />
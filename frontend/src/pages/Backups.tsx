@@ -27,10 +27,25 @@ const Backups: React.FC = () => {
     loadBackups();
   }, []);
 
-  const handleCreateBackup = async () => {
+  // Backups are created in the background; refresh until none are running.
+  const running = backupList.some((backup) => backup.status === 'in_progress');
+  useEffect(() => {
+    if (!running) return;
+    const timer = window.setInterval(async () => {
+      try {
+        const response = await backups.list();
+        setBackupList(response.backups);
+      } catch (err) {
+        console.error('Error refreshing backups:', err);
+      }
+    }, 2000);
+    return () => window.clearInterval(timer);
+  }, [running]);
+
+  const handleCreateBackup = async (mode: 'full' | 'incremental' = 'full') => {
     try {
       setLoading(true);
-      await backups.create();
+      await backups.create(mode);
       await loadBackups();
     } catch (err) {
       setError('Failed to create backup');
@@ -40,17 +55,21 @@ const Backups: React.FC = () => {
     }
   };
 
-  const handleRestore = async (backupId: string) => {
-    if (!window.confirm('Are you sure you want to restore from this backup? This will replace all current data.')) {
+  const handleRestore = async (backupId: string, mode: 'replace' | 'merge' = 'replace') => {
+    const prompt = mode === 'merge'
+      ? 'Merge this backup into your inventory? Items that differ from the backup will be reverted to it.'
+      : 'Are you sure you want to restore from this backup? This will replace all current data.';
+    if (!window.confirm(prompt)) {
       return;
     }
 
     try {
       setRestoring(true);
       setSelectedBackup(backupId);
-      const result = await backups.restore(backupId);
+      const result = await backups.restore(backupId, mode);
       if (result.success) {
-        alert(`Restore completed successfully!\nItems restored: ${result.items_restored}\nImages restored: ${result.images_restored}`);
+        const unchanged = mode === 'merge' ? `\nItems unchanged: ${result.items_unchanged}` : '';
+        alert(`Restore completed successfully!\nItems restored: ${result.items_restored}\nImages restored: ${result.images_restored}${unchanged}`);
       } else {
         throw new Error(result.message);
       }
@@ -133,7 +152,14 @@ const Backups: React.FC = () => {
             Upload Backup
           </label>
           <button
-            onClick={handleCreateBackup}
+            onClick={() => handleCreateBackup('incremental')}
+            disabled={loading}
+            className="bg-indigo-500 hover:bg-indigo-600 text-white px-4 py-2 rounded disabled:opacity-50"
+          >
+            Incremental Backup
+          </button>
+          <button
+            onClick={() => handleCreateBackup('full')}
             disabled={loading}
             className="bg-blue-500 hover:bg-blue-600 text-white px-4 py-2 rounded disabled:opacity-50"
           >
@@ -180,6 +206,9 @@ const Backups: React.FC = () => {
                 </td>
                 <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
                   {backup.item_count} items, {backup.image_count} images
+                  {backup.kind === 'incremental' && (
+                    <span className="ml-2 text-xs text-gray-500">(incremental)</span>
+                  )}
                 </td>
                 <td className="px-6 py-4 whitespace-nowrap">
                   <span
@@ -201,6 +230,13 @@ const Backups: React.FC = () => {
                       >
                         {restoring && selectedBackup === backup.id ? 'Restoring...' : 'Restore'}
                       </button>
+                      <button
+                        onClick={() => handleRestore(backup.id, 'merge')}
+                        disabled={restoring}
+                        className="text-indigo-600 hover:text-indigo-900 disabled:opacity-50"
+                      >
+                        Merge
+                      </button>
                       <button
                         onClick={() => backups.download(backup.id)}
                         className="text-blue-600 hover:text-blue-900"
@@ -221,7 +257,9 @@ const Backups: React.FC = () => {
                     </span>
                   )}
                   {backup.status === 'in_progress' && (
-                    <span className="text-yellow-600">Processing...</span>
+                    <span className="text-yellow-600">
+                      Processing... {backup.progress_items ?? 0}/{backup.item_count} items
+                    </span>
                   )}
                 </td>
               </tr>
@@ -380,7 +380,7 @@ export default function Dashboard() {
               {item.images && item.images[0] && (
                 <div className="aspect-h-1 aspect-w-1 bg-gray-200">
                   <img
-                    src={`http://localhost:8000/uploads/${item.images[0].filename}`}
+                    src={`http://localhost:8000/${item.images[0].variants?.['480'] ?? item.images[0].file_path}`}
                     alt=""
                     className="h-48 w-full object-cover"
                   />